@@ -2,6 +2,9 @@ import asyncio
 import random
 import time
 
+import loop_bootstrap
+from dag import DAG
+
 async def part1(n: int) -> str:
   i = random.randint(0, 10)
   print(f"part1({n}) sleeping for {i} seconds.")
@@ -18,37 +21,47 @@ async def part2(n: int, arg: str) -> str:
   print(f"Returning part2{n, arg} == {result}.")
   return result
 
-async def chain(n: int) -> None:
+async def chain(dag: DAG, n: int) -> None:
   start = time.perf_counter()
-  p1 = await part1(n)
-  p2 = await part2(n, p1)
+  # part2 declares part1 as its input, the DAG runs part1(n) first and passes its result on
+  p2 = await dag.run("part2", n)
   end = time.perf_counter() - start
   print(f"-->Chained result{n} => {p2} (took {end:0.2f} seconds).")
 
 async def main(*args):
-  await asyncio.gather(*(chain(n) for n in args))
+  dag = DAG()
+  dag.stage("part1", part1)
+  dag.stage("part2", part2, deps=["part1"])
+  await asyncio.gather(*(chain(dag, n) for n in args))
+  # which chain set the end-to-end time, and where it spent it
+  print(dag.report())
 
 if __name__ == "__main__":
   import sys
   random.seed(444)
   args = [1, 2, 3] if len(sys.argv) == 1 else map(int, sys.argv[1:])
   start = time.perf_counter()
-  asyncio.run(main(*args))
+  loop_bootstrap.run(main(*args))
   end = time.perf_counter() - start
   print(f"Program finished in {end:0.2f} seconds.")
+  # part2 runs in its own task and waits on part1's task, so it starts one loop iteration after part1 returns
+  # and other prints of the same instant can come in between; the sleeps and timings are the same as awaiting part1 inline
   # part1(1) sleeping for 4 seconds.
   # part1(2) sleeping for 4 seconds.
   # part1(3) sleeping for 0 seconds.
   # Returning part1(3) == result3-1.
   # part2(3, 'result3-1') sleeping for 4 seconds.
   # Returning part1(1) == result1-1.
-  # part2(1, 'result1-1') sleeping for 7 seconds.
   # Returning part1(2) == result2-1.
-  # part2(2, 'result2-1') sleeping for 4 seconds.
   # Returning part2(3, 'result3-1') == result3-2 derived from result3-1.
   # -->Chained result3 => result3-2 derived from result3-1 (took 4.00 seconds).
+  # part2(1, 'result1-1') sleeping for 7 seconds.
+  # part2(2, 'result2-1') sleeping for 4 seconds.
   # Returning part2(2, 'result2-1') == result2-2 derived from result2-1.
   # -->Chained result2 => result2-2 derived from result2-1 (took 8.00 seconds).
   # Returning part2(1, 'result1-1') == result1-2 derived from result1-1.
   # -->Chained result1 => result1-2 derived from result1-1 (took 11.00 seconds).
-  # Program finished in 11.00 seconds.
\ No newline at end of file
+  # critical path, 11.00 seconds end to end:
+  #   part1(1)                 ready at   0.00s  queued  0.00s  ran  4.00s
+  #   part2(1)                 ready at   4.00s  queued  0.00s  ran  7.00s
+  # Program finished in 11.00 seconds.
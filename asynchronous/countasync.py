@@ -1,6 +1,8 @@
 import asyncio
 import time
 
+import loop_bootstrap
+
 
 async def count():
   print("One")
@@ -23,7 +25,7 @@ async def main():
 
 if __name__ == "__main__":
   s = time.perf_counter()
-  asyncio.run(main())
+  loop_bootstrap.run(main())
   elapsed = time.perf_counter() - s
   print(f"{__file__} executed in {elapsed:0.2f} seconds.")
   # One
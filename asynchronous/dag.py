@@ -0,0 +1,133 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Sequence, Tuple, Union
+
+# a dependency is a stage name, computed for the same key, or (stage name, key function) for another key,
+# e.g. ("config", lambda n: None) makes every key share the one "config" result
+Dependency = Union[str, Tuple[str, Callable[[Hashable], Hashable]]]
+
+
+class Stage:
+  def __init__(self, name: str, fn: Callable[..., Awaitable[Any]], deps: Sequence[Dependency], limit: Optional[int]):
+    # fn(key, *results of deps in the declared order)
+    self.name = name
+    self.fn = fn
+    self.deps = list(deps)
+    # at most limit calls of this stage run at once, the others wait their turn
+    self.semaphore = asyncio.Semaphore(limit) if limit else None
+
+
+class Node:
+  # one stage computed for one key, with the timings the critical-path report needs
+  def __init__(self, stage: str, key: Hashable) -> None:
+    self.stage = stage
+    self.key = key
+    self.deps: List["Node"] = []
+    self.ready = 0.0    # all inputs available
+    self.started = 0.0  # got its concurrency slot
+    self.finished = 0.0
+
+  def __str__(self) -> str:
+    return f"{self.stage}({self.key})"
+
+
+class DAG:
+  """Runs stages as soon as their inputs are ready, computing every (stage, key) once."""
+
+  def __init__(self) -> None:
+    self.stages: Dict[str, Stage] = {}
+    self.nodes: Dict[Tuple[str, Hashable], Node] = {}
+    self._tasks: Dict[Tuple[str, Hashable], asyncio.Task] = {}
+    self.origin: Optional[float] = None
+
+  def stage(self, name: str, fn: Callable[..., Awaitable[Any]], deps: Sequence[Dependency] = (), limit: Optional[int] = None) -> None:
+    for dep in deps:
+      dep_name = dep if isinstance(dep, str) else dep[0]
+      # stages are declared upstream first, which also rules out cycles
+      if dep_name not in self.stages:
+        raise ValueError(f"stage {name} depends on {dep_name}, which is not declared (yet)")
+    self.stages[name] = Stage(name, fn, deps, limit)
+
+  def run(self, name: str, key: Hashable) -> "asyncio.Task":
+    # Memoized: the first request for (name, key) starts it, every later one awaits the same task,
+    # so an upstream result shared by several downstream stages is computed once
+    if self.origin is None:
+      self.origin = time.perf_counter()
+    if (name, key) not in self._tasks:
+      node = self.nodes[name, key] = Node(name, key)
+      self._tasks[name, key] = asyncio.ensure_future(self._run(self.stages[name], node))
+    return self._tasks[name, key]
+
+  async def _run(self, stage: Stage, node: Node) -> Any:
+    keys = [(dep, node.key) if isinstance(dep, str) else (dep[0], dep[1](node.key)) for dep in stage.deps]
+    # all inputs are requested at once, independent upstream stages run concurrently
+    # An upstream task is shared by every stage that needs it, shield() keeps the cancellation of one of them
+    # from cancelling it for all the others
+    inputs = await asyncio.gather(*(asyncio.shield(self.run(dep_name, dep_key)) for dep_name, dep_key in keys))
+    node.deps = [self.nodes[dep_key] for dep_key in keys]
+    node.ready = time.perf_counter()
+    if stage.semaphore is None:
+      node.started = node.ready
+      result = await stage.fn(node.key, *inputs)
+    else:
+      async with stage.semaphore:
+        node.started = time.perf_counter()
+        result = await stage.fn(node.key, *inputs)
+    node.finished = time.perf_counter()
+    return result
+
+  def critical_path(self, name: Optional[str] = None, key: Hashable = None) -> List[Node]:
+    # From the node that finished last (or the given one), follow the input that became ready last,
+    # that input is what held the node back; the path is the chain that set the end-to-end time
+    done = [node for node in self.nodes.values() if node.finished]
+    if not done:
+      return []
+    node = self.nodes[name, key] if name is not None else max(done, key=lambda node: node.finished)
+    path = [node]
+    while node.deps:
+      node = max(node.deps, key=lambda dep: dep.finished)
+      path.append(node)
+    return path[::-1]
+
+  def report(self, name: Optional[str] = None, key: Hashable = None) -> str:
+    path = self.critical_path(name, key)
+    if not path:
+      return "nothing ran"
+    lines = [f"critical path, {path[-1].finished - self.origin:0.2f} seconds end to end:"]
+    for node in path:
+      queued = node.started - node.ready
+      lines.append(
+          f"  {str(node):<24} ready at {node.ready - self.origin:6.2f}s"
+          f"  queued {queued:5.2f}s  ran {node.finished - node.started:5.2f}s"
+      )
+    return "\n".join(lines)
+
+
+async def check() -> bool:
+  # Cancelling one consumer of a shared upstream stage leaves the stage and its other consumers running
+  dag = DAG()
+  calls = []
+
+  async def config(key: Hashable) -> str:
+    calls.append(key)
+    await asyncio.sleep(0.05)
+    return "config"
+
+  async def consumer(key: Hashable, cfg: str) -> str:
+    await asyncio.sleep(0.01)
+    return f"{key} with {cfg}"
+
+  dag.stage("config", config)
+  dag.stage("consumer", consumer, deps=[("config", lambda key: None)])
+  a, b = dag.run("consumer", "a"), dag.run("consumer", "b")
+  await asyncio.sleep(0.01)
+  a.cancel()
+  results = await asyncio.gather(a, b, return_exceptions=True)
+  ok = isinstance(results[0], asyncio.CancelledError) and results[1] == "b with config" and calls == [None]
+  print(f"cancelling one consumer leaves the shared stage to the others: {'ok' if ok else 'FAILED'}")
+  return ok
+
+
+if __name__ == "__main__":
+  import loop_bootstrap
+  raise SystemExit(0 if loop_bootstrap.run(check()) else 1)
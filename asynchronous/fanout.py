@@ -0,0 +1,192 @@
+import asyncio
+import itertools
+import random
+from typing import Awaitable, Callable, Iterable, Iterator, List, Optional, Tuple, Type, TypeVar
+
+T = TypeVar("T")
+
+
+class FanOutError(Exception):
+  """Fewer awaitables succeeded than were needed, errors holds the failures."""
+
+  def __init__(self, message: str, errors: List[BaseException]) -> None:
+    super().__init__(message)
+    self.errors = errors
+
+
+class RetriesExhausted(Exception):
+  """Every attempt of the retry budget failed, the last failure is the __cause__."""
+
+
+async def first_k(aws: Iterable[Awaitable[T]], k: int, timeout: Optional[float] = None) -> List[T]:
+  # Runs all the awaitables at once and returns the first k results in the order they finished
+  # The moment k have succeeded (or too many have failed, or the timeout is up) the others are cancelled,
+  # and first_k waits until they are actually gone before it returns or raises, so nothing outlives the call
+  tasks = [asyncio.ensure_future(aw) for aw in aws]
+  if not 0 < k <= len(tasks):
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    raise ValueError(f"k must be between 1 and {len(tasks)}, got {k}")
+  # the position of every task, done tasks are put back in this order without a search per task
+  order = {task: index for index, task in enumerate(tasks)}
+  loop = asyncio.get_running_loop()
+  deadline = None if timeout is None else loop.time() + timeout
+  results: List[T] = []
+  errors: List[BaseException] = []
+  try:
+    pending = set(tasks)
+    while len(results) < k:
+      if len(results) + len(pending) < k:
+        raise FanOutError(f"only {len(results)} of the {k} needed results succeeded", errors)
+      remaining = None if deadline is None else deadline - loop.time()
+      if remaining is not None and remaining <= 0:
+        raise asyncio.TimeoutError(f"{len(results)} of {k} results before the deadline")
+      done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+      # tasks finishing in the same step are taken in the order they were passed in
+      for task in sorted(done, key=order.__getitem__):
+        if task.cancelled():
+          errors.append(asyncio.CancelledError())
+        elif task.exception() is not None:
+          errors.append(task.exception())
+        else:
+          results.append(task.result())
+    return results[:k]
+  finally:
+    for task in tasks:
+      if not task.done():
+        task.cancel()
+    # also retrieves the exceptions of the losers, so none is reported as "never retrieved"
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def first_success(aws: Iterable[Awaitable[T]], timeout: Optional[float] = None) -> T:
+  return (await first_k(aws, 1, timeout))[0]
+
+
+def constant(delay: float) -> Iterator[float]:
+  return itertools.repeat(delay)
+
+
+def exponential(base: float = 0.1, factor: float = 2.0, cap: float = 10.0, jitter: float = 0.0) -> Iterator[float]:
+  # base, base * factor, base * factor^2 ... up to cap, each shortened by up to jitter (a fraction) at random
+  # so retries that failed together don't come back together
+  delay = base
+  while True:
+    yield delay * (1 - random.uniform(0, jitter)) if jitter else delay
+    delay = min(delay * factor, cap)
+
+
+async def retry(
+    attempt: Callable[[], Awaitable[T]],
+    attempts: Optional[int] = 3,
+    backoff: Optional[Iterable[float]] = None,
+    retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+    attempt_timeout: Optional[float] = None,
+) -> T:
+  # attempt() is called up to attempts times, sleeping the next delay of the backoff schedule in between
+  # attempts=None has no budget, it retries until an attempt succeeds
+  # A cancellation is never retried, it ends the retry loop wherever it is, in an attempt or in a sleep
+  if attempts is not None and attempts < 1:
+    raise ValueError(f"attempts must be at least 1, got {attempts}")
+  # a finite backoff shorter than attempts - 1 keeps repeating its last delay
+  delays = iter(backoff if backoff is not None else constant(0))
+  delay = 0.0
+  # an attempt that runs over attempt_timeout counts as a failure like any other
+  retryable = retry_on + ((asyncio.TimeoutError,) if attempt_timeout is not None else ())
+  for number in itertools.count(1):
+    try:
+      if attempt_timeout is None:
+        return await attempt()
+      return await asyncio.wait_for(attempt(), attempt_timeout)
+    except retryable as error:
+      if number == attempts:
+        raise RetriesExhausted(f"{attempts} attempts failed") from error
+    delay = next(delays, delay)
+    await asyncio.sleep(delay)
+
+
+async def check() -> bool:
+  # No cancelled task may outlive first_k: every loser has run its cleanup and no task is left on the loop
+  cleaned_up = []
+  ok = True
+
+  async def sleeper(delay: float, value: int, fail: bool = False) -> int:
+    try:
+      await asyncio.sleep(delay)
+      if fail:
+        raise ValueError(value)
+      return value
+    finally:
+      cleaned_up.append(value)
+
+  def leftovers() -> set:
+    return asyncio.all_tasks() - {asyncio.current_task()}
+
+  results = await first_k([sleeper(0.3, 0), sleeper(0.01, 1), sleeper(0.02, 2), sleeper(10, 3)], k=2)
+  ok &= results == [1, 2] and sorted(cleaned_up) == [0, 1, 2, 3] and not leftovers()
+  print(f"first_k returns the first 2 and cancels the rest: {'ok' if ok else 'FAILED'}")
+
+  cleaned_up.clear()
+  result = await first_success([sleeper(0.01, 0, fail=True), sleeper(0.02, 1), sleeper(10, 2)])
+  step = result == 1 and sorted(cleaned_up) == [0, 1, 2] and not leftovers()
+  print(f"first_success skips failures: {'ok' if step else 'FAILED'}")
+  ok &= step
+
+  cleaned_up.clear()
+  try:
+    await first_k([sleeper(10, 0), sleeper(10, 1)], k=1, timeout=0.05)
+    step = False
+  except asyncio.TimeoutError:
+    step = sorted(cleaned_up) == [0, 1] and not leftovers()
+  print(f"deadline cancels everything: {'ok' if step else 'FAILED'}")
+  ok &= step
+
+  cleaned_up.clear()
+  try:
+    await first_k([sleeper(0.01, 0, fail=True), sleeper(0.02, 1, fail=True), sleeper(10, 2)], k=2)
+    step = False
+  except FanOutError as error:
+    # the k needed can't be reached any more once two of three failed, the third is not waited for
+    step = len(error.errors) == 2 and sorted(cleaned_up) == [0, 1, 2] and not leftovers()
+  print(f"too many failures end early: {'ok' if step else 'FAILED'}")
+  ok &= step
+
+  # first_k itself being cancelled takes its tasks down with it
+  cleaned_up.clear()
+  outer = asyncio.ensure_future(first_k([sleeper(10, 0), sleeper(10, 1)], k=1))
+  await asyncio.sleep(0.01)
+  outer.cancel()
+  await asyncio.gather(outer, return_exceptions=True)
+  step = sorted(cleaned_up) == [0, 1] and not leftovers()
+  print(f"cancelling first_k cancels its tasks: {'ok' if step else 'FAILED'}")
+  ok &= step
+
+  calls = []
+
+  async def flaky() -> int:
+    calls.append(asyncio.get_running_loop().time())
+    if len(calls) < 3:
+      raise ConnectionError
+    return len(calls)
+
+  step = await retry(flaky, attempts=5, backoff=exponential(0.01, 2)) == 3
+  gaps = [b - a for a, b in zip(calls, calls[1:])]
+  step &= gaps[0] >= 0.01 and gaps[1] >= 0.02
+  try:
+    calls.clear()
+    await retry(flaky, attempts=2, backoff=constant(0))
+    step = False
+  except RetriesExhausted as error:
+    step &= isinstance(error.__cause__, ConnectionError)
+  calls.clear()
+  # one delay for two retries, the last delay is reused instead of running out
+  step &= await retry(flaky, attempts=4, backoff=[0.01]) == 3
+  print(f"retry follows the backoff and the budget: {'ok' if step else 'FAILED'}")
+  ok &= step
+  return bool(ok)
+
+
+if __name__ == "__main__":
+  import loop_bootstrap
+  raise SystemExit(0 if loop_bootstrap.run(check()) else 1)
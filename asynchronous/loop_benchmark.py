@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import itertools
+import sys
+import time
+from typing import Awaitable, Callable, List
+
+import loop_bootstrap
+
+
+async def task_creation(n: int) -> None:
+  # n tasks that finish without ever suspending, the case eager tasks skip the loop's queue for
+  async def nothing() -> None:
+    pass
+
+  await asyncio.gather(*(asyncio.create_task(nothing()) for _ in range(n)))
+
+
+async def queue_handoff(n: int) -> None:
+  # one producer and one consumer passing n items through a small queue, every put/get pair switches tasks
+  q: asyncio.Queue = asyncio.Queue(maxsize=16)
+
+  async def consume() -> None:
+    for _ in range(n):
+      await q.get()
+
+  consumer = asyncio.create_task(consume())
+  for i in range(n):
+    await q.put(i)
+  await consumer
+
+
+async def socket_round_trips(n: int) -> None:
+  # n request/response round trips over one TCP connection to an echo server on the same loop
+  async def echo(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    while data := await reader.read(64):
+      writer.write(data)
+      await writer.drain()
+    writer.close()
+
+  server = await asyncio.start_server(echo, "127.0.0.1", 0)
+  port = server.sockets[0].getsockname()[1]
+  reader, writer = await asyncio.open_connection("127.0.0.1", port)
+  for _ in range(n):
+    writer.write(b"ping")
+    await reader.readexactly(4)
+  writer.close()
+  await writer.wait_closed()
+  server.close()
+  await server.wait_closed()
+
+
+WORKLOADS = {
+    "task creation": (task_creation, 100_000),
+    "queue handoff": (queue_handoff, 100_000),
+    "socket round trips": (socket_round_trips, 10_000),
+}
+
+
+def measure(workload: Callable[[int], Awaitable[None]], n: int, backend: str, eager: bool, repeat: int) -> float:
+  # best of repeat, each on a fresh loop, in operations per second
+  timings: List[float] = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    loop_bootstrap.run(workload(n), backend=backend, eager=eager)
+    timings.append(time.perf_counter() - start)
+  return n / min(timings)
+
+
+def configurations() -> list:
+  configs = []
+  for backend, eager in itertools.product(("asyncio", "uvloop"), (False, True)):
+    if backend == "uvloop" and loop_bootstrap.uvloop is None:
+      print(f"skipping {backend}{' + eager tasks' if eager else ''}: uvloop is not installed (pip3 install uvloop)")
+    elif eager and not loop_bootstrap.EAGER_TASKS_AVAILABLE:
+      print(f"skipping {backend} + eager tasks: needs Python 3.12+, this is {sys.version.split()[0]}")
+    else:
+      configs.append((backend, eager))
+  return configs
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Compare event loop backends on task, queue and socket micro-benchmarks")
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--scale", type=float, default=1.0, help="multiplies the number of operations of every workload")
+  args = parser.parse_args()
+
+  configs = configurations()
+  print(f"\n{'workload':<20}" + "".join(f"{loop_bootstrap.describe(b, e):>24}" for b, e in configs))
+  for name, (workload, n) in WORKLOADS.items():
+    n = max(1, int(n * args.scale))
+    rates = [measure(workload, n, backend, eager, args.repeat) for backend, eager in configs]
+    print(f"{name:<20}" + "".join(f"{rate:>18,.0f} ops/s" for rate in rates))
+
+  # Sample output, Python 3.11 on one core without uvloop, so only the default loop is measured:
+  # skipping asyncio + eager tasks: needs Python 3.12+, this is 3.11.7
+  # skipping uvloop: uvloop is not installed (pip3 install uvloop)
+  # skipping uvloop + eager tasks: uvloop is not installed (pip3 install uvloop)
+  #
+  # workload                             asyncio
+  # task creation                   74,335 ops/s
+  # queue handoff                  516,027 ops/s
+  # socket round trips              27,355 ops/s
@@ -0,0 +1,106 @@
+import asyncio
+import os
+from typing import Any, Callable, Coroutine, Optional
+
+try:
+  import uvloop
+except ImportError:
+  # uvloop is optional (pip3 install uvloop), without it the default asyncio loop is used
+  uvloop = None
+
+# Python 3.12+ can run a new task eagerly: create_task() runs the coroutine right away up to its first real suspension,
+# a task that finishes without suspending never goes through the loop's queue at all
+EAGER_TASKS_AVAILABLE = hasattr(asyncio, "eager_task_factory")
+BACKENDS = ("auto", "uvloop", "asyncio")
+
+
+def _custom_policy() -> bool:
+  # A policy set by the program (e.g. virtual_time.VirtualTimePolicy) decides the loop, the bootstrap doesn't override it
+  return type(asyncio.get_event_loop_policy()) is not asyncio.DefaultEventLoopPolicy
+
+
+def resolve(backend: Optional[str] = None, eager: Optional[bool] = None) -> tuple:
+  # backend and eager default to the ASYNC_LOOP and ASYNC_EAGER_TASKS environment variables, so a script
+  # can be switched without changing it; eager is off by default, it changes the order in which tasks start
+  backend = backend or os.environ.get("ASYNC_LOOP", "auto")
+  if backend not in BACKENDS:
+    raise ValueError(f"Unknown loop backend {backend}, choose from {', '.join(BACKENDS)}")
+  if eager is None:
+    eager = os.environ.get("ASYNC_EAGER_TASKS", "") not in ("", "0")
+  if _custom_policy():
+    backend = "policy"
+  elif backend == "auto":
+    backend = "uvloop" if uvloop is not None else "asyncio"
+  elif backend == "uvloop" and uvloop is None:
+    raise ImportError("The uvloop backend needs uvloop installed (pip3 install uvloop)")
+  return backend, eager and EAGER_TASKS_AVAILABLE
+
+
+def new_event_loop(backend: Optional[str] = None, eager: Optional[bool] = None) -> asyncio.AbstractEventLoop:
+  backend, eager = resolve(backend, eager)
+  if backend == "uvloop":
+    loop = uvloop.new_event_loop()
+  else:
+    # the policy's own loop, which is the default asyncio loop unless a custom policy is set
+    loop = asyncio.new_event_loop()
+  if eager:
+    loop.set_task_factory(asyncio.eager_task_factory)
+  return loop
+
+
+def describe(backend: Optional[str] = None, eager: Optional[bool] = None) -> str:
+  backend, eager = resolve(backend, eager)
+  return f"{backend}{' + eager tasks' if eager else ''}"
+
+
+def _cancel_all_tasks(loop: asyncio.AbstractEventLoop) -> None:
+  tasks = asyncio.all_tasks(loop)
+  for task in tasks:
+    task.cancel()
+  loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+  for task in tasks:
+    if not task.cancelled() and task.exception() is not None:
+      loop.call_exception_handler({
+          "message": "unhandled exception during shutdown",
+          "exception": task.exception(),
+          "task": task,
+      })
+
+
+def _run_without_runner(main: Coroutine, loop_factory: Callable[[], asyncio.AbstractEventLoop], debug: Optional[bool]) -> Any:
+  # What asyncio.Runner does, for Python 3.7 to 3.10 where it doesn't exist yet
+  loop = loop_factory()
+  try:
+    asyncio.set_event_loop(loop)
+    if debug is not None:
+      loop.set_debug(debug)
+    return loop.run_until_complete(main)
+  finally:
+    try:
+      _cancel_all_tasks(loop)
+      loop.run_until_complete(loop.shutdown_asyncgens())
+      if hasattr(loop, "shutdown_default_executor"):
+        loop.run_until_complete(loop.shutdown_default_executor())
+    finally:
+      asyncio.set_event_loop(None)
+      loop.close()
+
+
+def run_in_loop(main: Coroutine, loop_factory: Callable[[], asyncio.AbstractEventLoop], debug: Optional[bool] = None) -> Any:
+  # asyncio.run() on a loop from loop_factory
+  if not hasattr(asyncio, "Runner"):
+    return _run_without_runner(main, loop_factory, debug)
+  with asyncio.Runner(debug=debug, loop_factory=loop_factory) as runner:
+    return runner.run(main)
+
+
+def run(main: Coroutine, backend: Optional[str] = None, eager: Optional[bool] = None, debug: Optional[bool] = None) -> Any:
+  # The one entry point of the async scripts instead of asyncio.run(main()), same semantics
+  # (a new loop, cancelling what is left over and closing the loop at the end), on the selected loop
+  try:
+    resolve(backend, eager)
+  except (ValueError, ImportError):
+    # main never gets to run, closed here so it isn't also reported as "never awaited"
+    main.close()
+    raise
+  return run_in_loop(main, lambda: new_event_loop(backend, eager), debug)
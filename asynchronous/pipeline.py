@@ -0,0 +1,196 @@
+import asyncio
+import math
+import time
+from typing import Any, Awaitable, Callable, Iterable, List, Optional
+
+# ends a batch and tells one worker of a stage to stop
+_CLOSE = object()
+
+
+class LatencyHistogram:
+  # Log-scale buckets, 8 per power of two starting at 100ns, so percentiles are within about 9%
+  # and recording millions of samples costs a dict increment each instead of a growing list
+  BASE = 1e-7
+  PER_OCTAVE = 8
+
+  def __init__(self) -> None:
+    self.buckets: dict = {}
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+
+  def record(self, seconds: float, count: int = 1) -> None:
+    bucket = 0 if seconds <= self.BASE else int(math.log2(seconds / self.BASE) * self.PER_OCTAVE) + 1
+    self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+    self.count += count
+    self.total += seconds * count
+    self.max = max(self.max, seconds)
+
+  def percentile(self, p: float) -> float:
+    if not self.count:
+      return 0.0
+    rank = p / 100 * self.count
+    seen = 0
+    for bucket in sorted(self.buckets):
+      seen += self.buckets[bucket]
+      if seen >= rank:
+        # the geometric middle of the bucket, never above the largest sample
+        return 0.0 if bucket == 0 else min(self.BASE * 2 ** ((bucket - 0.5) / self.PER_OCTAVE), self.max)
+    return self.max
+
+  def summary(self) -> str:
+    mean = self.total / self.count if self.count else 0.0
+    return (
+        f"p50 {self.percentile(50) * 1e3:9.3f} ms  p99 {self.percentile(99) * 1e3:9.3f} ms"
+        f"  max {self.max * 1e3:9.3f} ms  mean {mean * 1e3:9.3f} ms"
+    )
+
+
+async def get_many(q: asyncio.Queue, max_items: int) -> list:
+  # Waits for the first item, then takes whatever else is already queued without waiting, up to max_items
+  items = [await q.get()]
+  while len(items) < max_items and not q.empty():
+    if items[-1][0] is _CLOSE:
+      break
+    items.append(q.get_nowait())
+  return items
+
+
+class Stage:
+  def __init__(
+      self,
+      name: str,
+      handler: Callable[[Any], Awaitable[Any]],
+      workers: int = 1,
+      batch_size: int = 1,
+      batched: bool = False,
+      maxsize: int = 1000,
+  ) -> None:
+    # handler(item) -> result, or with batched=True handler(items) -> results for a whole batch
+    self.name = name
+    self.handler = handler
+    self.workers = workers
+    self.batch_size = batch_size
+    self.batched = batched
+    # a bounded queue in front of every stage, a full one makes the stage before it wait (backpressure)
+    self.maxsize = maxsize
+    self.wait = LatencyHistogram()
+    self.service = LatencyHistogram()
+    self.items = 0
+
+
+class Pipeline:
+  """Chained stages with bounded queues, batched draining and per-stage latency histograms."""
+
+  def __init__(self, *stages: Stage, sink: Optional[Callable[[Any], Any]] = None) -> None:
+    self.stages = stages
+    self.queues = [asyncio.Queue(maxsize=stage.maxsize) for stage in stages]
+    # sink(result) receives what comes out of the last stage, without one the results are only counted
+    self.sink = sink
+    self.completed = 0
+    self._running = [stage.workers for stage in stages]
+    self._tasks: List[asyncio.Task] = []
+    self._error: Optional[BaseException] = None
+
+  async def __aenter__(self) -> "Pipeline":
+    self.start()
+    return self
+
+  async def __aexit__(self, exc_type, exc, tb) -> None:
+    if exc_type is None:
+      await self.close()
+    else:
+      for task in self._tasks:
+        task.cancel()
+      await asyncio.gather(*self._tasks, return_exceptions=True)
+
+  def start(self) -> None:
+    for index, stage in enumerate(self.stages):
+      for n in range(stage.workers):
+        self._tasks.append(asyncio.create_task(self._work(index), name=f"{stage.name}-{n}"))
+
+  async def put(self, item: Any) -> None:
+    # waits while the first stage's queue is full, the queue wait counts from here, so it includes that time
+    if self._error is not None:
+      raise self._error
+    await self.queues[0].put((item, time.perf_counter()))
+
+  async def put_many(self, items: Iterable[Any]) -> None:
+    for item in items:
+      await self.put(item)
+
+  async def close(self) -> None:
+    # Every item put so far still goes through all the stages, then the workers exit
+    # one close marker per worker of the first stage, the last worker of a stage to exit closes the next one
+    for _ in range(self.stages[0].workers):
+      if self._error is not None:
+        break
+      await self.queues[0].put((_CLOSE, 0.0))
+    await asyncio.gather(*self._tasks, return_exceptions=True)
+    if self._error is not None:
+      raise self._error
+
+  async def _forward(self, index: int, results: list) -> None:
+    if index + 1 < len(self.stages):
+      now = time.perf_counter()
+      for result in results:
+        await self.queues[index + 1].put((result, now))
+      return
+    self.completed += len(results)
+    if self.sink is not None:
+      for result in results:
+        outcome = self.sink(result)
+        if asyncio.iscoroutine(outcome):
+          await outcome
+
+  async def _work(self, index: int) -> None:
+    stage, q = self.stages[index], self.queues[index]
+    try:
+      while True:
+        batch = await get_many(q, stage.batch_size)
+        closing = batch[-1][0] is _CLOSE
+        if closing:
+          batch.pop()
+        if batch:
+          started = time.perf_counter()
+          for _, enqueued in batch:
+            stage.wait.record(started - enqueued)
+          items = [item for item, _ in batch]
+          if stage.batched:
+            results = await stage.handler(items)
+          else:
+            results = [await stage.handler(item) for item in items]
+          # service time per item, a batch of n items counts n times
+          stage.service.record((time.perf_counter() - started) / len(items), len(items))
+          stage.items += len(items)
+          await self._forward(index, results)
+        if closing:
+          break
+    except asyncio.CancelledError:
+      raise
+    except BaseException as error:
+      self._fail(error)
+      return
+    self._running[index] -= 1
+    if self._running[index] == 0 and index + 1 < len(self.stages):
+      for _ in range(self.stages[index + 1].workers):
+        await self.queues[index + 1].put((_CLOSE, 0.0))
+
+  def _fail(self, error: BaseException) -> None:
+    # the first failure stops every worker, and the queues are emptied so no producer stays blocked in put()
+    if self._error is None:
+      self._error = error
+    for task in self._tasks:
+      if task is not asyncio.current_task():
+        task.cancel()
+    for q in self.queues:
+      while not q.empty():
+        q.get_nowait()
+
+  def report(self) -> str:
+    lines = []
+    for stage in self.stages:
+      lines.append(f"{stage.name}: {stage.items} items, {stage.workers} workers, batches of up to {stage.batch_size}")
+      lines.append(f"  queue wait   {stage.wait.summary()}")
+      lines.append(f"  service time {stage.service.summary()}")
+    return "\n".join(lines)
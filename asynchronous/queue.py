@@ -4,6 +4,9 @@ import os
 import random
 import time
 
+import loop_bootstrap
+from pipeline import Pipeline, Stage
+
 async def makeitem(size: int = 5) -> str:
   return os.urandom(size).hex()
 
@@ -13,34 +16,42 @@ async def randsleep(caller=None) -> None:
     print(f"{caller} sleeping for {i} seconds.")
   await asyncio.sleep(i)
 
-async def produce(name: int, q: asyncio.Queue) -> None:
-  n = random.randint(0, 10)
+async def produce(name: int, pipeline: Pipeline, n: int, sleep: bool = True) -> None:
   for _ in it.repeat(None, n):  # Synchronous loop for each single producer
-    await randsleep(caller=f"Producer {name}")
+    if sleep:
+      await randsleep(caller=f"Producer {name}")
     i = await makeitem()
-    t = time.perf_counter()
-    await q.put((i, t))
-    print(f"Producer {name} added <{i}> to queue.")
+    # waits while the consumers' queue is full, instead of letting it grow without bound
+    await pipeline.put(i)
+    if sleep:
+      print(f"Producer {name} added <{i}> to queue.")
+
+async def consume(i: str) -> str:
+  await randsleep()
+  return i
 
-async def consume(name: int, q: asyncio.Queue) -> None:
-  while True:
-    await randsleep(caller=f"Consumer {name}")
-    i, t = await q.get()
-    now = time.perf_counter()
-    print(
-        f"Consumer {name} got element <{i}>"
-        f" in {now-t:0.5f} seconds."
-    )
-    q.task_done()
+async def consume_batch(items: list) -> list:
+  # the load test: no sleeping, a whole batch per call
+  return [i.upper() for i in items]
 
-async def main(nprod: int, ncon: int):
-  q = asyncio.Queue()
-  producers = [asyncio.create_task(produce(n, q)) for n in range(nprod)]
-  consumers = [asyncio.create_task(consume(n, q)) for n in range(ncon)]
-  await asyncio.gather(*producers)
-  await q.join()  # Implicitly awaits consumers, too
-  for c in consumers:
-    c.cancel()
+async def main(nprod: int, ncon: int, load_test: int = 0, stages: int = 1, batch_size: int = 1, maxsize: int = 10):
+  if load_test:
+    pipeline = Pipeline(*(
+        Stage(f"stage {s}", consume_batch, workers=ncon, batch_size=batch_size, batched=True, maxsize=maxsize)
+        for s in range(stages)
+    ))
+    counts = [load_test // nprod + (n < load_test % nprod) for n in range(nprod)]
+  else:
+    # the queue wait and service time of every element go into the histograms instead of a print per element
+    pipeline = Pipeline(*(
+        Stage(f"stage {s}", consume, workers=ncon, batch_size=batch_size, maxsize=maxsize) for s in range(stages)
+    ))
+    counts = [random.randint(0, 10) for _ in range(nprod)]
+  async with pipeline:
+    await asyncio.gather(*(produce(n, pipeline, count, sleep=not load_test) for n, count in enumerate(counts)))
+  # leaving the block waits until every element has gone through every stage
+  print(pipeline.report())
+  return pipeline.completed
 
 if __name__ == "__main__":
   import argparse
@@ -48,30 +59,22 @@ if __name__ == "__main__":
   parser = argparse.ArgumentParser()
   parser.add_argument("-p", "--nprod", type=int, default=5)
   parser.add_argument("-c", "--ncon", type=int, default=10)
+  parser.add_argument("--load-test", type=int, default=0, metavar="ITEMS", help="push ITEMS elements through without randsleep")
+  parser.add_argument("--stages", type=int, default=1)
+  parser.add_argument("--batch-size", type=int, default=1)
+  parser.add_argument("--maxsize", type=int, default=10, help="bound of every stage's queue")
   ns = parser.parse_args()
   start = time.perf_counter()
-  asyncio.run(main(**ns.__dict__))
+  completed = loop_bootstrap.run(main(**ns.__dict__))
   elapsed = time.perf_counter() - start
+  if ns.load_test:
+    print(f"{completed} elements in {elapsed:0.2f} seconds, {completed / elapsed:,.0f} elements/s.")
   print(f"Program completed in {elapsed:0.5f} seconds.")
-  # Producer 0 sleeping for 4 seconds.
-  # Consumer 0 sleeping for 4 seconds.
-  # Consumer 1 sleeping for 7 seconds.
-  # Consumer 2 sleeping for 4 seconds.
-  # Consumer 3 sleeping for 4 seconds.
-  # Consumer 4 sleeping for 8 seconds.
-  # Producer 0 added <440447c82f> to queue.
-  # Producer 0 sleeping for 10 seconds.
-  # Consumer 0 got element <440447c82f> in 0.00022 seconds.
-  # Consumer 0 sleeping for 7 seconds.
-  # Producer 0 added <82f04379d1> to queue.
-  # Producer 0 sleeping for 8 seconds.
-  # Consumer 2 got element <82f04379d1> in 0.00034 seconds.
-  # Consumer 2 sleeping for 4 seconds.
-  # Producer 0 added <a4568d2cb8> to queue.
-  # Producer 0 sleeping for 7 seconds.
-  # Consumer 3 got element <a4568d2cb8> in 0.00017 seconds.
-  # Consumer 3 sleeping for 1 seconds.
-  # Producer 0 added <6279dcdf5f> to queue.
-  # Consumer 1 got element <6279dcdf5f> in 0.00024 seconds.
-  # Consumer 1 sleeping for 6 seconds.
-  # Program completed in 29.00951 seconds.
+  # python3 queue.py -p 4 -c 4 --load-test 1000000 --stages 2 --batch-size 256 --maxsize 4096
+  # stage 0: 1000000 items, 4 workers, batches of up to 256
+  #   queue wait   p50    21.109 ms  p99    32.555 ms  max  5753.292 ms  mean    20.164 ms
+  #   service time p50     0.001 ms  p99     0.004 ms  max     0.046 ms  mean     0.001 ms
+  # stage 1: 1000000 items, 4 workers, batches of up to 256
+  #   queue wait   p50    21.109 ms  p99    35.501 ms  max    38.507 ms  mean    21.793 ms
+  #   service time p50     0.001 ms  p99     0.003 ms  max     0.028 ms  mean     0.001 ms
+  # 1000000 elements in 7.91 seconds, 126,429 elements/s.
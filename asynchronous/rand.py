@@ -1,5 +1,9 @@
 import asyncio
 import random
+from typing import List, Optional, Tuple
+
+import loop_bootstrap
+from fanout import constant, first_k, retry
 
 # ANSI colors
 c = (
@@ -9,26 +13,44 @@ c = (
     "\033[35m",  # Magenta
 )
 
-async def makerandom(idx: int, threshold: int = 6) -> int:
-  # coroutine
-  print(c[idx + 1] + f"Initiated makerandom({idx}).")
+class TooLow(Exception):
+  pass
+
+async def draw(idx: int, threshold: int) -> int:
+  # one attempt, a value that is too low is a failure for retry() to handle
   i = random.randint(0, 10)
-  while i <= threshold:
+  if i <= threshold:
     print(c[idx + 1] + f"makerandom({idx}) == {i} too low; retrying.")
-    await asyncio.sleep(idx + 1) # randint is CPU-bound, but with asyncio.sleep, it becomes an IO-Boundi(sh) Program
-    i = random.randint(0, 10)
+    raise TooLow(i)
+  return i
+
+async def makerandom(idx: int, threshold: int = 6, attempts: Optional[int] = None, backoff=None) -> int:
+  # coroutine
+  print(c[idx + 1] + f"Initiated makerandom({idx}).")
+  # the retry loop with a backoff schedule, by default the fixed idx + 1 seconds between attempts,
+  # and like the original while loop no budget: it draws until a value is high enough, pass attempts to cap it
+  # randint is CPU-bound, but with asyncio.sleep, it becomes an IO-Boundi(sh) Program
+  i = await retry(lambda: draw(idx, threshold), attempts, backoff or constant(idx + 1), retry_on=(TooLow,))
   print(c[idx + 1] + f"---> Finished: makerandom({idx}) == {i}" + c[0])
   return i
 
-async def main():
-  # runs the coroutine makerandom() concurrently across 3 different inputs
+async def labelled(idx: int) -> Tuple[int, int]:
+  return idx, await makerandom(idx, 10 - idx - 1)
+
+async def main(k: int = 3, n: int = 3) -> List[Tuple[int, int]]:
+  # runs the coroutine makerandom() concurrently across n different inputs
 
   # most pograms contain small, modular coroutines(i.e. makerandom()) and one wrapper function(i.e. main) to chain the coroutines together
-  res = await asyncio.gather(*(makerandom(i, 10 - i - 1) for i in range(3)))
-  return res
+  # only the first k results are needed, the slower ones are cancelled as soon as k have finished (k == n waits for all)
+  # results come back in the order they finished, each one with the index of its makerandom()
+  return await first_k((labelled(i) for i in range(n)), k)
 
 if __name__ == "__main__":
+  import argparse
   random.seed(444)
-  r1, r2, r3 = asyncio.run(main())
-  print()
-  print(f"r1: {r1}, r2: {r2}, r3: {r3}")
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-k", type=int, default=3, help="stop after the first k of the 3 results")
+  ns = parser.parse_args()
+  res = loop_bootstrap.run(main(ns.k))
+  print(c[0])
+  print(", ".join(f"r{idx + 1}: {r}" for idx, r in sorted(res)))
@@ -0,0 +1,127 @@
+import asyncio
+import atexit
+import os
+import runpy
+import selectors
+import sys
+import time
+from typing import Any, Callable, Coroutine, Optional
+
+import loop_bootstrap
+
+# the real clocks, the runner below replaces the ones in the time module
+real_perf_counter = time.perf_counter
+real_sleep = time.sleep
+
+
+class VirtualClock:
+  def __init__(self) -> None:
+    self.now = 0.0
+
+  def advance(self, seconds: float) -> None:
+    self.now += max(seconds, 0.0)
+
+
+clock = VirtualClock()
+
+
+class VirtualSelector:
+  # Wraps the loop's real selector: sockets, pipes and threads are still waited for for real,
+  # but when the loop would only be waiting for its next timer, the clock jumps to it instead
+  def __init__(self, selector: selectors.BaseSelector, virtual_clock: VirtualClock) -> None:
+    self._selector = selector
+    self._clock = virtual_clock
+    # set by the loop, tells whether a socket, pipe or executor thread may still wake it up
+    self.real_work: Callable[[], bool] = lambda: False
+
+  def select(self, timeout: Optional[float] = None):
+    events = self._selector.select(0)
+    if events:
+      return events
+    if timeout is None:
+      # no timer is scheduled, only I/O or another thread can wake the loop up
+      return self._selector.select(None)
+    if self.real_work():
+      # Jumping now would fire a timeout before the I/O or the thread had a chance to finish,
+      # so the wait is real and the clock moves by the time that really passed
+      started = real_perf_counter()
+      events = self._selector.select(timeout)
+      self._clock.advance(real_perf_counter() - started)
+      return events
+    # every task is sleeping, the timeout is exactly the time until the earliest timer is due
+    self._clock.advance(timeout)
+    return []
+
+  def __getattr__(self, name: str) -> Any:
+    return getattr(self._selector, name)
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+  """An event loop whose clock only moves when every task is waiting for a timer, and then jumps to that timer."""
+
+  def __init__(self, virtual_clock: VirtualClock = clock) -> None:
+    self._virtual_clock = virtual_clock
+    self._executor_calls = 0
+    selector = VirtualSelector(selectors.DefaultSelector(), virtual_clock)
+    super().__init__(selector)
+    selector.real_work = self._real_work
+
+  def _real_work(self) -> bool:
+    # Anything registered besides the loop's own self-pipe is a socket or pipe somebody is waiting on,
+    # and run_in_executor (to_thread, getaddrinfo) calls finish in a thread on their own time
+    return len(self._selector.get_map()) > 1 or self._executor_calls > 0
+
+  def run_in_executor(self, executor, func, *args) -> asyncio.Future:
+    future = super().run_in_executor(executor, func, *args)
+    self._executor_calls += 1
+    future.add_done_callback(self._executor_done)
+    return future
+
+  def _executor_done(self, future: asyncio.Future) -> None:
+    self._executor_calls -= 1
+
+  def time(self) -> float:
+    # asyncio.sleep, call_later, wait_for and timeouts all schedule against this clock
+    return self._virtual_clock.now
+
+
+class VirtualTimePolicy(asyncio.DefaultEventLoopPolicy):
+  # asyncio.run() and new_event_loop() create a VirtualTimeLoop once this policy is set
+  _loop_factory = VirtualTimeLoop
+
+
+def run(main: Coroutine) -> Any:
+  # asyncio.run on a virtual clock, e.g. for a test of scheduling logic that sleeps for minutes
+  return loop_bootstrap.run_in_loop(main, VirtualTimeLoop)
+
+
+def install() -> None:
+  # Virtual time for the whole program: the loops asyncio.run() creates, and time.perf_counter() / time.sleep(),
+  # so a script that measures itself with perf_counter reports the time it would have taken
+  # Other randomness is untouched, random.seed(444) in the scripts gives the same sleeps in the same order
+  asyncio.set_event_loop_policy(VirtualTimePolicy())
+  time.perf_counter = lambda: clock.now
+  time.sleep = clock.advance
+
+
+def uninstall() -> None:
+  asyncio.set_event_loop_policy(None)
+  time.perf_counter = real_perf_counter
+  time.sleep = real_sleep
+
+
+def report(script: str, started: float) -> None:
+  real = real_perf_counter() - started
+  print(f"\n{script}: {clock.now:0.2f} simulated seconds in {real * 1000:0.1f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+  # python3 virtual_time.py chain.py 1 2 3 runs chain.py on virtual time, with its own arguments
+  if len(sys.argv) < 2:
+    raise SystemExit("usage: virtual_time.py SCRIPT [ARGS...]")
+  script = sys.argv[1]
+  sys.argv = sys.argv[1:]
+  sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+  atexit.register(report, script, real_perf_counter())
+  install()
+  runpy.run_path(script, run_name="__main__")
@@ -0,0 +1,131 @@
+import argparse
+import time
+
+try:
+  import numpy as np
+except ImportError:
+  # numpy is optional, only the "numpy" backend needs it
+  np = None
+
+INT64_MAX = 2 ** 63 - 1
+BLOCK_SIZE = 1 << 16
+
+
+def python_range_sum(start, stop):
+  return sum(i * i for i in range(start, stop))
+
+
+def python_sum(number):
+  # the reference every other backend has to match, same as cpu_bound() in cpu_synchronous.py
+  return python_range_sum(0, number)
+
+
+def closed_form_sum(number):
+  # 0^2 + 1^2 + ... + (n-1)^2 = (n-1)n(2n-1)/6, exact because Python ints don't overflow
+  if number <= 0:
+    return 0
+  return (number - 1) * number * (2 * number - 1) // 6
+
+
+def closed_form_range_sum(start, stop):
+  return closed_form_sum(stop) - closed_form_sum(start)
+
+
+def numpy_range_sum(start, stop, block_size=BLOCK_SIZE):
+  # The generator in python_sum pays interpreter overhead for every single element,
+  # numpy squares and sums a whole block of int64 values in C
+  if stop <= start:
+    return 0
+  largest_square = (stop - 1) ** 2
+  if largest_square > INT64_MAX:
+    # i * i itself would overflow int64, there is nothing to vectorise safely
+    return python_range_sum(start, stop)
+  # The sum of a block has to fit in int64 as well, so the block shrinks as the squares grow
+  # The per-block sums are accumulated in a Python int, which can't overflow
+  block_size = max(1, min(block_size, INT64_MAX // max(largest_square, 1)))
+  # both buffers are allocated once, every block is computed in place
+  base = np.arange(block_size, dtype=np.int64)
+  block = np.empty(block_size, dtype=np.int64)
+  total = 0
+  for offset in range(start, stop, block_size):
+    size = min(block_size, stop - offset)
+    view = block[:size]
+    np.add(base[:size], offset, out=view)
+    np.multiply(view, view, out=view)
+    total += int(view.sum())
+  return total
+
+
+def numpy_sum(number, block_size=BLOCK_SIZE):
+  return numpy_range_sum(0, number, block_size)
+
+
+BACKENDS = {
+    "python": python_sum,
+    "numpy": numpy_sum,
+    "closed_form": closed_form_sum,
+}
+
+# the same backends over a sub-range [start, stop), used when one input is split across several workers
+RANGE_BACKENDS = {
+    "python": python_range_sum,
+    "numpy": numpy_range_sum,
+    "closed_form": closed_form_range_sum,
+}
+
+
+def get_backend(name, ranged=False):
+  if name not in BACKENDS:
+    raise ValueError(f"Unknown backend {name}, choose from {', '.join(BACKENDS)}")
+  if name == "numpy" and np is None:
+    raise ValueError("The numpy backend needs numpy installed (pip3 install numpy)")
+  return RANGE_BACKENDS[name] if ranged else BACKENDS[name]
+
+
+def check(numbers):
+  # every backend has to be bit-identical to the pure-Python reference, including the small and block boundary cases
+  edge_cases = [0, 1, 2, 3, BLOCK_SIZE - 1, BLOCK_SIZE, BLOCK_SIZE + 1, 3 * BLOCK_SIZE + 7]
+  failures = 0
+  for name in BACKENDS:
+    if name == "numpy" and np is None:
+      print(f"{name}: skipped, numpy is not installed")
+      continue
+    backend = BACKENDS[name]
+    for number in edge_cases + list(numbers):
+      expected, got = python_sum(number), backend(number)
+      if expected != got:
+        failures += 1
+        print(f"{name}: cpu_bound({number}) == {got}, expected {expected}")
+    # a split sum has to add up to exactly the same value
+    range_backend = RANGE_BACKENDS[name]
+    for number in edge_cases:
+      middle = number // 3
+      got = range_backend(0, middle) + range_backend(middle, number)
+      if python_sum(number) != got:
+        failures += 1
+        print(f"{name}: split cpu_bound({number}) == {got}, expected {python_sum(number)}")
+    print(f"{name}: checked {len(edge_cases) + len(numbers)} inputs")
+  return failures == 0
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--check", action="store_true", help="compare every backend against the pure-Python reference")
+  ns = parser.parse_args()
+  numbers = [5_000_000 + x for x in range(20)]
+
+  if ns.check:
+    raise SystemExit(0 if check(numbers) else 1)
+
+  for name in BACKENDS:
+    if name == "numpy" and np is None:
+      continue
+    backend = BACKENDS[name]
+    start_time = time.time()
+    for number in numbers:
+      backend(number)
+    duration = time.time() - start_time
+    print(f"{name}: Duration {duration} seconds")
+  # python: Duration 11.452936887741089 seconds
+  # numpy: Duration 0.11553359031677246 seconds
+  # closed_form: Duration 2.4557113647460938e-05 seconds
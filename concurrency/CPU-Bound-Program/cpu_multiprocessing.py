@@ -1,23 +1,114 @@
+import argparse
 import multiprocessing
+import struct
 import time
+from multiprocessing import shared_memory
+
+import cpu_backends
+import cpu_scheduler
 
 
 def cpu_bound(number):
   return sum(i * i for i in range(number))
 
 
-def find_sums(numbers):
+# inputs are int64, a sum of squares outgrows int64, so the result slots are sized from the largest input
+INPUT_FORMAT = "<q"
+
+# the segments of the find_sums_shared call a worker is serving, attached on its first task of that call
+attached = {}
+
+
+def result_size(numbers):
+  # sum(i * i for i in range(n)) < n**3 / 3, plus a sign bit, in whole bytes and never less than 8
+  largest = max(max(numbers, default=0), 0)
+  return max(8, ((largest ** 3 // 3).bit_length() + 1 + 7) // 8)
+
+
+def attach_shared(inputs_name, results_name):
+  # Attaching once per call and not once per task, in a multiprocessing.Pool as well as in a long-lived WorkerPool
+  # The segments of a previous call are unlinked by now, the worker lets go of its mapping of them
+  # The workers share the parent's resource tracker, so attaching doesn't make them unlink the segments
+  key = (inputs_name, results_name)
+  if key not in attached:
+    for segment in attached.pop(next(iter(attached), None), ()):
+      segment.close()
+    attached[key] = (shared_memory.SharedMemory(name=inputs_name), shared_memory.SharedMemory(name=results_name))
+  return attached[key]
+
+
+def shared_task(task):
+  inputs_name, results_name, slot_size, index, backend = task
+  inputs, results = attach_shared(inputs_name, results_name)
+  number, = struct.unpack_from(INPUT_FORMAT, inputs.buf, index * struct.calcsize(INPUT_FORMAT))
+  compute = cpu_bound if backend == "python" else cpu_backends.get_backend(backend)
+  result = compute(number)
+  offset = index * slot_size
+  results.buf[offset:offset + slot_size] = result.to_bytes(slot_size, "little", signed=True)
+  return index
+
+
+def find_sums_shared(numbers, backend="python", processes=None, pool=None):
+  # pool.map pickles every input to the workers and every result back,
+  # here both live in shared memory and only the indices and the segment names travel through the pool's pipes
+  item_size = struct.calcsize(INPUT_FORMAT)
+  slot_size = result_size(numbers)
+  size = max(len(numbers), 1)
+  inputs = shared_memory.SharedMemory(create=True, size=size * item_size)
+  results = shared_memory.SharedMemory(create=True, size=size * slot_size)
+  try:
+    for index, number in enumerate(numbers):
+      struct.pack_into(INPUT_FORMAT, inputs.buf, index * item_size, number)
+    tasks = [(inputs.name, results.name, slot_size, index, backend) for index in range(len(numbers))]
+    if pool is not None:
+      # a started worker_pool.WorkerPool, its workers attach on their first task of this call
+      pool.map(shared_task, tasks)
+    else:
+      with multiprocessing.Pool(processes) as new_pool:
+        new_pool.map(shared_task, tasks)
+    return [
+        int.from_bytes(results.buf[index * slot_size:(index + 1) * slot_size], "little", signed=True)
+        for index in range(len(numbers))
+    ]
+  finally:
+    for segment in (inputs, results):
+      segment.close()
+      segment.unlink()
+
+
+def find_sums(numbers, backend="python", split=False, pool=None, transport="pickle"):
+  if transport == "shared_memory":
+    if split:
+      # split mode sends small sub-range tasks and adds their partial sums up in the parent, there is nothing to share
+      raise ValueError("split=True only works with the pickle transport")
+    return find_sums_shared(numbers, backend, pool=pool)
+  if transport != "pickle":
+    raise ValueError(f"Unknown transport {transport}")
+  if split:
+    # every input is cut into sub-ranges spread over all the workers, see cpu_scheduler.py
+    sums, report = cpu_scheduler.find_sums_split(numbers, backend=backend, pool=pool)
+    return sums
+  # the backend functions are module-level, so they can be pickled and sent to the worker-processes like cpu_bound
+  compute = cpu_bound if backend == "python" else cpu_backends.get_backend(backend)
+  if pool is not None:
+    # a started worker_pool.WorkerPool skips the process spawn and import cost that a new Pool pays on every call
+    return pool.map(compute, numbers)
   with multiprocessing.Pool() as pool:
     # create a multiprocessing.Pool object and use its map() method to send individual numbers to worker-processes as they become free
     # By default, the number of pools will be determined by the number of CPUs in the machine, createing a process for each one
-    pool.map(cpu_bound, numbers)
+    return pool.map(compute, numbers)
 
 
 if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--backend", choices=cpu_backends.BACKENDS, default="python")
+  parser.add_argument("--split", action="store_true", help="split every input into sub-ranges for load balancing")
+  parser.add_argument("--transport", choices=["pickle", "shared_memory"], default="pickle")
+  ns = parser.parse_args()
   numbers = [5_000_000 + x for x in range(20)]
 
   start_time = time.time()
-  find_sums(numbers)
+  find_sums(numbers, ns.backend, ns.split, transport=ns.transport)
   duration = time.time() - start_time
   print(f"Duration {duration} seconds")
   # Duration 2.626873016357422 seconds
\ No newline at end of file
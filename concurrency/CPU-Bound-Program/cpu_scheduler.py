@@ -0,0 +1,86 @@
+import argparse
+import contextlib
+import math
+import multiprocessing
+import os
+import time
+
+import cpu_backends
+
+
+def plan_chunks(numbers, workers, tasks_per_worker=4, min_chunk=50_000):
+  # pool.map(cpu_bound, numbers) makes one task per input, so 20 inputs on 16 cores leave 12 cores idle in the second round
+  # and a single huge input runs on one core no matter how many there are
+  # Instead the total work is cut into about tasks_per_worker chunks per worker, a few per worker so that
+  # the ones finishing early pick up more, and every input is split into sub-ranges of roughly that size
+  total = sum(max(number, 0) for number in numbers)
+  chunk = max(min_chunk, math.ceil(total / (workers * tasks_per_worker)))
+  tasks = []
+  for index, number in enumerate(numbers):
+    pieces = max(1, math.ceil(number / chunk))
+    # equal pieces instead of chunk-sized ones with a small leftover at the end
+    bounds = [number * piece // pieces for piece in range(pieces + 1)]
+    tasks.extend((index, start, stop) for start, stop in zip(bounds, bounds[1:]))
+  # the largest ranges first, so a big one is not left alone at the very end
+  tasks.sort(key=lambda task: task[2] - task[1], reverse=True)
+  return tasks
+
+
+def range_task(task):
+  index, start, stop, backend = task
+  compute = cpu_backends.get_backend(backend, ranged=True)
+  started = time.perf_counter()
+  partial = compute(start, stop)
+  busy = time.perf_counter() - started
+  return index, partial, multiprocessing.current_process().name, busy
+
+
+def find_sums_split(numbers, processes=None, backend="python", tasks_per_worker=4, pool=None):
+  # pool is an already started worker_pool.WorkerPool, without one a fresh multiprocessing.Pool is created for the call
+  if pool is not None:
+    processes = pool.processes
+  processes = processes or os.cpu_count()
+  tasks = [(index, start, stop, backend) for index, start, stop in plan_chunks(numbers, processes, tasks_per_worker)]
+  sums = [0] * len(numbers)
+  busy = {}
+  started = time.perf_counter()
+  with contextlib.ExitStack() as stack:
+    if pool is None:
+      pool = stack.enter_context(multiprocessing.Pool(processes))
+    # chunksize=1 so every sub-range goes to whichever worker is free next, that is the load balancing
+    for index, partial, worker, seconds in pool.imap_unordered(range_task, tasks, chunksize=1):
+      # the partial sums of one input are reduced as they arrive, in any order, addition of ints is exact
+      sums[index] += partial
+      busy[worker] = busy.get(worker, 0.0) + seconds
+  wall = time.perf_counter() - started
+  report = {
+      "tasks": len(tasks),
+      "wall": wall,
+      # fraction of the wall time each worker spent computing, the rest is waiting or startup
+      "utilization": {worker: seconds / wall for worker, seconds in sorted(busy.items())},
+  }
+  return sums, report
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--backend", choices=cpu_backends.BACKENDS, default="python")
+  parser.add_argument("--processes", type=int, default=None)
+  parser.add_argument("--uneven", action="store_true", help="one huge input next to small ones")
+  ns = parser.parse_args()
+  numbers = [5_000_000 + x for x in range(20)]
+  if ns.uneven:
+    numbers = [50_000_000] + [100_000 + x for x in range(19)]
+
+  start_time = time.time()
+  with multiprocessing.Pool(ns.processes) as pool:
+    pool.map(cpu_backends.get_backend(ns.backend), numbers)
+  duration = time.time() - start_time
+  print(f"One task per input: Duration {duration} seconds")
+
+  start_time = time.time()
+  sums, report = find_sums_split(numbers, ns.processes, ns.backend)
+  duration = time.time() - start_time
+  print(f"Split into {report['tasks']} sub-ranges: Duration {duration} seconds")
+  for worker, utilization in report["utilization"].items():
+    print(f"  {worker}: {utilization:.0%} busy")
@@ -1,20 +1,27 @@
+import argparse
 import time
 
+import cpu_backends
+
 
 def cpu_bound(number):
   return sum(i * i for i in range(number))
 
 
-def find_sums(numbers):
-  for number in numbers:
-    cpu_bound(number)
+def find_sums(numbers, backend="python"):
+  # "python" is cpu_bound above, "numpy" and "closed_form" compute the same sums faster (see cpu_backends.py)
+  compute = cpu_bound if backend == "python" else cpu_backends.get_backend(backend)
+  return [compute(number) for number in numbers]
 
 
 if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--backend", choices=cpu_backends.BACKENDS, default="python")
+  ns = parser.parse_args()
   numbers = [5_000_000 + x for x in range(20)]
 
   start_time = time.time()
-  find_sums(numbers)
+  find_sums(numbers, ns.backend)
   duration = time.time() - start_time
   print(f"Duration {duration} seconds")
   # Duration 7.888615131378174 seconds
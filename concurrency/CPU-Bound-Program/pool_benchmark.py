@@ -0,0 +1,53 @@
+import argparse
+import multiprocessing
+import statistics
+import time
+
+import cpu_multiprocessing
+import worker_pool
+
+
+def measure(calls, numbers, backend, pool=None):
+  latencies = []
+  for _ in range(calls):
+    start = time.perf_counter()
+    cpu_multiprocessing.find_sums(numbers, backend, pool=pool)
+    latencies.append(time.perf_counter() - start)
+  return latencies
+
+
+def describe(name, latencies):
+  ms = [latency * 1000 for latency in latencies]
+  print(f"{name:<24} first {ms[0]:8.1f} ms   median {statistics.median(ms):8.1f} ms   max {max(ms):8.1f} ms")
+
+
+if __name__ == "__main__":
+  # In a service find_sums runs once per request, so the cost of creating the Pool is paid per request
+  # This compares that (cold) with calls into one pool that was started beforehand (warm), for every start method
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--calls", type=int, default=20)
+  parser.add_argument("--processes", type=int, default=None)
+  parser.add_argument("--backend", default="python")
+  ns = parser.parse_args()
+  # small inputs, so the pool overhead and not the sums dominates the latency of a call
+  numbers = [10_000 + x for x in range(20)]
+
+  for method in multiprocessing.get_all_start_methods():
+    # cold: a new Pool per call, like find_sums(numbers) without a pool
+    multiprocessing.set_start_method(method, force=True)
+    describe(f"{method} cold", measure(ns.calls, numbers, ns.backend))
+
+    start = time.perf_counter()
+    with worker_pool.WorkerPool(ns.processes, start_method=method, preload=["cpu_backends"]) as pool:
+      startup = time.perf_counter() - start
+      describe(f"{method} warm", measure(ns.calls, numbers, ns.backend, pool))
+    print(f"{'':<24} (warm pool start-up {startup * 1000:.1f} ms, paid once)")
+  # fork cold                first     41.1 ms   median     34.4 ms   max     42.3 ms
+  # fork warm                first     22.7 ms   median     22.6 ms   max     27.7 ms
+  #                          (warm pool start-up 26.1 ms, paid once)
+  # spawn cold               first    391.1 ms   median    257.4 ms   max    391.1 ms
+  # spawn warm               first     22.9 ms   median     24.4 ms   max     30.7 ms
+  #                          (warm pool start-up 1019.5 ms, paid once)
+  # forkserver cold          first    225.5 ms   median    173.3 ms   max    225.5 ms
+  # forkserver warm          first     21.2 ms   median     19.7 ms   max     24.5 ms
+  #                          (warm pool start-up 598.2 ms, paid once)
@@ -0,0 +1,71 @@
+import importlib
+import multiprocessing
+import os
+
+
+def _preload(modules):
+  # runs once in every worker, so the imports are paid when the pool starts and not by the first call that needs them
+  for name in modules:
+    importlib.import_module(name)
+
+
+def _ping(_):
+  return os.getpid()
+
+
+class WorkerPool:
+  """
+  A long-lived multiprocessing pool, started once and reused across calls instead of being created per call.
+  """
+  def __init__(self, processes=None, start_method=None, preload=()):
+    self.processes = processes or os.cpu_count()
+    # "fork" copies the parent and starts fastest, "spawn" starts a fresh interpreter and is the only one on Windows,
+    # "forkserver" forks the workers from a small server process that has already imported the preload modules
+    self.start_method = start_method
+    self.preload = tuple(preload)
+    self._pool = None
+
+  @property
+  def started(self):
+    return self._pool is not None
+
+  def start(self):
+    if self._pool is not None:
+      return self
+    context = multiprocessing.get_context(self.start_method)
+    if context.get_start_method() == "forkserver" and self.preload:
+      context.set_forkserver_preload(list(self.preload))
+    self._pool = context.Pool(self.processes, initializer=_preload, initargs=(self.preload,))
+    # Pool() returns before the workers have finished starting and importing,
+    # a round of no-op tasks waits for them so start() really leaves the pool warm
+    self._pool.map(_ping, range(self.processes * 2), chunksize=1)
+    return self
+
+  def _require_started(self):
+    if self._pool is None:
+      raise RuntimeError("WorkerPool is not started, call start() or use it as a context manager")
+    return self._pool
+
+  def map(self, fn, iterable, chunksize=None):
+    return self._require_started().map(fn, iterable, chunksize)
+
+  def imap_unordered(self, fn, iterable, chunksize=1):
+    return self._require_started().imap_unordered(fn, iterable, chunksize)
+
+  def shutdown(self, wait=True):
+    if self._pool is None:
+      return
+    pool, self._pool = self._pool, None
+    if wait:
+      # let the queued tasks finish, then let the workers exit normally
+      pool.close()
+    else:
+      pool.terminate()
+    pool.join()
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, *exc_info):
+    self.shutdown(wait=exc_info[0] is None)
+    return False
@@ -0,0 +1,147 @@
+import concurrent.futures
+import queue
+import threading
+import time
+
+
+class AdaptiveThreadPool:
+  """
+  Thread pool whose number of active workers follows the observed throughput and latency (AIMD, like TCP congestion control).
+  """
+  def __init__(self, max_workers=64, min_workers=1, initial_workers=4, window=0.25,
+               increase=2, decrease=0.5, latency_tolerance=2.0):
+    self.max_workers = max_workers
+    self.min_workers = min_workers
+    self.window = window
+    self.increase = increase
+    self.decrease = decrease
+    # latency this many times above the best window seen so far is taken as a sign that the remote is overloaded
+    self.latency_tolerance = latency_tolerance
+    # (seconds since start, active workers, completions per second, mean latency) for every window
+    self.history = []
+
+    self._limit = max(min_workers, min(initial_workers, max_workers))
+    self._queue = queue.Queue()
+    self._threads = []
+    # Workers beyond the current limit park on this condition instead of exiting,
+    # so they keep their thread-local requests.Session for when the limit grows again
+    self._cond = threading.Condition()
+    self._shutdown = False
+    self._stats_lock = threading.Lock()
+    self._completed = 0
+    self._errors = 0
+    self._latency_sum = 0.0
+    self._baseline_latency = None
+    # like TCP slow start, the limit doubles until the first sign of overload, then grows additively
+    self._slow_start = True
+    self._start_time = time.perf_counter()
+    self._last_adjust = self._start_time
+    self._stop = threading.Event()
+    self._controller = threading.Thread(target=self._control, name="AdaptiveThreadPool-controller", daemon=True)
+    with self._cond:
+      self._spawn()
+    self._controller.start()
+
+  def _spawn(self):
+    # called with the condition held, threads are only ever created up to the current limit
+    while len(self._threads) < self._limit:
+      thread = threading.Thread(
+          target=self._worker,
+          args=(len(self._threads),),
+          name=f"AdaptiveThreadPool-{len(self._threads)}",
+          daemon=True,
+      )
+      self._threads.append(thread)
+      thread.start()
+
+  def _worker(self, worker_id):
+    while True:
+      with self._cond:
+        while worker_id >= self._limit and not self._shutdown:
+          self._cond.wait()
+      item = self._queue.get()
+      if item is None:
+        return
+      future, fn, args, kwargs = item
+      if not future.set_running_or_notify_cancel():
+        continue
+      start = time.perf_counter()
+      try:
+        future.set_result(fn(*args, **kwargs))
+        failed = False
+      except BaseException as exc:
+        future.set_exception(exc)
+        failed = True
+      latency = time.perf_counter() - start
+      with self._stats_lock:
+        self._completed += 1
+        self._errors += failed
+        self._latency_sum += latency
+
+  def _control(self):
+    while not self._stop.wait(self.window):
+      self._adjust()
+
+  def _adjust(self):
+    now = time.perf_counter()
+    with self._stats_lock:
+      completed, errors, latency_sum = self._completed, self._errors, self._latency_sum
+      self._completed, self._errors, self._latency_sum = 0, 0, 0.0
+    elapsed, self._last_adjust = now - self._last_adjust, now
+    # an idle window says nothing about the remote
+    if completed == 0:
+      return
+    throughput = completed / elapsed
+    latency = latency_sum / completed
+    if self._baseline_latency is None or latency < self._baseline_latency:
+      self._baseline_latency = latency
+
+    with self._cond:
+      if self._shutdown:
+        return
+      self.history.append((now - self._start_time, self._limit, throughput, latency))
+      if errors or latency > self._baseline_latency * self.latency_tolerance:
+        # multiplicative decrease: back off quickly when the remote throttles or fails
+        self._slow_start = False
+        self._limit = max(self.min_workers, int(self._limit * self.decrease))
+      elif self._slow_start:
+        self._limit = min(self.max_workers, self._limit * 2)
+      else:
+        # additive increase: probe for more concurrency one step at a time
+        self._limit = min(self.max_workers, self._limit + self.increase)
+      self._spawn()
+      self._cond.notify_all()
+
+  @property
+  def concurrency(self):
+    return self._limit
+
+  def submit(self, fn, *args, **kwargs):
+    future = concurrent.futures.Future()
+    self._queue.put((future, fn, args, kwargs))
+    return future
+
+  def map(self, fn, *iterables):
+    # same ordering as Executor.map, the futures are created up front but only limit of them run at a time
+    futures = [self.submit(fn, *args) for args in zip(*iterables)]
+    return [future.result() for future in futures]
+
+  def shutdown(self, wait=True):
+    self._stop.set()
+    with self._cond:
+      self._shutdown = True
+      self._cond.notify_all()
+      threads = list(self._threads)
+    for _ in threads:
+      self._queue.put(None)
+    if wait:
+      for thread in threads:
+        thread.join()
+      self._controller.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.shutdown(wait=True)
+    return False
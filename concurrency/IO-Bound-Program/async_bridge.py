@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import aiohttp
+
+import io_asyncio
+import io_threading
+import local_server
+import loop_backend
+import streaming
+
+# the cancellation flag of the call a bridge thread is running, see cancelled()
+_current = threading.local()
+
+
+def cancelled():
+  # A thread can't be interrupted, so a call that is cancelled or times out while it runs keeps its thread until it returns
+  # Blocking code that loops (over chunks, pages, retries) can check this and stop early, its result is discarded anyway
+  token = getattr(_current, "token", None)
+  return token is not None and token.is_set()
+
+
+class BridgeMetrics:
+  # Updated from the event loop and from the bridge threads, so every change goes through the lock
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.waiting = 0      # callers in the event loop waiting for a slot
+    self.queued = 0       # submitted to the executor, no thread free yet
+    self.running = 0
+    self.completed = 0
+    self.failed = 0
+    self.cancelled = 0    # cancelled or timed out before a thread picked them up, never ran
+    self.abandoned = 0    # cancelled or timed out while running, the thread finished them for nothing
+    self.max_depth = 0    # most calls waiting + queued at once
+    self.max_running = 0
+    self.queue_wait = 0.0  # total seconds between submit and start
+
+  def change(self, **deltas):
+    with self._lock:
+      for name, delta in deltas.items():
+        setattr(self, name, getattr(self, name) + delta)
+      self.max_depth = max(self.max_depth, self.waiting + self.queued)
+      self.max_running = max(self.max_running, self.running)
+
+  def snapshot(self):
+    with self._lock:
+      return {name: value for name, value in vars(self).items() if not name.startswith("_")}
+
+  def __str__(self):
+    stats = self.snapshot()
+    started = stats["completed"] + stats["failed"] + stats["running"]
+    mean_wait = stats["queue_wait"] / started if started else 0.0
+    return (
+        f"{stats['completed']} completed, {stats['failed']} failed, {stats['cancelled']} cancelled before running, "
+        f"{stats['abandoned']} abandoned while running; now {stats['waiting']} waiting, {stats['queued']} queued, "
+        f"{stats['running']} running; max depth {stats['max_depth']}, max running {stats['max_running']}, "
+        f"mean queue wait {mean_wait * 1000:.1f} ms"
+    )
+
+
+class AsyncBridge:
+  """
+  Runs blocking callables on a bounded, dedicated thread pool and hands back awaitables, for requests code on an asyncio loop.
+  """
+  def __init__(self, max_workers=5, max_queued=None, thread_name_prefix="AsyncBridge"):
+    # Unlike loop.run_in_executor() on the loop's default executor, the pool is only for this bridge,
+    # so slow blocking calls can't take the threads that getaddrinfo() and to_thread() of everybody else need
+    self.max_workers = max_workers
+    # at most max_queued calls wait in the executor's queue on top of the max_workers running,
+    # callers beyond that wait in the event loop, where a timeout or a cancellation costs nothing
+    self.max_queued = max_workers if max_queued is None else max_queued
+    self.metrics = BridgeMetrics()
+    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+    self._slots = asyncio.Semaphore(max_workers + self.max_queued)
+    self._futures = set()
+
+  async def run(self, fn, *args, timeout=None, **kwargs):
+    # fn(*args, **kwargs) on a bridge thread, the timeout covers waiting for a slot as well as the call itself
+    # A cancellation or timeout of the awaiting task cancels the call if it hasn't started, and sets cancelled() if it has
+    return await asyncio.wait_for(self._run(fn, args, kwargs), timeout)
+
+  async def _run(self, fn, args, kwargs):
+    loop = asyncio.get_running_loop()
+    token = threading.Event()
+    self.metrics.change(waiting=1)
+    try:
+      await self._slots.acquire()
+    finally:
+      self.metrics.change(waiting=-1)
+    self.metrics.change(queued=1)
+    future = self._executor.submit(self._call, token, time.perf_counter(), fn, args, kwargs)
+    self._futures.add(future)
+    # the slot is given back when the thread is done with the call, not when the caller stops waiting,
+    # so abandoned calls still count against the bound
+    future.add_done_callback(lambda f: loop.call_soon_threadsafe(self._release, f))
+    try:
+      return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+      # wrap_future has already cancelled the executor's future, which only works if no thread picked it up yet
+      token.set()
+      if not future.cancelled():
+        self.metrics.change(abandoned=1)
+      raise
+
+  def _call(self, token, submitted, fn, args, kwargs):
+    self.metrics.change(queued=-1, running=1, queue_wait=time.perf_counter() - submitted)
+    _current.token = token
+    try:
+      result = fn(*args, **kwargs)
+    except BaseException:
+      self.metrics.change(running=-1, failed=1)
+      raise
+    finally:
+      _current.token = None
+    self.metrics.change(running=-1, completed=1)
+    return result
+
+  def _release(self, future):
+    if future.cancelled():
+      self.metrics.change(queued=-1, cancelled=1)
+    self._futures.discard(future)
+    self._slots.release()
+
+  async def close(self):
+    # Calls still queued are cancelled, the running ones are waited for without blocking the loop
+    for future in list(self._futures):
+      future.cancel()
+    await asyncio.gather(*(asyncio.wrap_future(f) for f in self._futures), return_exceptions=True)
+    self._executor.shutdown(wait=True)
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc_info):
+    await self.close()
+
+
+def fetch(url):
+  # The blocking requests code the bridge is for: every bridge thread reuses its own Session from io_threading.get_session()
+  size = 0
+  with io_threading.get_session().get(url, stream=True) as response:
+    for chunk in response.iter_content(streaming.CHUNK_SIZE):
+      if cancelled():
+        break
+      size += len(chunk)
+  return size
+
+
+async def download_all_sites(sites, max_workers=5, timeout=None):
+  async with AsyncBridge(max_workers=max_workers) as bridge:
+    results = await asyncio.gather(*(bridge.run(fetch, url, timeout=timeout) for url in sites), return_exceptions=True)
+    print(bridge.metrics)
+  return results
+
+
+async def heartbeat(interval, lags):
+  # How late the loop wakes this task up is how long something kept the loop from running anything else
+  loop = asyncio.get_running_loop()
+  while True:
+    expected = loop.time() + interval
+    await asyncio.sleep(interval)
+    lags.append(loop.time() - expected)
+
+
+async def mixed(sites, mode, max_workers):
+  # aiohttp downloads from io_asyncio and blocking requests downloads share one event loop,
+  # the blocking ones either called right on the loop or sent through the bridge
+  lags = []
+  ticker = asyncio.create_task(heartbeat(0.01, lags))
+  start = time.perf_counter()
+  async with aiohttp.ClientSession() as session, AsyncBridge(max_workers=max_workers) as bridge:
+    async def blocking(url):
+      if mode == "inline":
+        return fetch(url)
+      return await bridge.run(fetch, url)
+
+    tasks = [io_asyncio.download_site(session, url) for url in sites[::2]]
+    tasks += [blocking(url) for url in sites[1::2]]
+    await asyncio.gather(*tasks)
+  duration = time.perf_counter() - start
+  ticker.cancel()
+  print(f"{mode:<7} {len(sites)} sites in {duration:5.2f} s, worst loop stall {max(lags, default=0) * 1000:6.1f} ms")
+  if mode == "bridge":
+    print(f"        {bridge.metrics}")
+
+
+async def check():
+  # Timeouts and cancellations reach the blocking calls, and the bridge never goes past its bounds
+  ok = True
+  async with AsyncBridge(max_workers=2, max_queued=2) as bridge:
+    def slow(seconds):
+      deadline = time.perf_counter() + seconds
+      while time.perf_counter() < deadline and not cancelled():
+        time.sleep(0.005)
+      return cancelled()
+
+    results = await asyncio.gather(*(bridge.run(slow, 0.02) for _ in range(20)))
+    metrics = bridge.metrics.snapshot()
+    step = results == [False] * 20 and metrics["max_running"] <= 2 and metrics["waiting"] + metrics["queued"] == 0
+    print(f"bounded: {metrics['max_running']} threads at most, max depth {metrics['max_depth']}: {'ok' if step else 'FAILED'}")
+    ok &= step
+
+    seen = []
+    try:
+      await bridge.run(lambda: seen.append(slow(10)), timeout=0.05)
+      step = False
+    except asyncio.TimeoutError:
+      # the running call sees cancelled() and returns early, the bridge waits for it in close()
+      await asyncio.sleep(0.05)
+      step = seen == [True]
+    print(f"timeout reaches a running call: {'ok' if step else 'FAILED'}")
+    ok &= step
+
+    ran = []
+    blockers = [asyncio.create_task(bridge.run(slow, 0.1)) for _ in range(2)]
+    queued = asyncio.create_task(bridge.run(ran.append, 1))
+    await asyncio.sleep(0.02)
+    queued.cancel()
+    await asyncio.gather(*blockers, queued, return_exceptions=True)
+    step = ran == [] and bridge.metrics.cancelled == 1
+    print(f"cancelling a queued call means it never runs: {'ok' if step else 'FAILED'}")
+    ok &= step
+
+    try:
+      await bridge.run(int, "not a number")
+      step = False
+    except ValueError:
+      step = bridge.metrics.failed == 1
+    print(f"exceptions come back to the awaiting task: {'ok' if step else 'FAILED'}")
+    ok &= step
+  return bool(ok)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Blocking requests downloads driven from the io_asyncio event loop")
+  parser.add_argument("--urls", type=int, default=40)
+  parser.add_argument("--max-workers", type=int, default=5)
+  parser.add_argument("--latency", type=float, default=0.05, help="seconds the bundled local_server sleeps per request")
+  parser.add_argument("--check", action="store_true", help="check timeouts, cancellation and the bounds, then exit")
+  args = parser.parse_args()
+
+  if args.check:
+    raise SystemExit(0 if loop_backend.run(check()) else 1)
+  server = local_server.start_server(latency=args.latency)
+  sites = [f"{server.base_url}/{i}" for i in range(args.urls)]
+  for mode in ("inline", "bridge"):
+    loop_backend.run(mixed(sites, mode, args.max_workers))
+  server.shutdown()
+  # Sample output, without the "Read ..." lines of the aiohttp half:
+  # inline  40 sites in  1.16 s, worst loop stall 1092.7 ms
+  # bridge  40 sites in  0.28 s, worst loop stall   14.8 ms
+  #         20 completed, 0 failed, 0 cancelled before running, 0 abandoned while running; now 0 waiting, 0 queued, 0 running; max depth 15, max running 5, mean queue wait 46.1 ms
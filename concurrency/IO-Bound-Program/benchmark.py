@@ -0,0 +1,290 @@
+import argparse
+import contextlib
+import functools
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+import http_cache
+import local_server
+import loop_backend
+import policy as download_policy
+
+# strategies whose download_all_sites takes a concurrency knob, the others are run once per URL count
+CONCURRENT_STRATEGIES = {"threading", "threading_adaptive", "asyncio_bounded", "multiprocessing", "hybrid"}
+STRATEGIES = ["synchronous", "threading", "threading_adaptive", "asyncio", "asyncio_bounded", "multiprocessing", "hybrid"]
+
+
+def percentile(values, p):
+  # nearest-rank percentile, good enough for a few hundred samples and needs no third party library
+  if not values:
+    return None
+  ordered = sorted(values)
+  index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))
+  return ordered[index]
+
+
+def timed(download_site):
+  # every download_site returns the number of bytes it read,
+  # so the wrapper only adds the per-request latency next to it
+  @functools.wraps(download_site)
+  def wrapper(*args, **kwargs):
+    start = time.perf_counter()
+    try:
+      result = download_site(*args, **kwargs)
+    except Exception:
+      result = None
+    return time.perf_counter() - start, result
+  return wrapper
+
+
+def async_timed(download_site):
+  @functools.wraps(download_site)
+  async def wrapper(*args, **kwargs):
+    start = time.perf_counter()
+    try:
+      result = await download_site(*args, **kwargs)
+    except Exception:
+      result = None
+    return time.perf_counter() - start, result
+  return wrapper
+
+
+def run_strategy(strategy, sites, concurrency, options):
+  # the wrapper replaces the module attribute, so download_all_sites picks it up without being changed
+  # (the multiprocessing pool is forked, therefore the child processes see the wrapped function as well)
+
+  # objects for the strategies that run in this process, plain options for the ones that build them in every worker
+  dest_dir = options["dest_dir"]
+  cache = http_cache.ResponseCache() if options["cache"] else None
+  cache_options = {} if options["cache"] else None
+  policy_options = options["policy"]
+  policy = download_policy.DownloadPolicy(**policy_options) if policy_options is not None else None
+  # the policy's counters, read once the downloads are done (the tuples below are evaluated left to right)
+  report = lambda: policy.report() if policy is not None else None
+
+  if strategy == "synchronous":
+    import io_synchronous
+    io_synchronous.download_site = timed(io_synchronous.download_site)
+    return io_synchronous.download_all_sites(sites, dest_dir=dest_dir, cache=cache, policy=policy), report()
+  if strategy in ("threading", "threading_adaptive"):
+    # for threading_adaptive concurrency is the upper bound, the pool picks the actual number of threads
+    import io_threading
+    io_threading.download_site = timed(io_threading.download_site)
+    return io_threading.download_all_sites(
+        sites, max_workers=concurrency, dest_dir=dest_dir, cache=cache, policy=policy,
+        adaptive=strategy == "threading_adaptive"), report()
+  if strategy == "asyncio":
+    import io_asyncio
+    io_asyncio.download_site = async_timed(io_asyncio.download_site)
+    return loop_backend.run(io_asyncio.download_all_sites(sites, dest_dir=dest_dir, cache=cache, policy=policy)), report()
+  if strategy == "asyncio_bounded":
+    import io_asyncio
+    io_asyncio.download_site = async_timed(io_asyncio.download_site)
+
+    async def collect():
+      return [result async for _, result in io_asyncio.download_sites_bounded(
+          sites, max_in_flight=concurrency, dest_dir=dest_dir, cache=cache, policy=policy)]
+    return loop_backend.run(collect()), report()
+  if strategy == "multiprocessing":
+    import io_multiprocessing
+    multiprocessing.set_start_method("fork", force=True)
+    io_multiprocessing.download_site = timed(io_multiprocessing.download_site)
+    # every worker builds its own policy, their counters come back when the pool is done
+    reports = []
+    results = io_multiprocessing.download_all_sites(
+        sites, processes=concurrency, dest_dir=dest_dir, cache_options=cache_options,
+        policy_options=policy_options, policy_reports=reports)
+    return results, download_policy.merge_reports(reports)
+  if strategy == "hybrid":
+    # concurrency is the number of processes, each one gets about four batches
+    import io_hybrid
+    multiprocessing.set_start_method("fork", force=True)
+    io_hybrid.download_site = async_timed(io_hybrid.download_site)
+    reports = []
+    results = io_hybrid.download_all_sites(
+        sites, processes=concurrency, batch_size=max(1, len(sites) // (concurrency * 4)),
+        policy_options=policy_options, policy_reports=reports, cache_options=cache_options, dest_dir=dest_dir)
+    return results, download_policy.merge_reports(reports)
+  raise ValueError(f"Unknown strategy {strategy}")
+
+
+def run_trial(strategy, base_url, count, concurrency, payload_size, options):
+  # Runs inside a fresh interpreter, so the peak RSS of one trial is not inherited by the next one
+  sites = [f"{base_url}/jython", f"{base_url}/dice"] * (count // 2) + [f"{base_url}/jython"] * (count % 2)
+  start = time.perf_counter()
+  # the downloaders print one line per site, which is not what is measured here
+  with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+    results, policy_stats = run_strategy(strategy, sites, concurrency, options)
+  duration = time.perf_counter() - start
+
+  latencies = []
+  errors = 0
+  for item in results:
+    # asyncio.gather(..., return_exceptions=True) hands back exceptions instead of (latency, size) pairs
+    if not isinstance(item, tuple) or item[1] != payload_size:
+      errors += 1
+    if isinstance(item, tuple):
+      latencies.append(item[0])
+  # ru_maxrss is reported in kilobytes on Linux, the children are the multiprocessing pool workers
+  rss_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+  return {
+      "strategy": strategy,
+      "urls": count,
+      "concurrency": concurrency if strategy in CONCURRENT_STRATEGIES else None,
+      "duration": duration,
+      "throughput": count / duration,
+      "errors": errors,
+      "latencies": latencies,
+      "peak_rss_kb": max(rss_self, rss_children),
+      # retries, timeouts and hedges, added up over the workers for multiprocessing and hybrid
+      "policy_stats": policy_stats,
+  }
+
+
+def spawn_trial(strategy, base_url, count, concurrency, payload_size, options):
+  command = [
+      sys.executable, os.path.abspath(__file__), "--trial", strategy,
+      "--base-url", base_url,
+      "--urls", str(count),
+      "--concurrency", str(concurrency),
+      "--payload-size", str(payload_size),
+      "--options", json.dumps(options),
+  ]
+  output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+  return json.loads(output.strip().splitlines()[-1])
+
+
+def trial_options(ns):
+  policy = None
+  if ns.policy:
+    policy = {"timeout": ns.timeout, "deadline": ns.deadline, "retries": ns.retries, "hedge_after": ns.hedge_after}
+  return {"dest_dir": ns.dest_dir, "cache": ns.cache, "policy": policy}
+
+
+def summarize(trials):
+  latencies = [latency for trial in trials for latency in trial["latencies"]]
+  return {
+      "strategy": trials[0]["strategy"],
+      "urls": trials[0]["urls"],
+      "concurrency": trials[0]["concurrency"],
+      "runs": len(trials),
+      "duration_median": statistics.median(trial["duration"] for trial in trials),
+      "throughput_median": statistics.median(trial["throughput"] for trial in trials),
+      "latency_p50": percentile(latencies, 50),
+      "latency_p95": percentile(latencies, 95),
+      "latency_p99": percentile(latencies, 99),
+      "errors": sum(trial["errors"] for trial in trials),
+      "peak_rss_kb": max(trial["peak_rss_kb"] for trial in trials),
+      "policy_stats": download_policy.merge_reports(trial["policy_stats"] for trial in trials),
+  }
+
+
+def format_table(summaries):
+  header = f"{'strategy':<20}{'urls':>7}{'conc':>6}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'rss MB':>9}{'errors':>8}"
+  lines = [header, "-" * len(header)]
+  for s in summaries:
+    ms = lambda value: f"{value * 1000:.1f}" if value is not None else "-"
+    concurrency = s["concurrency"] if s["concurrency"] is not None else "-"
+    lines.append(
+        f"{s['strategy']:<20}{s['urls']:>7}{concurrency:>6}{s['throughput_median']:>10.1f}"
+        f"{ms(s['latency_p50']):>9}{ms(s['latency_p95']):>9}{ms(s['latency_p99']):>9}"
+        f"{s['peak_rss_kb'] / 1024:>9.1f}{s['errors']:>8}"
+    )
+  return "\n".join(lines)
+
+
+def main(ns):
+  server = local_server.start_server(
+      latency=ns.latency,
+      jitter=ns.jitter,
+      payload_size=ns.payload_size,
+      error_rate=ns.error_rate,
+  )
+  options = trial_options(ns)
+  summaries = []
+  try:
+    for strategy in ns.strategies:
+      for count in ns.urls:
+        # a sweep over concurrency means nothing for the synchronous version or the unbounded asyncio version
+        levels = ns.concurrency if strategy in CONCURRENT_STRATEGIES else [1]
+        for concurrency in levels:
+          trials = [
+              spawn_trial(strategy, server.base_url, count, concurrency, ns.payload_size, options)
+              for _ in range(ns.repeat)
+          ]
+          summaries.append(summarize(trials))
+          print(f"{strategy} urls={count} concurrency={concurrency} done", file=sys.stderr)
+  finally:
+    server.shutdown()
+    server.server_close()
+
+  report = {
+      "server": {
+          "latency": ns.latency,
+          "jitter": ns.jitter,
+          "payload_size": ns.payload_size,
+          "error_rate": ns.error_rate,
+      },
+      "options": options,
+      "repeat": ns.repeat,
+      "results": summaries,
+  }
+  if ns.json:
+    with open(ns.json, "w") as f:
+      json.dump(report, f, indent=2)
+  else:
+    print(json.dumps(report, indent=2))
+  print(format_table(summaries), file=sys.stderr if not ns.json else sys.stdout)
+
+
+if __name__ == "__main__":
+  # Runs the download_all_sites implementations against the same local stand-in server,
+  # each trial in its own interpreter, and reports throughput, per-request latency percentiles and peak RSS
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--strategies", nargs="+", choices=STRATEGIES, default=STRATEGIES)
+  parser.add_argument("--urls", nargs="+", type=int, default=[160])
+  parser.add_argument("--concurrency", nargs="+", type=int, default=[5, 20])
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--latency", type=float, default=0.05)
+  parser.add_argument("--jitter", type=float, default=0.0)
+  parser.add_argument("--payload-size", type=int, default=1024)
+  parser.add_argument("--error-rate", type=float, default=0.0)
+  parser.add_argument("--dest-dir", help="stream the bodies to files in this directory instead of reading them into memory")
+  parser.add_argument("--cache", action="store_true", help="answer duplicate urls from an http_cache.ResponseCache")
+  parser.add_argument("--policy", action="store_true", help="fetch through a policy.DownloadPolicy")
+  parser.add_argument("--timeout", type=float, default=10.0, help="policy: per-request timeout")
+  parser.add_argument("--deadline", type=float, help="policy: total deadline per site including retries")
+  parser.add_argument("--retries", type=int, default=3, help="policy: retries per site")
+  parser.add_argument("--hedge-after", type=float, help="policy: send a hedged request after this many seconds")
+  parser.add_argument("--json", help="write the JSON report to this file instead of stdout")
+  # internal: run a single trial and print its JSON result
+  parser.add_argument("--trial", choices=STRATEGIES, help=argparse.SUPPRESS)
+  parser.add_argument("--base-url", help=argparse.SUPPRESS)
+  parser.add_argument("--options", type=json.loads, help=argparse.SUPPRESS)
+  ns = parser.parse_args()
+
+  if ns.trial:
+    print(json.dumps(run_trial(ns.trial, ns.base_url, ns.urls[0], ns.concurrency[0], ns.payload_size, ns.options)))
+  else:
+    main(ns)
+  # strategy               urls  conc     req/s   p50 ms   p95 ms   p99 ms   rss MB  errors
+  # ---------------------------------------------------------------------------------------
+  # synchronous             160     -      18.4     53.2     59.8     66.2     42.4       0
+  # threading               160     5      88.4     53.9     60.8     66.9     42.9       0
+  # threading               160    20     279.9     60.5     82.8     97.0     44.1       0
+  # threading_adaptive      160     5      85.3     54.9     64.6     72.5     43.3       0
+  # threading_adaptive      160    20     176.6     56.5     69.5     77.5     43.9       0
+  # asyncio                 160     -     839.9    103.0    134.4    140.4     45.5       0
+  # asyncio_bounded         160     5      94.6     51.5     54.3     57.6     45.7       0
+  # asyncio_bounded         160    20     346.1     52.6     60.5     62.9     45.7       0
+  # multiprocessing         160     5      84.7     54.3     67.4     87.1     45.7       0
+  # multiprocessing         160    20     174.3     63.0    127.2    153.1     45.7       0
+  # hybrid                  160     5     449.0    112.2    149.8    160.3     47.3       0
+  # hybrid                  160    20     236.6    209.8    271.0    288.3     47.4       0
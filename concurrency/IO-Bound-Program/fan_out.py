@@ -0,0 +1,90 @@
+import contextlib
+import operator
+import os
+import threading
+
+
+@contextlib.contextmanager
+def thread_stack_size(size):
+  # threading.stack_size applies to the threads created after the call, so it is set only while the workers start
+  # The default is 8MB of virtual memory per thread on Linux, a tiny task needs a small fraction of that
+  if size is None:
+    yield
+    return
+  previous = threading.stack_size(size)
+  try:
+    yield
+  finally:
+    threading.stack_size(previous)
+
+
+def chunked(items, chunk_size):
+  for start in range(0, len(items), chunk_size):
+    yield start, items[start:start + chunk_size]
+
+
+def fan_out(task, items, max_workers=None, chunk_size=None, stack_size=None, reduce=None, initial=0):
+  # Runs task(item) for every item on max_workers threads instead of one thread per item
+  # The items are handed out in chunks, so a worker takes the shared lock once per chunk and not once per item
+  # With reduce, e.g. operator.add, every worker folds its results into a local accumulator without any locking,
+  # and the accumulators are merged once at the end; without it the results come back in the order of the items
+  # initial is the identity of reduce (0 for operator.add), every worker starts from it
+  items = list(items)
+  max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+  chunk_size = chunk_size or max(1, len(items) // (max_workers * 4))
+  chunks = chunked(items, chunk_size)
+  lock = threading.Lock()
+  results = None if reduce is not None else [None] * len(items)
+  partials = []
+  errors = []
+  # set by the first failure, the other workers stop before their next chunk instead of finishing all of them
+  failed = threading.Event()
+
+  def worker():
+    accumulator = initial
+    try:
+      while not failed.is_set():
+        with lock:
+          start, chunk = next(chunks, (None, None))
+        if chunk is None:
+          break
+        if reduce is None:
+          results[start:start + len(chunk)] = [task(item) for item in chunk]
+        else:
+          for item in chunk:
+            accumulator = reduce(accumulator, task(item))
+    except BaseException as error:
+      errors.append(error)
+      failed.set()
+    # list.append is atomic, the partials don't need the lock
+    partials.append(accumulator)
+
+  with thread_stack_size(stack_size):
+    threads = [threading.Thread(target=worker) for _ in range(min(max_workers, len(items)) or 1)]
+    for thread in threads:
+      thread.start()
+  for thread in threads:
+    thread.join()
+  if errors:
+    raise errors[0]
+  if reduce is None:
+    return results
+  total = initial
+  for partial in partials:
+    total = reduce(total, partial)
+  return total
+
+
+def increment_counter(fake_value):
+  # race_problem.increment_counter without the shared global, the increments are counted locally and returned
+  counter = 0
+  for _ in range(100):
+    counter += 1
+  return counter
+
+
+if __name__ == "__main__":
+  fake_data = [x for x in range(5000)]
+  counter = fan_out(increment_counter, fake_data, max_workers=8, stack_size=256 * 1024, reduce=operator.add)
+  print(counter)
+  # 500000
@@ -0,0 +1,77 @@
+import argparse
+import concurrent.futures
+import json
+import operator
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import fan_out
+import race_problem
+
+STACK_SIZE = 256 * 1024
+
+
+def counting_threads(task, seen):
+  # the number of live threads is sampled from inside every task, list.append is atomic and needs no lock
+  def wrapper(item):
+    seen.append(threading.active_count())
+    return task(item)
+  return wrapper
+
+
+def run_trial(mode, items):
+  # Runs inside a fresh interpreter, so the peak RSS of one trial is not inherited by the next one
+  fake_data = list(range(items))
+  seen = [threading.active_count()]
+  start = time.perf_counter()
+  if mode == "thread per item":
+    # race_problem.py as it is, one worker per item and the unprotected global counter
+    race_problem.counter = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=items) as executor:
+      executor.map(counting_threads(race_problem.increment_counter, seen), fake_data)
+    counter = race_problem.counter
+  else:
+    workers = 8
+    stack_size = STACK_SIZE if mode == "fan_out small stack" else None
+    counter = fan_out.fan_out(
+        counting_threads(fan_out.increment_counter, seen), fake_data, max_workers=workers, stack_size=stack_size,
+        reduce=operator.add)
+  duration = time.perf_counter() - start
+  return {
+      "mode": mode,
+      "seconds": duration,
+      "threads": max(seen),
+      "counter": counter,
+      "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+  }
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--items", type=int, default=5000)
+  parser.add_argument("--trial", help=argparse.SUPPRESS)
+  ns = parser.parse_args()
+
+  if ns.trial:
+    print(json.dumps(run_trial(ns.trial, ns.items)))
+    raise SystemExit(0)
+
+  print(f"{'mode':<22} {'seconds':>8} {'threads':>8} {'peak RSS MB':>12} {'counter':>9}")
+  for mode in ("thread per item", "fan_out", "fan_out small stack"):
+    command = [sys.executable, __file__, "--items", str(ns.items), "--trial", mode]
+    result = json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout)
+    print(
+        f"{result['mode']:<22} {result['seconds']:>8.3f} {result['threads']:>8} {result['peak_rss_mb']:>12.1f}"
+        f" {result['counter']:>9}"
+    )
+  print(f"expected counter {ns.items * 100}")
+  # mode                    seconds  threads  peak RSS MB   counter
+  # thread per item           1.539      314        105.9   5000000
+  # fan_out                   0.192        6         18.2   5000000
+  # fan_out small stack       0.185        9         18.5   5000000
+  # expected counter 5000000
+  # (--items 50000; threads is the most threads seen alive by a task, fan_out's workers may finish before the last one starts;
+  # the thread-per-item counter is only right by luck, its increments are not protected)
@@ -0,0 +1,242 @@
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+
+import aiohttp
+
+import streaming
+
+
+class CacheEntry:
+  def __init__(self, body, etag=None, last_modified=None, fetched_at=None):
+    self.body = body
+    # validators sent back to the server, which answers 304 Not Modified instead of the body when they still match
+    self.etag = etag
+    self.last_modified = last_modified
+    self.fetched_at = time.time() if fetched_at is None else fetched_at
+
+  def conditional_headers(self):
+    headers = {}
+    if self.etag:
+      headers["If-None-Match"] = self.etag
+    if self.last_modified:
+      headers["If-Modified-Since"] = self.last_modified
+    return headers
+
+
+def read_response(session, url, timeout=None, headers=None):
+  # one request with requests, a 304 is an answer like a 200, any other error status raises instead of being returned,
+  # so an error page is never handed to the waiters of a coalesced fetch as if it were the body
+  with session.get(url, headers=headers, timeout=timeout) as response:
+    if response.status_code != 304:
+      response.raise_for_status()
+    return response.status_code, response.content, response.headers
+
+
+async def read_response_async(session, url, timeout=None, headers=None):
+  options = {} if timeout is None else {"timeout": aiohttp.ClientTimeout(total=timeout)}
+  async with session.get(url, headers=headers, **options) as response:
+    if response.status != 304:
+      response.raise_for_status()
+    return response.status, await response.read(), response.headers
+
+
+class ResponseCache:
+  """
+  Response cache shared by the synchronous, threading, multiprocessing and asyncio download_site functions.
+  """
+  def __init__(self, max_bytes=64 * 1024 * 1024, max_age=60.0, disk_dir=None):
+    # Entries younger than max_age are served without touching the network,
+    # older ones are revalidated with a conditional request
+    self.max_bytes = max_bytes
+    self.max_age = max_age
+    # The disk tier is write-through and survives the process,
+    # which is also how the processes of a multiprocessing.Pool share what each of them downloaded
+    self.disk_dir = disk_dir
+    if disk_dir is not None:
+      os.makedirs(disk_dir, exist_ok=True)
+    # OrderedDict keeps the least recently used url first, move_to_end() on every hit
+    self._entries = collections.OrderedDict()
+    self._bytes = 0
+    # The cache is used from many threads at once, the lock only guards the bookkeeping,
+    # it is never held across a request or while a body is read from or written to disk
+    self._lock = threading.Lock()
+    # One future per url that is being fetched right now, duplicates wait on it instead of sending their own request
+    self._in_flight = {}
+    self._async_in_flight = {}
+    self.stats = collections.Counter(hits=0, misses=0, coalesced=0, revalidated=0, disk_hits=0, evictions=0)
+
+  def _disk_paths(self, url):
+    name = hashlib.sha1(url.encode()).hexdigest()
+    return os.path.join(self.disk_dir, name), os.path.join(self.disk_dir, name + ".json")
+
+  def _load_from_disk(self, url):
+    if self.disk_dir is None:
+      return None
+    body_path, meta_path = self._disk_paths(url)
+    try:
+      with open(meta_path) as f:
+        meta = json.load(f)
+      with open(body_path, "rb") as f:
+        body = f.read()
+    except (OSError, ValueError):
+      return None
+    return CacheEntry(body, meta["etag"], meta["last_modified"], meta["fetched_at"])
+
+  def _store_on_disk(self, url, entry):
+    if self.disk_dir is None:
+      return
+    # written to temporary files and renamed, so another process never reads half a body
+    body_path, meta_path = self._disk_paths(url)
+    tmp_path = streaming.temporary_path(body_path)
+    with open(tmp_path, "wb") as f:
+      f.write(entry.body)
+    os.replace(tmp_path, body_path)
+    tmp_path = streaming.temporary_path(meta_path)
+    with open(tmp_path, "w") as f:
+      json.dump({"etag": entry.etag, "last_modified": entry.last_modified, "fetched_at": entry.fetched_at}, f)
+    os.replace(tmp_path, meta_path)
+
+  def _store_in_memory(self, url, entry):
+    # called with the lock held
+    old = self._entries.pop(url, None)
+    if old is not None:
+      self._bytes -= len(old.body)
+    # a body larger than the whole budget would only evict everything else, it stays on disk only
+    if len(entry.body) > self.max_bytes:
+      return
+    self._entries[url] = entry
+    self._bytes += len(entry.body)
+    while self._bytes > self.max_bytes:
+      _, evicted = self._entries.popitem(last=False)
+      self._bytes -= len(evicted.body)
+      self.stats["evictions"] += 1
+
+  def _lookup(self, url):
+    # called with the lock held, the memory tier only
+    entry = self._entries.get(url)
+    if entry is not None:
+      self._entries.move_to_end(url)
+    return entry
+
+  def _publish_from_disk(self, url, entry):
+    # an entry read from disk without the lock, another thread may have put a newer one in memory meanwhile
+    if entry is None:
+      return None
+    with self._lock:
+      self.stats["disk_hits"] += 1
+      if url in self._entries:
+        return self._lookup(url)
+      self._store_in_memory(url, entry)
+    return entry
+
+  def _is_fresh(self, entry):
+    return time.time() - entry.fetched_at < self.max_age
+
+  def _update(self, url, entry, status, body, headers):
+    # Shared by the blocking and the asyncio fetch once the response is in, returns the body to hand out
+    # and the entry the caller writes to disk, outside the lock (and off the event loop for fetch_async)
+    if status == 304 and entry is not None:
+      entry.fetched_at = time.time()
+      with self._lock:
+        self.stats["revalidated"] += 1
+        self._store_in_memory(url, entry)
+      return entry.body, entry
+    with self._lock:
+      self.stats["misses"] += 1
+    # other 2xx answers (204, 206) are handed out but never cached
+    if status != 200:
+      return body, None
+    entry = CacheEntry(body, headers.get("ETag"), headers.get("Last-Modified"))
+    with self._lock:
+      self._store_in_memory(url, entry)
+    return body, entry
+
+  def fetch(self, session, url, send=None):
+    # for requests.Session, used by the synchronous, threading and multiprocessing downloaders
+    # send, e.g. policy.fetch, wraps the network request of a miss or a revalidation: send(session, url, send=reader)
+    with self._lock:
+      entry = self._lookup(url)
+    if entry is None and self.disk_dir is not None:
+      entry = self._publish_from_disk(url, self._load_from_disk(url))
+    with self._lock:
+      if entry is not None and self._is_fresh(entry):
+        self.stats["hits"] += 1
+        return entry.body
+      future = self._in_flight.get(url)
+      owner = future is None
+      if owner:
+        future = self._in_flight[url] = concurrent.futures.Future()
+      else:
+        self.stats["coalesced"] += 1
+    if not owner:
+      return future.result()
+
+    try:
+      headers = entry.conditional_headers() if entry is not None else {}
+      reader = functools.partial(read_response, headers=headers)
+      status, body, response_headers = reader(session, url) if send is None else send(session, url, send=reader)
+      body, stored = self._update(url, entry, status, body, response_headers)
+      future.set_result(body)
+    except BaseException as exc:
+      future.set_exception(exc)
+      raise
+    finally:
+      with self._lock:
+        del self._in_flight[url]
+    if stored is not None:
+      self._store_on_disk(url, stored)
+    return body
+
+  async def fetch_async(self, session, url, send=None):
+    # for aiohttp.ClientSession, coalesced tasks await one shared asyncio task instead of blocking their thread
+    # send is the asyncio counterpart of fetch's, e.g. policy.fetch_async
+    # the disk tier is read and written on the loop's default executor, a body on disk never blocks the loop
+    loop = asyncio.get_running_loop()
+    with self._lock:
+      entry = self._lookup(url)
+    if entry is None and self.disk_dir is not None:
+      entry = self._publish_from_disk(url, await loop.run_in_executor(None, self._load_from_disk, url))
+    with self._lock:
+      if entry is not None and self._is_fresh(entry):
+        self.stats["hits"] += 1
+        return entry.body
+      task = self._async_in_flight.get(url)
+      if task is not None:
+        self.stats["coalesced"] += 1
+    if task is None:
+      # The request runs as a task of its own that every caller of the url awaits through shield(),
+      # so a cancelled caller, the first one included, only stops waiting and the others still get the body
+      task = loop.create_task(self._refresh_async(session, url, entry, send))
+      with self._lock:
+        self._async_in_flight[url] = task
+      task.add_done_callback(functools.partial(self._refresh_done, url))
+    return await asyncio.shield(task)
+
+  async def _refresh_async(self, session, url, entry, send):
+    headers = entry.conditional_headers() if entry is not None else {}
+    reader = functools.partial(read_response_async, headers=headers)
+    status, body, response_headers = await (reader(session, url) if send is None else send(session, url, send=reader))
+    body, stored = self._update(url, entry, status, body, response_headers)
+    if stored is not None:
+      await asyncio.get_running_loop().run_in_executor(None, self._store_on_disk, url, stored)
+    return body
+
+  def _refresh_done(self, url, task):
+    # a callback and not a finally in _refresh_async: with eager tasks the task can be done before it is registered
+    with self._lock:
+      if self._async_in_flight.get(url) is task:
+        del self._async_in_flight[url]
+    if not task.cancelled():
+      # nobody may be waiting any more, don't let asyncio log "exception was never retrieved"
+      task.exception()
+
+  def report(self):
+    with self._lock:
+      return dict(self.stats, entries=len(self._entries), bytes=self._bytes)
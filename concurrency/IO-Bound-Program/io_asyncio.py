@@ -1,26 +1,150 @@
 import asyncio
+import functools
+import os
 import time
+import aiofiles
+import aiofiles.os
 import aiohttp
 
+import loop_backend
+import streaming
 
-async def download_site(session, url):
+
+async def stream_to_file(response, path):
+  # aiohttp has no readinto(), but iter_chunked never hands out more than CHUNK_SIZE bytes at a time,
+  # and aiofiles runs the blocking file writes in a thread so they don't stall the event loop
+  tmp_path = streaming.temporary_path(path)
+  written = 0
+  try:
+    async with aiofiles.open(tmp_path, "wb") as f:
+      async for chunk in response.content.iter_chunked(streaming.CHUNK_SIZE):
+        await f.write(chunk)
+        written += len(chunk)
+    await aiofiles.os.replace(tmp_path, path)
+  except BaseException:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    raise
+  return written
+
+
+async def fetch_to_file(session, url, timeout=None, *, path):
+  # one streamed download shaped like policy.read_site_async, so DownloadPolicy.fetch_async can retry and hedge it
+  options = {} if timeout is None else {"timeout": aiohttp.ClientTimeout(total=timeout)}
+  async with session.get(url, **options) as response:
+    response.raise_for_status()
+    return await stream_to_file(response, path)
+
+
+async def write_file(path, body):
+  tmp_path = streaming.temporary_path(path)
+  try:
+    async with aiofiles.open(tmp_path, "wb") as f:
+      await f.write(body)
+    await aiofiles.os.replace(tmp_path, path)
+  except BaseException:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    raise
+  return len(body)
+
+
+async def download_site(session, url, dest_dir=None, cache=None, policy=None):
+  # the same order as io_synchronous.download_site: cache, then dest_dir, then policy, the policy wraps the network requests
+  send = policy.fetch_async if policy is not None else None
+  if cache is not None:
+    # there is no need to make the cache thread-safe for asyncio, but duplicate urls still coalesce onto one request
+    body = await cache.fetch_async(session, url, send=send)
+    if dest_dir is not None:
+      written = await write_file(streaming.site_path(dest_dir, url), body)
+      print("Wrote {0} from {1}".format(written, url))
+      return written
+    print("Read {0} from {1}".format(len(body), url))
+    return len(body)
+  if dest_dir is not None:
+    path = streaming.site_path(dest_dir, url)
+    if policy is not None:
+      written = await policy.fetch_async(session, url, send=functools.partial(fetch_to_file, path=path))
+    else:
+      written = await fetch_to_file(session, url, path=path)
+    print("Wrote {0} from {1}".format(written, url))
+    return written
+  if policy is not None:
+    # failures are retried and timed out here, instead of only being collected by gather(..., return_exceptions=True)
+    body = await policy.fetch_async(session, url)
+    print("Read {0} from {1}".format(len(body), url))
+    return len(body)
   async with session.get(url) as response:
     print("Read {0} from {1}".format(response.content_length, url))
+    return response.content_length
 
 
-async def download_all_sites(sites):
+async def download_all_sites(sites, dest_dir=None, cache=None, policy=None):
   # unlike threading, session is created as a context manager and shared in all the tasks
   # There is no way one task could interrupt another while the session is in a bad state
+  if dest_dir is not None:
+    os.makedirs(dest_dir, exist_ok=True)
   async with aiohttp.ClientSession() as session:
     tasks = []
     for url in sites:
       # creates a list of tasks using asyncio.ensure_future(), which also takes care of starting them
-      task = asyncio.ensure_future(download_site(session, url))
+      task = asyncio.ensure_future(download_site(session, url, dest_dir, cache, policy))
       tasks.append(task)
     # await is the magic that allows the task to hand control back to the event loop
     # When the code awaits a function call, it’s a signal that the call is likely to be something that takes a while and that the task should give up control
     # Once all the tasks are created, asyncio.gather() is used to keep the session context alive until all of the tasks have completed.
-    await asyncio.gather(*tasks, return_exceptions=True)
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _iterate(urls):
+  # accepts both a plain iterable (list, generator, file object) and an async iterable, and pulls one url at a time
+  if hasattr(urls, "__aiter__"):
+    async for url in urls:
+      yield url
+  else:
+    for url in urls:
+      yield url
+
+
+async def _download_site_result(session, url, dest_dir, cache, policy):
+  # the same contract as gather(..., return_exceptions=True): a failing site is reported, not raised
+  try:
+    return url, await download_site(session, url, dest_dir, cache, policy)
+  except Exception as exc:
+    return url, exc
+
+
+async def download_sites_bounded(urls, max_in_flight=100, limit_per_host=0, dest_dir=None, cache=None, policy=None):
+  # download_all_sites creates every task up front, so with hundreds of thousands of urls
+  # the task list, the coroutines and the sockets all grow with the input
+  # Here the urls are pulled lazily and at most max_in_flight tasks exist at any time,
+  # results are yielded as they complete, so memory stays flat regardless of the input size
+
+  # The connector is the connection pool of the shared session,
+  # limit caps the total number of sockets and limit_per_host the sockets to a single host (0 means no per-host limit)
+  if dest_dir is not None:
+    os.makedirs(dest_dir, exist_ok=True)
+  connector = aiohttp.TCPConnector(limit=max_in_flight, limit_per_host=limit_per_host)
+  async with aiohttp.ClientSession(connector=connector) as session:
+    pending = set()
+    try:
+      async for url in _iterate(urls):
+        if len(pending) >= max_in_flight:
+          # the window is full, wait for at least one task to finish before pulling the next url
+          done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+          for task in done:
+            yield task.result()
+        pending.add(asyncio.ensure_future(_download_site_result(session, url, dest_dir, cache, policy)))
+      while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+          yield task.result()
+    finally:
+      # the caller may stop iterating early, tasks still in flight must not outlive the session
+      # (breaking out of the loop only runs this on aclose(), use contextlib.aclosing() to make it immediate)
+      for task in pending:
+        task.cancel()
+      await asyncio.gather(*pending, return_exceptions=True)
 
 
 if __name__ == "__main__":
@@ -54,9 +178,16 @@ if __name__ == "__main__":
   ] * 80
   start_time = time.time()
   # needs to start up the event loop and tell it which tasks to run
-  # after python3.7, asyncio.run() is the counterpart
-  asyncio.get_event_loop().run_until_complete(download_all_sites(sites))
-  # asyncio.run(download_all_sites(sites)) # same as above
+  # after python3.7, asyncio.run() is the counterpart, loop_backend.run() is asyncio.run() on the loop
+  # selected with ASYNC_LOOP, uvloop when it is installed
+  # asyncio.get_event_loop().run_until_complete(download_all_sites(sites)) # the pre-3.7 way
+  loop_backend.run(download_all_sites(sites))
+
+  # with an input too large to hold as tasks, iterate over download_sites_bounded() instead
+  # async def main():
+  #   async for url, result in download_sites_bounded(iter(sites), max_in_flight=50, limit_per_host=10):
+  #     pass
+  # loop_backend.run(main())
   duration = time.time() - start_time
   print(f"Downloaded {len(sites)} sites in {duration} seconds")
   # Downloaded 160 sites in 0.913593053817749 seconds
@@ -0,0 +1,215 @@
+import asyncio
+import functools
+import itertools
+import multiprocessing
+import multiprocessing.util
+import os
+import queue
+import time
+import aiohttp
+
+import http_cache
+import io_asyncio
+import loop_backend
+import policy as download_policy
+import streaming
+
+loop = None
+session = None
+cache = None
+policy = None
+
+
+async def _open_session(limit):
+  # a ClientSession is bound to the loop it is created in, so it has to be created from inside the worker's loop
+  return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit))
+
+
+def _close_session():
+  loop.run_until_complete(session.close())
+  loop.close()
+
+
+def set_global_loop(limit, policy_options=None, cache_options=None):
+  # Like set_global_session in io_multiprocessing, every process of the pool gets its own long-lived state,
+  # only this time it is an event loop and an aiohttp.ClientSession instead of a blocking requests.Session
+  global loop, session, cache, policy
+  # the same loop backend as io_asyncio, uvloop when it is installed and eager tasks with ASYNC_EAGER_TASKS=1
+  loop = loop_backend.new_event_loop()
+  asyncio.set_event_loop(loop)
+  session = loop.run_until_complete(_open_session(limit))
+  # the cache and the policy are built in every process from their options, as in io_multiprocessing
+  if cache_options is not None:
+    cache = http_cache.ResponseCache(**cache_options)
+  if policy_options is not None:
+    policy = download_policy.DownloadPolicy(**policy_options)
+  # closes the session when the worker exits after pool.close()/pool.join()
+  multiprocessing.util.Finalize(None, _close_session, exitpriority=10)
+
+
+async def download_site(session, url, dest_dir=None):
+  # the same order as io_asyncio.download_site: cache, then dest_dir, then policy, the policy wraps the network requests
+  name = multiprocessing.current_process().name
+  send = policy.fetch_async if policy is not None else None
+  if cache is not None:
+    body = await cache.fetch_async(session, url, send=send)
+    if dest_dir is not None:
+      written = await io_asyncio.write_file(streaming.site_path(dest_dir, url), body)
+      print(f"{name}:Wrote {written} from {url}")
+      return written
+    print(f"{name}:Read {len(body)} from {url}")
+    return len(body)
+  if dest_dir is not None:
+    path = streaming.site_path(dest_dir, url)
+    if policy is not None:
+      written = await policy.fetch_async(session, url, send=functools.partial(io_asyncio.fetch_to_file, path=path))
+    else:
+      written = await io_asyncio.fetch_to_file(session, url, path=path)
+    print(f"{name}:Wrote {written} from {url}")
+    return written
+  if policy is not None:
+    body = await policy.fetch_async(session, url)
+    print(f"{name}:Read {len(body)} from {url}")
+    return len(body)
+  async with session.get(url) as response:
+    # unlike io_asyncio the body is read, the point of this version is that parsing and TLS get more than one core
+    body = await response.read()
+    print(f"{name}:Read {len(body)} from {url}")
+    return len(body)
+
+
+async def _download(index, url, results, dest_dir):
+  # every url reports on its own, so a slow one doesn't hold back the others of its batch,
+  # with its position in the input to put it back in order
+  try:
+    result = await download_site(session, url, dest_dir)
+  except Exception as error:
+    result = error
+  results.put((index, url, result))
+
+
+async def _serve(tasks, results, limit, dest_dir):
+  # The worker's event loop keeps taking batches while earlier ones are still downloading,
+  # it only stops taking new ones while limit downloads are in flight
+  pending = set()
+  while True:
+    while len(pending) >= limit:
+      _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    # the blocking get runs in a thread, the downloads already started keep going meanwhile
+    batch = await loop.run_in_executor(None, tasks.get)
+    if batch is None:
+      break
+    pending = {task for task in pending if not task.done()}
+    pending.update(asyncio.ensure_future(_download(index, url, results, dest_dir)) for index, url in batch)
+  await asyncio.gather(*pending)
+
+
+def worker(tasks, results, limit, policy_options, cache_options, dest_dir):
+  set_global_loop(limit, policy_options, cache_options)
+  loop.run_until_complete(_serve(tasks, results, limit, dest_dir))
+  # the last message of every worker, no index or url and the counters of its policy, see _download_indexed
+  results.put((None, None, policy.report() if policy is not None else None))
+
+
+def batched(sites, batch_size):
+  # cut from the iterator only when the task queue has room, see download_sites_hybrid
+  iterator = iter(sites)
+  while True:
+    batch = list(itertools.islice(iterator, batch_size))
+    if not batch:
+      return
+    yield batch
+
+
+def _receive(results, workers):
+  while True:
+    try:
+      return results.get(timeout=1)
+    except queue.Empty:
+      if any(process.exitcode not in (None, 0) for process in workers):
+        raise RuntimeError("a download worker died")
+
+
+def _download_indexed(sites, processes, batch_size, limit_per_process, policy_options, max_batches, policy_reports,
+                      cache_options, dest_dir):
+  # download_sites_hybrid, with the position of each url in sites: (index, url, result) as each download finishes
+  processes = processes or os.cpu_count()
+  if dest_dir is not None:
+    os.makedirs(dest_dir, exist_ok=True)
+  tasks = multiprocessing.Queue(maxsize=max_batches or processes * 2)
+  results = multiprocessing.Queue()
+  workers = [
+      multiprocessing.Process(target=worker, args=(tasks, results, limit_per_process, policy_options, cache_options, dest_dir),
+                              daemon=True)
+      for _ in range(processes)
+  ]
+  for process in workers:
+    process.start()
+  try:
+    batches = batched(enumerate(sites), batch_size)
+    batch = next(batches, None)
+    submitted = received = 0
+    while batch is not None or received < submitted:
+      if batch is not None:
+        try:
+          tasks.put_nowait(batch)
+          submitted += len(batch)
+          batch = next(batches, None)
+          continue
+        except queue.Full:
+          pass
+      index, url, result = _receive(results, workers)
+      received += 1
+      yield index, url, result
+    for _ in workers:
+      tasks.put(None)
+    # every worker reports once on its way out, read before the join so no worker waits on a full pipe
+    for _ in workers:
+      _, _, report = _receive(results, workers)
+      if report is not None and policy_reports is not None:
+        policy_reports.append(report)
+  except BaseException:
+    for process in workers:
+      process.terminate()
+    raise
+  finally:
+    # the None above lets every worker leave its loop and exit normally, so the Finalize closes its session
+    for process in workers:
+      process.join()
+
+
+def download_sites_hybrid(sites, processes=None, batch_size=50, limit_per_process=100, policy_options=None, max_batches=None,
+                          policy_reports=None, cache_options=None, dest_dir=None):
+  # pool.map in io_multiprocessing pickles one url per task and each process handles one request at a time
+  # Here every process runs an event loop with up to limit_per_process requests in flight,
+  # so the network is saturated by asyncio and the CPU work is spread over all cores by multiprocessing
+  # At most max_batches batches wait in the task queue, so a generator of urls is read as the workers catch up,
+  # not drained up front like Pool.imap would do; the (url, result) pairs come back as each download finishes
+  # With policy_options, the policy.report() of every worker is appended to the policy_reports list if one is given
+  # cache_options build a http_cache.ResponseCache in every process, give it a disk_dir to share bodies between them
+  for _, url, result in _download_indexed(
+      sites, processes, batch_size, limit_per_process, policy_options, max_batches, policy_reports, cache_options, dest_dir):
+    yield url, result
+
+
+def download_all_sites(sites, processes=None, batch_size=50, limit_per_process=100, policy_options=None, policy_reports=None,
+                       cache_options=None, dest_dir=None):
+  # the results in the order of sites, like pool.map in io_multiprocessing, whatever order they finish in
+  results = {}
+  for index, _, result in _download_indexed(
+      sites, processes, batch_size, limit_per_process, policy_options, None, policy_reports, cache_options, dest_dir):
+    results[index] = result
+  return [results[index] for index in range(len(results))]
+
+
+if __name__ == "__main__":
+  # A batch_size close to limit_per_process keeps every event loop busy,
+  # several batches per process keep the processes busy when some batches finish early
+  sites = [
+      "https://www.jython.org",
+      "http://olympus.realpython.org/dice",
+  ] * 80
+  start_time = time.time()
+  download_all_sites(sites, batch_size=20)
+  duration = time.time() - start_time
+  print(f"Downloaded {len(sites)} in {duration} seconds")
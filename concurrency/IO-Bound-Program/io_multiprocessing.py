@@ -1,32 +1,133 @@
+import functools
+import os
 import requests
 import multiprocessing
+import multiprocessing.util
 import time
 
+import http_cache
+import policy as download_policy
+import shm_transport
+import streaming
+
 session = None
+buffer = None
+cache = None
+policy = None
+slab = None
+
 
+def _send_report(reports):
+  reports.put(policy.report())
 
-def set_global_session():
+
+def set_global_session(cache_options=None, policy_options=None, slab_handle=None, reports=None):
   # session for each process
-  global session
+  global session, buffer, cache, policy, slab
   if not session:
     session = requests.Session()
+  # and one chunk buffer for each process, used when the bodies are streamed to disk
+  if buffer is None:
+    buffer = streaming.allocate_buffer()
+  # A cache object holds locks and can't be sent to another process, so each process builds its own from the options
+  # Give it a disk_dir to share bodies between the processes, the in-memory tier is per process
+  if cache_options is not None and cache is None:
+    cache = http_cache.ResponseCache(**cache_options)
+  # the same goes for the retry/circuit breaker policy, the breaker state is per process
+  if policy_options is not None and policy is None:
+    policy = download_policy.DownloadPolicy(**policy_options)
+    # its counters are sent back to the parent when the worker exits after pool.close()/pool.join()
+    if reports is not None:
+      multiprocessing.util.Finalize(None, _send_report, args=(reports,), exitpriority=10)
+  # the shared memory slab the bodies are written into when download_all_bodies uses transport="shared_memory"
+  if slab_handle is not None and slab is None:
+    slab = shm_transport.SlabAllocator.attach(*slab_handle)
 
 
-def download_site(url):
+def download_site(url, dest_dir=None):
+  # the same order as io_synchronous.download_site: cache, then dest_dir, then policy, the policy wraps the network requests
+  name = multiprocessing.current_process().name
+  send = policy.fetch if policy is not None else None
+  if cache is not None:
+    body = cache.fetch(session, url, send=send)
+    if dest_dir is not None:
+      written = streaming.write_file(streaming.site_path(dest_dir, url), body)
+      print(f"{name}:Wrote {written} from {url}")
+      return written
+    print(f"{name}:Read {len(body)} from {url}")
+    return len(body)
+  if dest_dir is not None:
+    path = streaming.site_path(dest_dir, url)
+    if policy is not None:
+      written = policy.fetch(session, url, send=functools.partial(streaming.fetch_to_file, path=path))
+    else:
+      written = streaming.fetch_to_file(session, url, path=path, buffer=buffer)
+    print(f"{name}:Wrote {written} from {url}")
+    return written
+  if policy is not None:
+    body = policy.fetch(session, url)
+    print(f"{name}:Read {len(body)} from {url}")
+    return len(body)
   with session.get(url) as response:
-    name = multiprocessing.current_process().name
     print(f"{name}:Read {len(response.content)} from {url}")
+    return len(response.content)
 
 
-def download_all_sites(sites):
+def download_all_sites(sites, processes=None, dest_dir=None, cache_options=None, policy_options=None, policy_reports=None):
+  # With policy_options, the policy.report() of every worker is appended to the policy_reports list if one is given
+  processes = processes or os.cpu_count()
+  reports = multiprocessing.Queue() if policy_options is not None and policy_reports is not None else None
   # By default, multiprocessing.Pool() will determine the number of CPUs in your computer and match that
-  with multiprocessing.Pool(initializer=set_global_session) as pool:
+  with multiprocessing.Pool(processes=processes, initializer=set_global_session, initargs=(cache_options, policy_options, None, reports)) as pool:
     # The pool creates a number of separate Python interpreter processes,
     # and has each one run the specified function on some of the items in the iterable
     # The communication between the main process and the other processes is handled by the multiprocessing module
 
     # Since the processes doesn't share the same memory, initializer=set_global_session part creates a session for each processes
-    pool.map(download_site, sites)
+    if dest_dir is not None:
+      os.makedirs(dest_dir, exist_ok=True)
+    results = pool.map(functools.partial(download_site, dest_dir=dest_dir), sites)
+    # leaving the with block would terminate() the workers before their reports are sent, close() lets them exit
+    pool.close()
+    pool.join()
+  if reports is not None:
+    policy_reports.extend(reports.get(timeout=5) for _ in range(processes))
+  return results
+
+
+def download_body(task):
+  index, url = task
+  if slab is None:
+    # the whole body is pickled by the worker and unpickled by the parent
+    with session.get(url) as response:
+      return index, (None, response.content)
+  # the body is read straight into a slot of the shared memory slab, only (slot, length) is pickled
+  with session.get(url, stream=True) as response:
+    response.raw.decode_content = True
+    return index, slab.fill(response.raw.readinto)
+
+
+def download_all_bodies(sites, processes=None, transport="pickle", slot_size=256 * 1024):
+  # Unlike download_all_sites this hands the bodies back to the parent, which is where pickling them gets expensive
+  processes = processes or os.cpu_count()
+  bodies = [None] * len(sites)
+  slab_handle = None
+  if transport == "shared_memory":
+    # a few slots per process, a worker waits for a free slot when the parent falls behind
+    transport_slab = shm_transport.SlabAllocator.create(slot_size, processes * 4)
+    slab_handle = transport_slab.handle()
+  elif transport != "pickle":
+    raise ValueError(f"Unknown transport {transport}")
+  try:
+    with multiprocessing.Pool(processes=processes, initializer=set_global_session, initargs=(None, None, slab_handle)) as pool:
+      # imap_unordered and not map: the parent has to free slots while the workers still run,
+      # and an ordered imap could wait for one result while the slots are all held by later ones
+      for index, descriptor in pool.imap_unordered(download_body, enumerate(sites)):
+        bodies[index] = transport_slab.read(descriptor) if slab_handle is not None else descriptor[1]
+  finally:
+    if slab_handle is not None:
+      transport_slab.close()
+  return bodies
 
 
 if __name__ == "__main__":
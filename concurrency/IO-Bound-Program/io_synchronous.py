@@ -1,16 +1,52 @@
+import functools
+import os
 import requests
 import time
 
+import streaming
 
-def download_site(url, session):
+
+def download_site(url, session, dest_dir=None, buffer=None, cache=None, policy=None):
+  # The options combine, checked in the same order by all four downloaders: cache, then dest_dir, then policy
+  # The policy wraps whatever goes to the network, the cache's misses and revalidations as well as the streamed downloads
+  send = policy.fetch if policy is not None else None
+  if cache is not None:
+    # duplicate urls are answered from the cache, a cached body is in memory anyway, with dest_dir it is written out from there
+    body = cache.fetch(session, url, send=send)
+    if dest_dir is not None:
+      written = streaming.write_file(streaming.site_path(dest_dir, url), body)
+      print(f"Wrote {written} from {url}")
+      return written
+    print(f"Read {len(body)} from {url}")
+    return len(body)
+  if dest_dir is not None:
+    # stream=True defers reading the body, so it can be copied to disk chunk by chunk instead of into response.content
+    path = streaming.site_path(dest_dir, url)
+    if policy is not None:
+      # every attempt gets a buffer of its own, hedged attempts run at the same time
+      written = policy.fetch(session, url, send=functools.partial(streaming.fetch_to_file, path=path))
+    else:
+      written = streaming.fetch_to_file(session, url, path=path, buffer=buffer)
+    print(f"Wrote {written} from {url}")
+    return written
+  if policy is not None:
+    # timeouts, retries with backoff, circuit breaking and hedging, a bad url fails on its own instead of hanging the loop
+    body = policy.fetch(session, url)
+    print(f"Read {len(body)} from {url}")
+    return len(body)
   with session.get(url) as response:
     print(f"Read {len(response.content)} from {url}")
+    return len(response.content)
 
 
-def download_all_sites(sites):
+def download_all_sites(sites, dest_dir=None, cache=None, policy=None):
+  # there is only one worker, so a single buffer is reused for every site
+  buffer = None
+  if dest_dir is not None:
+    os.makedirs(dest_dir, exist_ok=True)
+    buffer = streaming.allocate_buffer()
   with requests.Session() as session:
-    for url in sites:
-      download_site(url, session)
+    return [download_site(url, session, dest_dir, buffer, cache, policy) for url in sites]
 
 
 if __name__ == "__main__":
@@ -1,8 +1,13 @@
 import concurrent.futures
+import functools
+import os
 import requests
 import threading
 import time
 
+import adaptive_pool
+import streaming
+
 # you only want to create one of these objects, not one for each thread. 
 # The object itself takes care of separating accesses from different threads to different data.
 thread_local = threading.local()
@@ -28,19 +33,63 @@ def get_session():
   return thread_local.session
 
 
-def download_site(url):
+def get_buffer():
+  # the chunk buffer follows the same thread local pattern as the session, one per thread, reused for every site
+  if not hasattr(thread_local, "buffer"):
+    thread_local.buffer = streaming.allocate_buffer()
+  return thread_local.buffer
+
+
+def download_site(url, dest_dir=None, cache=None, policy=None):
+  # the same order as io_synchronous.download_site: cache, then dest_dir, then policy, the policy wraps the network requests
   session = get_session()
+  send = policy.fetch if policy is not None else None
+  if cache is not None:
+    # the cache is shared by all the threads, it coalesces duplicate urls fetched at the same time into one request
+    body = cache.fetch(session, url, send=send)
+    if dest_dir is not None:
+      written = streaming.write_file(streaming.site_path(dest_dir, url), body)
+      print(f"Wrote {written} from {url}")
+      return written
+    print(f"Read {len(body)} from {url}")
+    return len(body)
+  if dest_dir is not None:
+    path = streaming.site_path(dest_dir, url)
+    if policy is not None:
+      written = policy.fetch(session, url, send=functools.partial(streaming.fetch_to_file, path=path))
+    else:
+      written = streaming.fetch_to_file(session, url, path=path, buffer=get_buffer())
+    print(f"Wrote {written} from {url}")
+    return written
+  if policy is not None:
+    # the policy is shared by all the threads, so the circuit breaker of a host sees the failures of every thread
+    body = policy.fetch(session, url)
+    print(f"Read {len(body)} from {url}")
+    return len(body)
   with session.get(url) as response:
     print(f"Read {len(response.content)} from {url}")
+    return len(response.content)
 
 
-def download_all_sites(sites):
+def download_all_sites(sites, max_workers=5, dest_dir=None, cache=None, adaptive=False, policy=None):
   # Thread: 
   # Pool: This object is going to create a pool of threads, each of which can run concurrently
   # Executor: the Executor is the part that’s going to control how and when each of the threads in the pool will run
   # An executor is a higher-level abstraction, that manage many of the details when fine-grained details aren't needed
-  with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-    executor.map(download_site, sites)
+  if dest_dir is not None:
+    os.makedirs(dest_dir, exist_ok=True)
+  download = functools.partial(download_site, dest_dir=dest_dir, cache=cache, policy=policy)
+  if adaptive:
+    # A fixed max_workers is a guess, too low for slow remotes and too high for one that throttles
+    # The adaptive pool grows and shrinks the number of active threads from the measured throughput and latency,
+    # and max_workers becomes the upper bound, parked threads keep their session from get_session()
+    with adaptive_pool.AdaptiveThreadPool(max_workers=max_workers) as executor:
+      results = executor.map(download, sites)
+    for elapsed, workers, throughput, latency in executor.history:
+      print(f"{elapsed:6.2f}s: {workers} workers, {throughput:.1f} sites/s, {latency * 1000:.1f} ms")
+    return results
+  with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+    return list(executor.map(download, sites))
 
 
 if __name__ == "__main__":
@@ -50,6 +99,7 @@ if __name__ == "__main__":
   ] * 80
   start_time = time.time()
   download_all_sites(sites)
+  # download_all_sites(sites, max_workers=64, adaptive=True) # let the pool pick the number of threads, up to 64
   duration = time.time() - start_time
   print(f"Downloaded {len(sites)} in {duration} seconds")
   # Downloaded 160 in 3.974519729614258 seconds
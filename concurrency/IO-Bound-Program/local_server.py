@@ -0,0 +1,109 @@
+import argparse
+import email.utils
+import hashlib
+import http.server
+import random
+import sys
+import threading
+import time
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+  # HTTP/1.1 keeps the connection alive between requests,
+  # so the Session objects of the downloaders can actually reuse their sockets like they would against a real site
+  protocol_version = "HTTP/1.1"
+  # headers and body are written separately, with Nagle's algorithm on the body waits for the client's delayed ACK (~40ms)
+  disable_nagle_algorithm = True
+
+  def do_GET(self):
+    config = self.server.config
+    # every request gets its own sleep, so the server behaves like a slow remote host and not like a slow single queue
+    if config["latency"] > 0:
+      time.sleep(random.uniform(config["latency"] * (1 - config["jitter"]), config["latency"] * (1 + config["jitter"])))
+    if random.random() < config["error_rate"]:
+      self.send_error(500, "Injected error")
+      return
+    # the payload never changes, so a client that already holds it gets a 304 without a body
+    if self.headers.get("If-None-Match") == self.server.etag or (
+        "If-None-Match" not in self.headers and self.headers.get("If-Modified-Since") == self.server.last_modified):
+      self.send_response(304)
+      self.send_header("ETag", self.server.etag)
+      self.send_header("Last-Modified", self.server.last_modified)
+      self.send_header("Content-Length", "0")
+      self.end_headers()
+      return
+    body = self.server.payload
+    self.send_response(200)
+    self.send_header("Content-Type", "application/octet-stream")
+    self.send_header("Content-Length", str(len(body)))
+    self.send_header("ETag", self.server.etag)
+    self.send_header("Last-Modified", self.server.last_modified)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    # logging every request to stderr would dominate the benchmark numbers
+    pass
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+  # the default backlog of 5 drops connections as soon as the downloaders open more sockets than that at once
+  request_queue_size = 1024
+  daemon_threads = True
+
+  def __init__(self, address, latency=0.0, jitter=0.0, payload_size=1024, error_rate=0.0):
+    super().__init__(address, StandInHandler)
+    self.config = {
+        "latency": latency,
+        "jitter": jitter,
+        "payload_size": payload_size,
+        "error_rate": error_rate,
+    }
+    self.payload = b"x" * payload_size
+    self.etag = '"{0}"'.format(hashlib.sha1(self.payload).hexdigest())
+    self.last_modified = email.utils.formatdate(usegmt=True)
+
+  def handle_error(self, request, client_address):
+    # clients closing keep-alive connections at the end of a run are expected, not worth a traceback
+    if not isinstance(sys.exc_info()[1], ConnectionError):
+      super().handle_error(request, client_address)
+
+  @property
+  def base_url(self):
+    host, port = self.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def start_server(host="127.0.0.1", port=0, **config):
+  # port=0 lets the operating system pick a free port, read it back from server.base_url
+  server = StandInServer((host, port), **config)
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  return server
+
+
+if __name__ == "__main__":
+  # A local stand-in for "https://www.jython.org" and "http://olympus.realpython.org/dice",
+  # so the downloaders can be compared without depending on the network or hammering real sites
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8000)
+  parser.add_argument("--latency", type=float, default=0.05, help="seconds slept before each response")
+  parser.add_argument("--jitter", type=float, default=0.0, help="latency is drawn from latency * (1 +- jitter)")
+  parser.add_argument("--payload-size", type=int, default=1024, help="bytes in each response body")
+  parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+  ns = parser.parse_args()
+  server = StandInServer(
+      (ns.host, ns.port),
+      latency=ns.latency,
+      jitter=ns.jitter,
+      payload_size=ns.payload_size,
+      error_rate=ns.error_rate,
+  )
+  print(f"Serving on {server.base_url}")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
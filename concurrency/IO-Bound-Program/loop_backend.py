@@ -0,0 +1,24 @@
+import importlib.util
+import os
+import sys
+
+# The IO scripts start their loop the way the async scripts do, with asynchronous/loop_bootstrap.py:
+# the same ASYNC_LOOP and ASYNC_EAGER_TASKS switches, and a loop made by a factory instead of a global uvloop policy
+# It is loaded by its path, putting asynchronous/ on sys.path would shadow the standard queue module with its queue.py
+_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "asynchronous", "loop_bootstrap.py")
+
+if "loop_bootstrap" in sys.modules:
+  _bootstrap = sys.modules["loop_bootstrap"]
+else:
+  _spec = importlib.util.spec_from_file_location("loop_bootstrap", _PATH)
+  _bootstrap = importlib.util.module_from_spec(_spec)
+  sys.modules["loop_bootstrap"] = _bootstrap
+  _spec.loader.exec_module(_bootstrap)
+
+BACKENDS = _bootstrap.BACKENDS
+EAGER_TASKS_AVAILABLE = _bootstrap.EAGER_TASKS_AVAILABLE
+resolve = _bootstrap.resolve
+new_event_loop = _bootstrap.new_event_loop
+describe = _bootstrap.describe
+run_in_loop = _bootstrap.run_in_loop
+run = _bootstrap.run
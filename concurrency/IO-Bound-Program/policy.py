@@ -0,0 +1,269 @@
+import asyncio
+import collections
+import concurrent.futures
+import random
+import threading
+import time
+import urllib.parse
+
+import aiohttp
+import requests
+
+
+class CircuitOpenError(Exception):
+  pass
+
+
+class DeadlineExceeded(Exception):
+  pass
+
+
+class CircuitBreaker:
+  """
+  Stops sending requests to a host after failure_threshold failures in a row, and lets one probe through after reset_timeout.
+  """
+  def __init__(self, failure_threshold=5, reset_timeout=30.0):
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    self.failures = 0
+    self.opened_at = None
+    self._lock = threading.Lock()
+
+  def allow(self):
+    with self._lock:
+      if self.opened_at is None:
+        return True
+      # half-open: after reset_timeout one request is let through, its outcome closes or re-opens the circuit
+      if time.monotonic() - self.opened_at >= self.reset_timeout:
+        self.opened_at = time.monotonic()
+        return True
+      return False
+
+  def record(self, success):
+    with self._lock:
+      if success:
+        self.failures = 0
+        self.opened_at = None
+      else:
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+          self.opened_at = time.monotonic()
+
+
+def _status_of(exc):
+  # requests.HTTPError carries the response, aiohttp.ClientResponseError the status
+  if isinstance(exc, requests.HTTPError) and exc.response is not None:
+    return exc.response.status_code
+  if isinstance(exc, aiohttp.ClientResponseError):
+    return exc.status
+  return None
+
+
+def _is_timeout(exc):
+  return isinstance(exc, (requests.Timeout, asyncio.TimeoutError, TimeoutError))
+
+
+def _is_retryable(exc):
+  # a 404 will still be a 404 on the next try, a 503, a 429 or a dropped connection might not
+  status = _status_of(exc)
+  if status is not None:
+    return status >= 500 or status == 429
+  return isinstance(exc, (requests.RequestException, aiohttp.ClientError, asyncio.TimeoutError, TimeoutError))
+
+
+def read_site(session, url, timeout):
+  # the requests version of one attempt, timeout is per connect/read, not for the whole body
+  with session.get(url, timeout=timeout) as response:
+    response.raise_for_status()
+    return response.content
+
+
+async def read_site_async(session, url, timeout):
+  async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+    response.raise_for_status()
+    return await response.read()
+
+
+class DownloadPolicy:
+  """
+  Per-request timeout, total deadline, retries with exponential backoff and jitter, a circuit breaker per host and hedged requests.
+  """
+  def __init__(self, timeout=10.0, deadline=None, retries=3, backoff=0.1, max_backoff=5.0,
+               failure_threshold=5, reset_timeout=30.0, hedge_after=None, hedge_workers=32):
+    self.timeout = timeout
+    # deadline bounds one fetch including all its retries and backoff sleeps, None means only retries bound it
+    self.deadline = deadline
+    self.retries = retries
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    # A request still running after hedge_after seconds gets a second identical request, whichever finishes first wins
+    # Stragglers dominate tail latency, hedging the slowest few percent cuts it for a few percent more requests
+    self.hedge_after = hedge_after
+    self._breakers = collections.defaultdict(self._new_breaker)
+    self._breakers_lock = threading.Lock()
+    self._stats_lock = threading.Lock()
+    self.stats = collections.Counter(
+        calls=0, attempts=0, retries=0, timeouts=0, failures=0, circuit_open=0,
+        deadline_exceeded=0, hedges=0, hedges_won=0)
+    # A blocking request can't be raced against another one from the same thread,
+    # hedged fetches run their attempts on these threads, each with its own requests.Session
+    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=hedge_workers) if hedge_after is not None else None
+    self._thread_local = threading.local()
+
+  def _new_breaker(self):
+    return CircuitBreaker(self.failure_threshold, self.reset_timeout)
+
+  def _breaker(self, url):
+    host = urllib.parse.urlsplit(url).netloc
+    with self._breakers_lock:
+      return self._breakers[host]
+
+  def _count(self, key, n=1):
+    with self._stats_lock:
+      self.stats[key] += n
+
+  def _backoff_delay(self, attempt):
+    # "full jitter": a random delay up to the exponential bound keeps retrying clients from synchronising
+    return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+  def _attempt_timeout(self, started):
+    if self.deadline is None:
+      return self.timeout
+    remaining = self.deadline - (time.monotonic() - started)
+    if remaining <= 0:
+      self._count("deadline_exceeded")
+      raise DeadlineExceeded(f"deadline of {self.deadline} seconds exceeded")
+    return min(self.timeout, remaining)
+
+  def _record_failure(self, breaker, exc):
+    # Only the errors worth retrying say the host is in trouble: a 404 or a 403 is the host answering,
+    # it closes the circuit like a success instead of counting towards opening it
+    if _is_retryable(exc):
+      breaker.record(False)
+    elif _status_of(exc) is not None:
+      breaker.record(True)
+    self._count("failures")
+    if _is_timeout(exc):
+      self._count("timeouts")
+
+  def _session(self):
+    if not hasattr(self._thread_local, "session"):
+      self._thread_local.session = requests.Session()
+    return self._thread_local.session
+
+  def _hedged(self, url, timeout, send):
+    # both attempts run on the policy's threads, the caller's session is never shared between two threads
+    primary = self._executor.submit(lambda: send(self._session(), url, timeout))
+    done, _ = concurrent.futures.wait([primary], timeout=self.hedge_after)
+    if done:
+      return primary.result()
+    self._count("hedges")
+    hedge = self._executor.submit(lambda: send(self._session(), url, timeout))
+    pending = {primary, hedge}
+    while pending:
+      done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        if future.exception() is None:
+          if future is hedge:
+            self._count("hedges_won")
+          # the loser can't be interrupted, it finishes in the background within its timeout
+          return future.result()
+    return primary.result()
+
+  def fetch(self, session, url, send=read_site):
+    # for the requests based downloaders, returns the body or raises the last error
+    self._count("calls")
+    breaker = self._breaker(url)
+    started = time.monotonic()
+    for attempt in range(self.retries + 1):
+      if not breaker.allow():
+        self._count("circuit_open")
+        raise CircuitOpenError(f"circuit open for {url}")
+      timeout = self._attempt_timeout(started)
+      self._count("attempts")
+      try:
+        if self._executor is not None:
+          body = self._hedged(url, timeout, send)
+        else:
+          body = send(session, url, timeout)
+      except Exception as exc:
+        self._record_failure(breaker, exc)
+        if attempt == self.retries or not _is_retryable(exc):
+          raise
+        self._count("retries")
+        time.sleep(self._backoff_delay(attempt))
+        continue
+      breaker.record(True)
+      return body
+
+  async def _hedged_async(self, session, url, timeout, send):
+    primary = asyncio.ensure_future(asyncio.wait_for(send(session, url, timeout), timeout))
+    tasks = [primary]
+    try:
+      done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+      if not done:
+        self._count("hedges")
+        hedge = asyncio.ensure_future(asyncio.wait_for(send(session, url, timeout), timeout))
+        tasks.append(hedge)
+        pending = set(tasks)
+        while pending:
+          done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+          for task in done:
+            if task.exception() is None:
+              if task is hedge:
+                self._count("hedges_won")
+              return task.result()
+      return primary.result()
+    finally:
+      # unlike a blocking request, the losing task can be cancelled right away
+      for task in tasks:
+        if not task.done():
+          task.cancel()
+
+  async def fetch_async(self, session, url, send=read_site_async):
+    # for aiohttp, the same policy without blocking the event loop in the backoff sleeps
+    self._count("calls")
+    breaker = self._breaker(url)
+    started = time.monotonic()
+    for attempt in range(self.retries + 1):
+      if not breaker.allow():
+        self._count("circuit_open")
+        raise CircuitOpenError(f"circuit open for {url}")
+      timeout = self._attempt_timeout(started)
+      self._count("attempts")
+      try:
+        if self.hedge_after is not None:
+          body = await self._hedged_async(session, url, timeout, send)
+        else:
+          body = await asyncio.wait_for(send(session, url, timeout), timeout)
+      except Exception as exc:
+        self._record_failure(breaker, exc)
+        if attempt == self.retries or not _is_retryable(exc):
+          raise
+        self._count("retries")
+        await asyncio.sleep(self._backoff_delay(attempt))
+        continue
+      breaker.record(True)
+      return body
+
+  def report(self):
+    with self._stats_lock:
+      return dict(self.stats)
+
+  def close(self):
+    if self._executor is not None:
+      self._executor.shutdown(wait=False)
+
+
+def merge_reports(reports):
+  # The reports of several policies added up, e.g. the one policy of every multiprocessing worker, None if there are none
+  reports = [report for report in reports if report is not None]
+  if not reports:
+    return None
+  merged = collections.Counter()
+  for report in reports:
+    # update() and not +, which would drop the keys that are still 0
+    merged.update(report)
+  return dict(merged)
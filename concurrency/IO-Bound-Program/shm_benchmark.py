@@ -0,0 +1,72 @@
+import argparse
+import multiprocessing
+import os
+import time
+
+import shm_transport
+
+slab = None
+payloads = {}
+
+
+def attach(slab_handle):
+  global slab
+  if slab_handle is not None:
+    slab = shm_transport.SlabAllocator.attach(*slab_handle)
+
+
+def produce(size):
+  # a synthetic body of the given size, made once per worker, so only the transport is measured and not the network
+  if size not in payloads:
+    payloads[size] = os.urandom(size)
+  payload = payloads[size]
+  if slab is None:
+    return None, payload
+  return slab.write(payload)
+
+
+def measure(transport, size, count, processes):
+  slab_handle = None
+  if transport == "shared_memory":
+    owner = shm_transport.SlabAllocator.create(size, processes * 4)
+    slab_handle = owner.handle()
+  try:
+    with multiprocessing.Pool(processes, initializer=attach, initargs=(slab_handle,)) as pool:
+      # the pool is started and warmed up before the clock starts
+      pool.map(abs, range(processes))
+      start = time.perf_counter()
+      received = 0
+      for descriptor in pool.imap_unordered(produce, [size] * count):
+        if slab_handle is None:
+          received += len(descriptor[1])
+        else:
+          # the parent only looks at the bytes in place, then hands the slot back
+          view = owner.view(descriptor)
+          received += len(view)
+          view.release()
+          owner.release(descriptor)
+      elapsed = time.perf_counter() - start
+  finally:
+    if slab_handle is not None:
+      owner.close()
+  return received / elapsed / 2 ** 20
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--processes", type=int, default=4)
+  parser.add_argument("--total", type=int, default=256, help="MB moved per payload size")
+  ns = parser.parse_args()
+
+  print(f"{'payload':>10} {'pickle MB/s':>14} {'shared_memory MB/s':>20}")
+  for size in (1024, 64 * 1024, 1024 * 1024, 8 * 1024 * 1024):
+    count = max(ns.processes * 8, ns.total * 2 ** 20 // size)
+    pickled = measure("pickle", size, count, ns.processes)
+    shared = measure("shared_memory", size, count, ns.processes)
+    print(f"{size // 1024:>8}KB {pickled:>14.1f} {shared:>20.1f}")
+  #    payload    pickle MB/s   shared_memory MB/s
+  #        1KB           16.2                 11.8
+  #       64KB          258.8                924.8
+  #     1024KB          363.1               1577.5
+  #     8192KB          299.7                696.5
+  # For tiny payloads the extra round trip through the free-slot queue costs more than pickling saves
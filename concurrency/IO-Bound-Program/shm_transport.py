@@ -0,0 +1,110 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+
+class SlabAllocator:
+  """
+  Fixed-size slots in one shared memory segment, passed between processes as small (slot, length) descriptors.
+  """
+  def __init__(self, shm, slot_size, slots, free_slots, owner):
+    self.slot_size = slot_size
+    self.slots = slots
+    self._shm = shm
+    # The indices of the free slots travel through a queue, so a worker blocks when every slot is taken
+    # until the parent has consumed and released one, which is also the backpressure of the transport
+    self._free_slots = free_slots
+    self._owner = owner
+
+  @classmethod
+  def create(cls, slot_size, slots, context=multiprocessing):
+    shm = shared_memory.SharedMemory(create=True, size=slot_size * slots)
+    free_slots = context.Queue()
+    for slot in range(slots):
+      free_slots.put(slot)
+    return cls(shm, slot_size, slots, free_slots, owner=True)
+
+  def handle(self):
+    # what a worker needs to attach, meant for Pool(initializer=..., initargs=...) since a Queue can only be inherited
+    return self._shm.name, self.slot_size, self.slots, self._free_slots
+
+  @classmethod
+  def attach(cls, name, slot_size, slots, free_slots):
+    # Pool workers share the parent's resource tracker, attaching here doesn't make them unlink the segment on exit
+    return cls(shared_memory.SharedMemory(name=name), slot_size, slots, free_slots, owner=False)
+
+  def _slot_view(self, slot, length=None):
+    offset = slot * self.slot_size
+    return self._shm.buf[offset:offset + (self.slot_size if length is None else length)]
+
+  def write(self, data):
+    # Only the descriptor gets pickled, a body that doesn't fit into a slot is sent inline like before
+    if len(data) > self.slot_size:
+      return None, bytes(data)
+    slot = self._free_slots.get()
+    view = self._slot_view(slot, len(data))
+    view[:] = data
+    view.release()
+    return slot, len(data)
+
+  def fill(self, readinto):
+    # readinto(buffer) -> number of bytes, e.g. response.raw.readinto, reads straight into shared memory without a copy
+    slot = self._free_slots.get()
+    view = self._slot_view(slot)
+    length = 0
+    try:
+      while length < self.slot_size:
+        n = readinto(view[length:])
+        if not n:
+          return slot, length
+        length += n
+      # the slot is full, find out whether there is more, if so the whole body goes inline
+      extra = bytearray(self.slot_size)
+      n = readinto(extra)
+      if not n:
+        return slot, length
+      data = bytearray(view[:length]) + extra[:n]
+      while n:
+        n = readinto(extra)
+        data += extra[:n]
+    except BaseException:
+      self._free_slots.put(slot)
+      raise
+    finally:
+      view.release()
+    self._free_slots.put(slot)
+    return None, bytes(data)
+
+  def view(self, descriptor):
+    # zero-copy access for the parent, release(descriptor) once done with it, views must not outlive the release
+    slot, payload = descriptor
+    if slot is None:
+      return memoryview(payload)
+    return self._slot_view(slot, payload)
+
+  def read(self, descriptor):
+    # copies the payload out and frees the slot at once
+    slot, payload = descriptor
+    if slot is None:
+      return payload
+    view = self._slot_view(slot, payload)
+    data = bytes(view)
+    view.release()
+    self.release(descriptor)
+    return data
+
+  def release(self, descriptor):
+    slot, _ = descriptor
+    if slot is not None:
+      self._free_slots.put(slot)
+
+  def close(self):
+    self._shm.close()
+    if self._owner:
+      self._shm.unlink()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+    return False
@@ -0,0 +1,73 @@
+import hashlib
+import os
+import re
+import uuid
+
+# Only this many bytes of a response body are held in memory at once by a worker,
+# so the peak memory of a download is chunk size x number of workers instead of body size x number of workers
+CHUNK_SIZE = 64 * 1024
+
+
+def allocate_buffer(chunk_size=CHUNK_SIZE):
+  # A memoryview over a preallocated bytearray can be filled in place (readinto) and sliced without copying,
+  # so the same buffer is reused for every chunk of every download of one worker
+  return memoryview(bytearray(chunk_size))
+
+
+def site_path(dest_dir, url):
+  # the same url always maps to the same file, the digest keeps urls that sanitize to the same name apart
+  name = re.sub(r"[^A-Za-z0-9._-]+", "_", url.split("://", 1)[-1]).strip("_")[:100]
+  digest = hashlib.sha1(url.encode()).hexdigest()[:10]
+  return os.path.join(dest_dir, f"{name}-{digest}")
+
+
+def temporary_path(path):
+  # The sites list repeats the same urls, so several workers can be writing the same file at once
+  # Each one writes its own temporary file and os.replace() swaps it in atomically when it is complete
+  return f"{path}.{uuid.uuid4().hex}.part"
+
+
+def stream_to_file(response, path, buffer):
+  # response has to come from session.get(url, stream=True), otherwise requests has already read the whole body
+  # decode_content makes urllib3 undo gzip/deflate like response.content would
+  response.raw.decode_content = True
+  tmp_path = temporary_path(path)
+  written = 0
+  try:
+    with open(tmp_path, "wb") as f:
+      while True:
+        n = response.raw.readinto(buffer)
+        if not n:
+          break
+        # buffer[:n] is a view, not a copy
+        f.write(buffer[:n])
+        written += n
+    os.replace(tmp_path, path)
+  except BaseException:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    raise
+  return written
+
+
+def fetch_to_file(session, url, timeout=None, *, path, buffer=None):
+  # One streamed download, shaped like policy.read_site so DownloadPolicy.fetch can retry and hedge it:
+  # an error status raises instead of being saved as the site, and every attempt writes its own temporary file
+  # Hedged attempts run at the same time, so without a buffer of its own every attempt allocates one
+  with session.get(url, stream=True, timeout=timeout) as response:
+    response.raise_for_status()
+    return stream_to_file(response, path, buffer if buffer is not None else allocate_buffer())
+
+
+def write_file(path, body):
+  # a body that is already in memory (from the cache), written with the same temporary file + os.replace()
+  tmp_path = temporary_path(path)
+  try:
+    with open(tmp_path, "wb") as f:
+      f.write(body)
+    os.replace(tmp_path, path)
+  except BaseException:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    raise
+  return len(body)
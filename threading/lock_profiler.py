@@ -0,0 +1,297 @@
+import _thread
+import argparse
+import atexit
+import collections
+import math
+import os
+import runpy
+import sys
+import sysconfig
+import threading
+import time
+
+# the originals, the profiler puts them back on disable() and uses them internally
+Lock = threading.Lock
+RLock = threading.RLock
+Condition = threading.Condition
+
+STDLIB = sysconfig.get_paths()["stdlib"]
+_report_at_exit = False
+
+
+def in_stdlib(filename):
+  # frozen modules are the import machinery
+  return filename.startswith("<frozen") or filename.startswith(STDLIB) and "site-packages" not in filename
+
+
+def histogram_bucket(seconds):
+  # power-of-two buckets in microseconds, bucket b holds 2^(b-1) <= us < 2^b
+  microseconds = seconds * 1e6
+  return 0 if microseconds < 1 else int(math.log2(microseconds)) + 1
+
+
+def bucket_label(bucket):
+  return "<1us" if bucket == 0 else f"<{2 ** bucket}us"
+
+
+class Stats:
+  """
+  Wait and hold times of every primitive created at one place in the code.
+  """
+  def __init__(self, name, kind):
+    self.name = name
+    self.kind = kind
+    self.acquisitions = 0
+    self.contended = 0
+    self.wait = 0.0
+    self.max_wait = 0.0
+    self.hold = 0.0
+    self.max_hold = 0.0
+    self.wait_histogram = collections.Counter()
+    self.hold_histogram = collections.Counter()
+    # thread name -> [acquisitions, wait]
+    self.threads = collections.defaultdict(lambda: [0, 0.0])
+    # a raw lock, the profiler's own bookkeeping must not show up in (or recurse into) the profile
+    self.lock = _thread.allocate_lock()
+
+  def record_acquire(self, waited, contended):
+    with self.lock:
+      self.acquisitions += 1
+      self.contended += contended
+      self.wait += waited
+      self.max_wait = max(self.max_wait, waited)
+      self.wait_histogram[histogram_bucket(waited)] += 1
+      thread = self.threads[threading.current_thread().name]
+      thread[0] += 1
+      thread[1] += waited
+
+  def record_hold(self, held):
+    with self.lock:
+      self.hold += held
+      self.max_hold = max(self.max_hold, held)
+      self.hold_histogram[histogram_bucket(held)] += 1
+
+
+class Registry:
+  def __init__(self):
+    self.stats = {}
+    self.lock = _thread.allocate_lock()
+
+  def stats_for(self, kind):
+    # Primitives are grouped by where they were created, e.g. "queue.py:Queue.__init__ <- product_consumer_queue.py:63"
+    # for the mutex of a Queue created on that line
+    frame = sys._getframe(2)
+    creator = None
+    while frame is not None and frame.f_code.co_filename == __file__:
+      frame = frame.f_back
+    if frame is None or frame.f_code.co_filename == threading.__file__:
+      # primitives created by the threading module itself (the Events of every Thread) are plumbing, not profiled
+      return None
+    code = frame.f_code
+    if in_stdlib(code.co_filename):
+      # created inside the standard library (queue, logging, concurrent.futures), named after the library function
+      # and attributed to the first frame of the profiled program
+      creator = f"{os.path.relpath(code.co_filename, STDLIB)}:{getattr(code, 'co_qualname', code.co_name)}"
+      while frame is not None and in_stdlib(frame.f_code.co_filename):
+        frame = frame.f_back
+      if frame is None:
+        return None
+    site = f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno}"
+    name = f"{kind} {creator} <- {site}" if creator else f"{kind} {getattr(frame.f_code, 'co_qualname', frame.f_code.co_name)} {site}"
+    with self.lock:
+      if name not in self.stats:
+        self.stats[name] = Stats(name, kind)
+      return self.stats[name]
+
+
+registry = Registry()
+
+
+class ProfiledLock:
+  """
+  threading.Lock that records how long acquire() waited, whether it was contended and how long the lock was held.
+  """
+  _factory = staticmethod(Lock)
+
+  def __init__(self, stats):
+    self._lock = self._factory()
+    self._stats = stats
+    self._acquired_at = None
+
+  def acquire(self, blocking=True, timeout=-1):
+    # the uncontended case costs a single non-blocking attempt and no clock reads for the wait
+    if self._lock.acquire(False):
+      self._stats.record_acquire(0.0, False)
+    elif not blocking:
+      return False
+    else:
+      start = time.perf_counter()
+      if not self._lock.acquire(True, timeout):
+        return False
+      self._stats.record_acquire(time.perf_counter() - start, True)
+    self._acquired(time.perf_counter())
+    return True
+
+  def _acquired(self, now):
+    self._acquired_at = now
+
+  def release(self):
+    self._released(time.perf_counter())
+    self._lock.release()
+
+  def _released(self, now):
+    # a Lock may be released by another thread than the one that acquired it (product_consumer.Pipeline does that),
+    # so the acquire time is kept on the lock and not per thread
+    if self._acquired_at is not None:
+      self._stats.record_hold(now - self._acquired_at)
+      self._acquired_at = None
+
+  def locked(self):
+    return self._lock.locked()
+
+  def _at_fork_reinit(self):
+    # called in the child after a fork, e.g. for the module-level locks of concurrent.futures
+    self._lock._at_fork_reinit()
+    self._acquired_at = None
+
+  __enter__ = acquire
+
+  def __exit__(self, *exc_info):
+    self.release()
+
+
+class ProfiledRLock(ProfiledLock):
+  """
+  threading.RLock counterpart, the hold time runs from the outermost acquire to the matching release.
+  """
+  _factory = staticmethod(RLock)
+
+  def __init__(self, stats):
+    super().__init__(stats)
+    self._depth = 0
+
+  def _acquired(self, now):
+    # only the owner touches _depth
+    self._depth += 1
+    if self._depth == 1:
+      self._acquired_at = now
+
+  def _released(self, now):
+    self._depth -= 1
+    if self._depth == 0:
+      super()._released(now)
+
+  # Condition.wait uses these to drop and restore a lock that is held several times over
+  def _at_fork_reinit(self):
+    super()._at_fork_reinit()
+    self._depth = 0
+
+  def _is_owned(self):
+    return self._lock._is_owned()
+
+  def _release_save(self):
+    depth, self._depth = self._depth, 1
+    self._released(time.perf_counter())
+    return self._lock._release_save(), depth
+
+  def _acquire_restore(self, state):
+    saved, depth = state
+    start = time.perf_counter()
+    self._lock._acquire_restore(saved)
+    now = time.perf_counter()
+    self._stats.record_acquire(now - start, now - start > 1e-6)
+    self._acquired(now)
+    self._depth = depth
+
+
+class ProfiledCondition(Condition):
+  """
+  threading.Condition that records the time spent in wait(), with its lock profiled as well.
+  """
+  def __init__(self, lock=None):
+    if lock is None:
+      lock = profiled_rlock()
+    super().__init__(lock)
+    self._wait_stats = registry.stats_for("Condition")
+
+  def wait(self, timeout=None):
+    start = time.perf_counter()
+    try:
+      return super().wait(timeout)
+    finally:
+      if self._wait_stats is not None:
+        self._wait_stats.record_acquire(time.perf_counter() - start, True)
+
+
+def profiled_lock():
+  stats = registry.stats_for("Lock")
+  return Lock() if stats is None else ProfiledLock(stats)
+
+
+def profiled_rlock(*args, **kwargs):
+  stats = registry.stats_for("RLock")
+  return RLock() if stats is None else ProfiledRLock(stats)
+
+
+def enable(report_at_exit=True, top=10):
+  # Locks, RLocks and Conditions created from now on are profiled, including the ones inside queue.Queue,
+  # which creates them through the threading module; nothing is patched until this is called,
+  # so with the profiler off the program runs on the plain primitives
+  # The report is printed when the program exits, however the profiler was enabled, once even if enable() is called again
+  global _report_at_exit
+  if report_at_exit and not _report_at_exit:
+    atexit.register(report, sys.stderr, top)
+    _report_at_exit = True
+  threading.Lock = profiled_lock
+  threading.RLock = profiled_rlock
+  threading.Condition = ProfiledCondition
+
+
+def disable():
+  threading.Lock = Lock
+  threading.RLock = RLock
+  threading.Condition = Condition
+
+
+def report(out=sys.stderr, top=10):
+  stats = sorted(registry.stats.values(), key=lambda stat: stat.wait, reverse=True)
+  print("\nlock profile (sorted by total wait)", file=out)
+  print(f"{'primitive':<64} {'acquires':>9} {'contended':>9} {'wait ms':>9} {'max ms':>8} {'hold ms':>9} {'max ms':>8}", file=out)
+  for stat in stats:
+    if not stat.acquisitions:
+      continue
+    contended = f"{stat.contended / stat.acquisitions:.0%}"
+    print(
+        f"{stat.name[:64]:<64} {stat.acquisitions:>9} {contended:>9} {stat.wait * 1e3:>9.1f} {stat.max_wait * 1e3:>8.2f}"
+        f" {stat.hold * 1e3:>9.1f} {stat.max_hold * 1e3:>8.2f}",
+        file=out,
+    )
+  for stat in stats[:top]:
+    if not stat.contended:
+      continue
+    print(f"\n{stat.name}", file=out)
+    threads = sorted(stat.threads.items(), key=lambda item: item[1][1], reverse=True)
+    print("  waiting threads: " + ", ".join(f"{name} {count}x {wait * 1e3:.1f}ms" for name, (count, wait) in threads[:5]), file=out)
+    for title, histogram in (("wait", stat.wait_histogram), ("hold", stat.hold_histogram)):
+      if not histogram:
+        continue
+      largest = max(histogram.values())
+      print(f"  {title}:", file=out)
+      for bucket in range(min(histogram), max(histogram) + 1):
+        count = histogram.get(bucket, 0)
+        print(f"    {bucket_label(bucket):>10} {count:>8} {'#' * math.ceil(40 * count / largest)}", file=out)
+
+
+if __name__ == "__main__":
+  # python3 lock_profiler.py race_conditions/lock.py runs lock.py with profiled primitives and reports at exit
+  parser = argparse.ArgumentParser()
+  parser.add_argument("script")
+  parser.add_argument("args", nargs=argparse.REMAINDER)
+  parser.add_argument("--top", type=int, default=10, help="histograms for the top N primitives by wait time")
+  ns = parser.parse_args()
+
+  # the script runs as if it was started directly, its own directory first on sys.path for its imports
+  sys.argv = [ns.script] + ns.args
+  sys.path.insert(0, os.path.dirname(os.path.abspath(ns.script)))
+  enable(top=ns.top)
+  runpy.run_path(ns.script, run_name="__main__")
@@ -0,0 +1,131 @@
+import collections
+import concurrent.futures
+import logging
+import random
+import threading
+import time
+
+from product_consumer import SENTINEL
+
+
+def producer(pipeline, count, batch_size):
+  """Pretend we're getting messages from the network, a batch at a time."""
+  for start in range(0, count, batch_size):
+    messages = [random.randint(1, 101) for _ in range(min(batch_size, count - start))]
+    pipeline.put_many(messages, "Producer")
+
+
+def consumer(pipeline, name, batch_size, linger):
+  """Pretend we're saving numbers in the database, a batch at a time."""
+  stored = 0
+  while True:
+    messages = pipeline.get_many(batch_size, linger, name)
+    if messages[-1] is SENTINEL:
+      stored += len(messages) - 1
+      logging.info("%s stored %d messages. Exiting", name, stored)
+      return stored
+    stored += len(messages)
+
+
+class BatchedPipeline:
+  """
+  Pipeline between any number of producers and consumers that moves whole batches per lock round trip.
+  """
+  def __init__(self, maxsize=1024):
+    # maxsize counts messages, not batches, put_many blocks while the pipeline is full
+    self.maxsize = maxsize
+    self.messages = collections.deque()
+    # sentinels currently queued, kept up to date on put and get so lingering never has to scan the deque
+    self.sentinels = 0
+    self.lock = threading.Lock()
+    # producers wait on not_full and consumers on not_empty, both share the one lock
+    self.not_full = threading.Condition(self.lock)
+    self.not_empty = threading.Condition(self.lock)
+
+  def qsize(self):
+    with self.lock:
+      return len(self.messages)
+
+  def empty(self):
+    return self.qsize() == 0
+
+  def put_many(self, messages, name="Producer", timeout=None):
+    # A batch larger than the free space goes in piece by piece, so maxsize holds for any batch size
+    # Logging is checked once per batch, the debug calls of Pipeline are paid per message even when disabled
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    if debug:
+      logging.debug("%s:about to add %d messages", name, len(messages))
+    deadline = None if timeout is None else time.monotonic() + timeout
+    index = 0
+    with self.not_full:
+      while index < len(messages):
+        while len(self.messages) >= self.maxsize:
+          remaining = None if deadline is None else deadline - time.monotonic()
+          if remaining is not None and remaining <= 0:
+            raise TimeoutError(f"{name}: pipeline full, {len(messages) - index} messages not added")
+          self.not_full.wait(remaining)
+        free = self.maxsize - len(self.messages)
+        chunk = messages[index:index + free]
+        self.messages.extend(chunk)
+        self.sentinels += sum(1 for message in chunk if message is SENTINEL)
+        index += free
+        self.not_empty.notify_all()
+    if debug:
+      logging.debug("%s:added %d messages", name, len(messages))
+
+  def get_many(self, max_batch=256, linger=0.0, name="Consumer"):
+    # Blocks until there is at least one message, then waits up to linger seconds for the batch to fill up
+    # A linger of 0 returns whatever is there, a longer one trades latency for fewer, larger batches
+    with self.not_empty:
+      while True:
+        while not self.messages:
+          self.not_empty.wait()
+        if linger > 0 and len(self.messages) < max_batch:
+          deadline = time.monotonic() + linger
+          while len(self.messages) < max_batch and not self.sentinels:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+              break
+            self.not_empty.wait(remaining)
+        # with several consumers another one may have emptied the pipeline while this one lingered
+        if self.messages:
+          break
+      batch = []
+      while self.messages and len(batch) < max_batch:
+        message = self.messages.popleft()
+        batch.append(message)
+        # a batch ends at a sentinel, so one consumer can't swallow the sentinels meant for the others
+        if message is SENTINEL:
+          self.sentinels -= 1
+          break
+      self.not_full.notify_all()
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+      logging.debug("%s:got %d messages", name, len(batch))
+    return batch
+
+  # the single message interface of product_consumer.Pipeline, one message is a batch of one
+  def set_message(self, message, name):
+    self.put_many([message], name)
+
+  def get_message(self, name):
+    return self.get_many(1, 0.0, name)[0]
+
+
+if __name__ == "__main__":
+  format = "%(asctime)s: %(message)s"
+  logging.basicConfig(
+      format=format,
+      level=logging.INFO,
+      datefmt="%H:%M:%S"
+  )
+
+  producers, consumers, count = 4, 4, 100_000
+  pipeline = BatchedPipeline(maxsize=1024)
+  with concurrent.futures.ThreadPoolExecutor(max_workers=producers + consumers) as executor:
+    consumed = [executor.submit(consumer, pipeline, f"Consumer {n}", 256, 0.001) for n in range(consumers)]
+    produced = [executor.submit(producer, pipeline, count, 256) for _ in range(producers)]
+    concurrent.futures.wait(produced)
+    # one sentinel per consumer, every consumer stops at the first one it gets
+    pipeline.put_many([SENTINEL] * consumers, "Main")
+    total = sum(future.result() for future in consumed)
+  logging.info("Main: %d messages produced, %d stored", producers * count, total)
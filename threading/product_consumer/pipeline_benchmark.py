@@ -0,0 +1,92 @@
+import argparse
+import logging
+import threading
+import time
+
+import batched_pipeline
+import product_consumer
+import product_consumer_queue
+import ring_pipeline
+from product_consumer import SENTINEL
+
+
+def run_single(pipeline, count):
+  # one producer and one consumer moving one message per call, like product_consumer.py
+  received = []
+
+  def consume():
+    stored = 0
+    while pipeline.get_message("Consumer") is not SENTINEL:
+      stored += 1
+    received.append(stored)
+
+  thread = threading.Thread(target=consume)
+  start = time.perf_counter()
+  thread.start()
+  for message in range(count):
+    pipeline.set_message(message, "Producer")
+  pipeline.set_message(SENTINEL, "Producer")
+  thread.join()
+  return received[0], time.perf_counter() - start
+
+
+def run_batched(pipeline, count, producers, consumers, batch_size, linger):
+  received = []
+  per_producer = count // producers
+
+  def produce():
+    for start in range(0, per_producer, batch_size):
+      pipeline.put_many(list(range(start, min(start + batch_size, per_producer))), "Producer")
+
+  def consume(name):
+    received.append(batched_pipeline.consumer(pipeline, name, batch_size, linger))
+
+  threads = [threading.Thread(target=consume, args=(f"Consumer {n}",)) for n in range(consumers)]
+  threads += [threading.Thread(target=produce) for _ in range(producers)]
+  start = time.perf_counter()
+  for thread in threads:
+    thread.start()
+  for thread in threads[consumers:]:
+    thread.join()
+  pipeline.put_many([SENTINEL] * consumers, "Main")
+  for thread in threads[:consumers]:
+    thread.join()
+  return sum(received), time.perf_counter() - start
+
+
+def cases(count):
+  yield "product_consumer.Pipeline", lambda: run_single(product_consumer.Pipeline(), count)
+  yield "product_consumer_queue.Pipeline", lambda: run_single(product_consumer_queue.Pipeline(), count)
+  yield "RingPipeline", lambda: run_single(ring_pipeline.RingPipeline(), count)
+  yield "BatchedPipeline single", lambda: run_single(batched_pipeline.BatchedPipeline(), count)
+  for producers, consumers in ((1, 1), (4, 4)):
+    for batch_size in (16, 256):
+      yield (
+          f"BatchedPipeline {producers}x{consumers} b{batch_size}",
+          lambda p=producers, c=consumers, b=batch_size: run_batched(
+              batched_pipeline.BatchedPipeline(maxsize=4 * b), count, p, c, b, 0.001),
+      )
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--messages", type=int, default=200_000)
+  ns = parser.parse_args()
+  # the hot paths log at debug level, which is off here just like in the demos, and the consumers' info lines are muted
+  logging.basicConfig(level=logging.WARNING)
+
+  print(f"{'pipeline':<36} {'messages/s':>12}")
+  for name, run in cases(ns.messages):
+    received, elapsed = run()
+    if received != ns.messages:
+      raise SystemExit(f"{name}: {received} of {ns.messages} messages received")
+    print(f"{name:<36} {received / elapsed:>12,.0f}")
+  # pipeline                               messages/s
+  # product_consumer.Pipeline                  44,600
+  # product_consumer_queue.Pipeline            98,288
+  # RingPipeline                              821,452
+  # BatchedPipeline single                    178,661
+  # BatchedPipeline 1x1 b16                 1,210,519
+  # BatchedPipeline 1x1 b256                4,992,318
+  # BatchedPipeline 4x4 b16                 1,102,378
+  # BatchedPipeline 4x4 b256                4,573,824
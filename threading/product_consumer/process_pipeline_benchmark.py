@@ -0,0 +1,78 @@
+import argparse
+import logging
+import multiprocessing
+import threading
+import time
+
+import product_consumer_queue
+import shm_pipeline
+from product_consumer import SENTINEL
+
+
+def save(message, work):
+  # stands in for "saving a number in the database", pure Python CPU work that holds the GIL
+  return sum(i * i for i in range(message * work))
+
+
+def consume(pipeline, work):
+  while (message := pipeline.get_message("Consumer")) is not SENTINEL:
+    save(message, work)
+
+
+class QueuePipeline:
+  # multiprocessing.Queue with the Pipeline interface, the SENTINEL is sent as None since its identity can't be pickled
+  def __init__(self, maxsize):
+    self.queue = multiprocessing.Queue(maxsize)
+
+  def set_message(self, message, name):
+    self.queue.put(None if message is SENTINEL else message)
+
+  def get_message(self, name):
+    message = self.queue.get()
+    return SENTINEL if message is None else message
+
+
+def run(pipeline, workers, count, work, worker_type):
+  workers = [worker_type(target=consume, args=(pipeline, work)) for _ in range(workers)]
+  for worker in workers:
+    worker.start()
+  start = time.perf_counter()
+  for message in range(count):
+    pipeline.set_message(message % 100 + 1, "Producer")
+  for _ in workers:
+    pipeline.set_message(SENTINEL, "Producer")
+  for worker in workers:
+    worker.join()
+  return count / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--messages", type=int, default=20_000)
+  parser.add_argument("--work", type=int, default=100, help="CPU work per message, 0 measures the transport alone")
+  ns = parser.parse_args()
+  logging.basicConfig(level=logging.WARNING)
+
+  print(f"{'pipeline':<42} {'messages/s':>12}")
+  for consumers in (1, 2, 4):
+    rates = {
+        "product_consumer_queue.Pipeline threads": run(
+            product_consumer_queue.Pipeline(), consumers, ns.messages, ns.work, threading.Thread),
+        "multiprocessing.Queue": run(QueuePipeline(1024), consumers, ns.messages, ns.work, multiprocessing.Process),
+    }
+    with shm_pipeline.SharedMemoryPipeline(capacity=1024) as pipeline:
+      rates["SharedMemoryPipeline"] = run(pipeline, consumers, ns.messages, ns.work, multiprocessing.Process)
+    for name, rate in rates.items():
+      print(f"{name + f' x{consumers}':<42} {rate:>12,.0f}")
+  # python3 process_pipeline_benchmark.py --work 0, the transport alone
+  # pipeline                                     messages/s
+  # product_consumer_queue.Pipeline threads x1       91,768
+  # multiprocessing.Queue x1                         61,278
+  # SharedMemoryPipeline x1                          96,346
+  # product_consumer_queue.Pipeline threads x2       87,777
+  # multiprocessing.Queue x2                         54,120
+  # SharedMemoryPipeline x2                          97,121
+  # product_consumer_queue.Pipeline threads x4       77,113
+  # multiprocessing.Queue x4                         51,412
+  # SharedMemoryPipeline x4                          82,545
+  # Measured on a single core; with --work the process rows scale with the number of cores and the thread rows don't
@@ -1,25 +1,47 @@
+import argparse
 import concurrent.futures
 import logging
 import queue
 import random
+import sys
 import threading
 import time
 
+from product_consumer import SENTINEL
+
+
+class PipelineClosed(Exception):
+  """Raised by set_message once the pipeline is closed, and by get_message once it is closed and drained."""
+
 
 def producer(pipeline, event):
   """Pretend we're getting a message from the network."""
+  # The event is only checked before a new message is fetched, a message that is already fetched is always delivered,
+  # the consumers keep draining until close(), so a put that blocks on a full queue still finishes
   while not event.is_set():
     message = random.randint(1, 101)
     logging.info("Producer got message: %s", message)
-    pipeline.set_message(message, "Producer")
+    try:
+      pipeline.set_message(message, "Producer")
+    except PipelineClosed:
+      logging.info("Producer: pipeline closed, message %s not delivered", message)
+      break
 
   logging.info("Producer received EXIT event. Exiting")
 
 
 def consumer(pipeline, event):
   """Pretend we're saving a number in the database."""
-  while not event.is_set() or not pipeline.empty():
-    message = pipeline.get_message("Consumer")
+  # Instead of polling `not event.is_set() or not pipeline.empty()`, which can block forever in get() when the
+  # producer stops between the two checks, the consumer blocks in get_message until a message arrives, the
+  # pipeline is closed and drained, or it gets its own poison pill
+  while True:
+    try:
+      message = pipeline.get_message("Consumer")
+    except PipelineClosed:
+      break
+    if message is SENTINEL:
+      break
     logging.info(
         "Consumer storing message: %s  (queue size=%s)",
         message,
@@ -31,26 +53,181 @@ def consumer(pipeline, event):
 
 class Pipeline(queue.Queue):
   # Queue is thread-safe, therefore the locking happens inside the Queue itself
-  def __init__(self):
+  def __init__(self, maxsize=10):
     # The parameter maxsize will limit the queue to that number of elements,
     # causing .put() to block until there are fewer than maxsize elements
-    
+
     # If maxsize is not set, then the queue will grow to the limits of the computer’s memory.
-    super().__init__(maxsize=10)
+    super().__init__(maxsize=maxsize)
+    self.closed = False
 
-  def get_message(self, name):
+  def get_message(self, name, timeout=None):
+    # raises queue.Empty after timeout seconds without a message, and PipelineClosed once closed and drained
     logging.debug("%s:about to get from queue", name)
-    value = self.get()
-    logging.debug("%s:got %d from queue", name, value)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with self.not_empty:
+      while not self._qsize():
+        if self.closed:
+          raise PipelineClosed(f"{name}: pipeline is closed and drained")
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+          raise queue.Empty
+        self.not_empty.wait(remaining)
+      value = self._get()
+      self.not_full.notify()
+    logging.debug("%s:got %s from queue", name, value)
     return value
 
-  def set_message(self, value, name):
-    logging.debug("%s:about to add %d to queue", name, value)
-    self.put(value)
-    logging.debug("%s:added %d to queue", name, value)
+  def set_message(self, value, name, timeout=None):
+    # raises queue.Full after timeout seconds without a free slot, and PipelineClosed once closed,
+    # also when close() is called while this one is waiting for a slot
+    logging.debug("%s:about to add %s to queue", name, value)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with self.not_full:
+      while not self.closed and 0 < self.maxsize <= self._qsize():
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+          raise queue.Full
+        self.not_full.wait(remaining)
+      if self.closed:
+        raise PipelineClosed(f"{name}: pipeline is closed")
+      self._put(value)
+      self.unfinished_tasks += 1
+      self.not_empty.notify()
+    logging.debug("%s:added %s to queue", name, value)
+
+  def close(self, pills=0):
+    # No new messages are accepted, the ones already queued are still delivered; the consumers get PipelineClosed
+    # once the queue is empty, so the shutdown takes as long as draining the queue and no longer
+    # With pills=N one SENTINEL per consumer is queued behind the remaining messages (maxsize doesn't apply to them),
+    # every consumer stops at the first one it gets
+    with self.mutex:
+      self.closed = True
+      for _ in range(pills):
+        self._put(SENTINEL)
+        self.unfinished_tasks += 1
+      # wake every waiter, blocked producers raise and blocked consumers recheck
+      self.not_empty.notify_all()
+      self.not_full.notify_all()
+
+  def drain(self):
+    # takes whatever is still queued without blocking, e.g. when there are no consumers left to do it
+    with self.mutex:
+      messages = []
+      while self._qsize():
+        messages.append(self._get())
+      self.not_full.notify_all()
+      return messages
+
+
+def check_shutdown(producers, consumers, maxsize, pills, switch_interval, deadline=5.0):
+  # Every message a producer delivered has to be consumed exactly once, and all threads have to finish
+  # in time, wherever the event and close() happen to hit them
+  pipeline = Pipeline(maxsize)
+  event = threading.Event()
+  delivered, stored = [], []
+  lock = threading.Lock()
+
+  def produce(worker):
+    count = 0
+    while not event.is_set():
+      try:
+        pipeline.set_message((worker, count), "Producer")
+      except PipelineClosed:
+        break
+      count += 1
+    with lock:
+      delivered.extend((worker, n) for n in range(count))
+
+  def consume():
+    received = []
+    while True:
+      try:
+        message = pipeline.get_message("Consumer")
+      except PipelineClosed:
+        break
+      if message is SENTINEL:
+        break
+      # a slow consumer now and then, so the queue runs full while the event is set
+      if random.random() < 0.01:
+        time.sleep(0.001)
+      received.append(message)
+    with lock:
+      stored.extend(received)
+
+  previous = sys.getswitchinterval()
+  sys.setswitchinterval(switch_interval)
+  try:
+    consumer_threads = [threading.Thread(target=consume) for _ in range(consumers)]
+    producer_threads = [threading.Thread(target=produce, args=(n,)) for n in range(producers)]
+    for thread in consumer_threads + producer_threads:
+      thread.start()
+    time.sleep(random.uniform(0, 0.02))
+    event.set()
+    started = time.monotonic()
+    for thread in producer_threads:
+      thread.join(deadline)
+    pipeline.close(pills=consumers if pills else 0)
+    for thread in consumer_threads:
+      thread.join(max(0.0, deadline - (time.monotonic() - started)))
+    finished = not any(thread.is_alive() for thread in consumer_threads + producer_threads)
+  finally:
+    sys.setswitchinterval(previous)
+  return finished and sorted(stored) == sorted(delivered) and pipeline.empty()
+
+
+def check_timeouts():
+  pipeline = Pipeline(maxsize=1)
+  results = []
+  try:
+    pipeline.get_message("Consumer", timeout=0.01)
+  except queue.Empty:
+    results.append("get timeout")
+  pipeline.set_message(1, "Producer")
+  try:
+    pipeline.set_message(2, "Producer", timeout=0.01)
+  except queue.Full:
+    results.append("put timeout")
+
+  # close() wakes a producer blocked on the full queue, and a consumer blocked on an empty one
+  def blocked_put():
+    try:
+      pipeline.set_message(3, "Producer")
+    except PipelineClosed:
+      results.append("put closed")
+
+  thread = threading.Thread(target=blocked_put)
+  thread.start()
+  time.sleep(0.01)
+  pipeline.close()
+  thread.join(1)
+  results.append(f"drained {pipeline.get_message('Consumer')}")
+  try:
+    pipeline.get_message("Consumer")
+  except PipelineClosed:
+    results.append("get closed")
+  return results == ["get timeout", "put timeout", "put closed", "drained 1", "get closed"]
 
 
 if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--check", action="store_true", help="run the shutdown protocol through many interleavings")
+  parser.add_argument("--consumers", type=int, default=1)
+  parser.add_argument("--pills", action="store_true", help="stop the consumers with one poison pill each")
+  ns = parser.parse_args()
+
+  if ns.check:
+    failures = 0 if check_timeouts() else 1
+    print(f"timeouts and close wake-ups: {'ok' if not failures else 'FAILED'}")
+    for producers in (1, 3):
+      for consumers in (1, 4):
+        for maxsize in (1, 10):
+          for pills in (False, True):
+            ok = all(check_shutdown(producers, consumers, maxsize, pills, interval) for interval in (1e-6, 1e-3) * 5)
+            failures += not ok
+            print(f"{producers} producers {consumers} consumers maxsize {maxsize:>2} pills {pills!s:<5}: {'ok' if ok else 'FAILED'}")
+    raise SystemExit(1 if failures else 0)
+
   format = "%(asctime)s: %(message)s"
   logging.basicConfig(
       format=format,
@@ -63,10 +240,14 @@ if __name__ == "__main__":
   # Queue can be used directly as a pipeline object
   # pipeline = queue.Queue(maxsize=10)
   event = threading.Event()
-  with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-    executor.submit(producer, pipeline, event)
-    executor.submit(consumer, pipeline, event)
+  with concurrent.futures.ThreadPoolExecutor(max_workers=1 + ns.consumers) as executor:
+    consumers = [executor.submit(consumer, pipeline, event) for _ in range(ns.consumers)]
+    producer_future = executor.submit(producer, pipeline, event)
 
     time.sleep(0.1)
     logging.info("Main: about to set event")
     event.set()
+    # the producer finishes the message it has in hand, then the consumers drain what is left and exit
+    producer_future.result()
+    logging.info("Main: about to close the pipeline (queue size=%s)", pipeline.qsize())
+    pipeline.close(pills=ns.consumers if ns.pills else 0)
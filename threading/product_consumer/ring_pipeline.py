@@ -0,0 +1,131 @@
+import argparse
+import array
+import concurrent.futures
+import logging
+import random
+import sys
+import time
+
+from product_consumer import SENTINEL, consumer, producer
+
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+class RingPipeline:
+  """
+  Single-producer/single-consumer ring buffer with the set_message/get_message interface of product_consumer.Pipeline.
+  """
+  def __init__(self, capacity=1024, spin=100):
+    self.capacity = capacity
+    # ints like the random.randint messages go into a preallocated int64 array,
+    # anything else (the SENTINEL, big ints, other objects) into the object slot at the same index
+    self.numbers = array.array("q", bytes(8 * capacity))
+    self.objects = [None] * capacity
+    self.is_object = bytearray(capacity)
+    # head is only written by the consumer and tail only by the producer, a slot belongs to the producer until
+    # tail has moved past it and to the consumer until head has, so no lock is needed between the two
+    # Both counters only grow, tail - head is the number of messages in the ring
+    self.head = 0
+    self.tail = 0
+    # how often a side checks the other's counter before it gives up its time slice
+    self.spin = spin
+
+  def qsize(self):
+    return self.tail - self.head
+
+  def empty(self):
+    return self.tail == self.head
+
+  def _wait(self, ready):
+    # Busy-wait for a moment, then yield with sleep(0), which lets the other thread run instead of waiting for
+    # the interpreter's switch interval, and back off to short sleeps if the other side is stalled
+    for _ in range(self.spin):
+      if ready():
+        return
+    pause = 0
+    while not ready():
+      time.sleep(pause)
+      pause = min(pause * 2 or 1e-6, 1e-3)
+
+  def set_message(self, message, name):
+    tail = self.tail
+    if tail - self.head >= self.capacity:
+      self._wait(lambda: self.tail - self.head < self.capacity)
+    index = tail % self.capacity
+    if type(message) is int and INT64_MIN <= message <= INT64_MAX:
+      self.numbers[index] = message
+      self.is_object[index] = 0
+    else:
+      self.objects[index] = message
+      self.is_object[index] = 1
+    # publishing the slot is the last step, the consumer never sees a half-written one
+    self.tail = tail + 1
+
+  def get_message(self, name):
+    head = self.head
+    if self.tail == head:
+      self._wait(lambda: self.tail != self.head)
+    index = head % self.capacity
+    if self.is_object[index]:
+      message = self.objects[index]
+      # drop the reference, the ring shouldn't keep a consumed object alive
+      self.objects[index] = None
+    else:
+      message = self.numbers[index]
+    # handing the slot back to the producer is the last step as well
+    self.head = head + 1
+    return message
+
+
+def stress(count, capacity, switch_interval):
+  # A tiny switch interval makes the interpreter swap threads as often as possible, so the producer and consumer
+  # interleave at every point of set_message/get_message; every message has to arrive once and in order
+  expected = [random.choice((random.randint(1, 101), 2 ** 70, "text", None)) for _ in range(count)]
+  pipeline = RingPipeline(capacity)
+  previous = sys.getswitchinterval()
+  sys.setswitchinterval(switch_interval)
+  try:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+      def produce():
+        for message in expected:
+          pipeline.set_message(message, "Producer")
+        pipeline.set_message(SENTINEL, "Producer")
+
+      def consume():
+        received = []
+        while (message := pipeline.get_message("Consumer")) is not SENTINEL:
+          received.append(message)
+        return received
+
+      executor.submit(produce)
+      received = executor.submit(consume).result()
+  finally:
+    sys.setswitchinterval(previous)
+  return received == expected and pipeline.empty()
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--check", action="store_true", help="stress test for lost, duplicated or reordered messages")
+  ns = parser.parse_args()
+
+  if ns.check:
+    failures = 0
+    for capacity in (1, 2, 3, 64, 1024):
+      for switch_interval in (1e-6, 1e-4, 5e-3):
+        ok = stress(20_000, capacity, switch_interval)
+        failures += not ok
+        print(f"capacity {capacity:>4} switch interval {switch_interval:g}: {'ok' if ok else 'FAILED'}")
+    raise SystemExit(1 if failures else 0)
+
+  format = "%(asctime)s: %(message)s"
+  logging.basicConfig(
+      format=format,
+      level=logging.INFO,
+      datefmt="%H:%M:%S"
+  )
+
+  pipeline = RingPipeline(capacity=16)
+  with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+    executor.submit(producer, pipeline)
+    executor.submit(consumer, pipeline)
@@ -0,0 +1,140 @@
+import logging
+import multiprocessing
+import pickle
+import random
+import struct
+from multiprocessing import shared_memory
+
+from product_consumer import SENTINEL
+
+# head and tail counters at the start of the segment, followed by the slots
+HEADER = struct.Struct("<qq")
+# every slot starts with its kind and length, an int message is stored as int64 and anything else is pickled
+SLOT_HEADER = struct.Struct("<BI")
+INT, SENTINEL_KIND, PICKLED = 0, 1, 2
+INT64 = struct.Struct("<q")
+
+
+def producer(pipeline, count):
+  """Pretend we're getting a message from the network."""
+  for _ in range(count):
+    pipeline.set_message(random.randint(1, 101), "Producer")
+
+
+def consumer(pipeline, name):
+  """Pretend we're saving a number in the database, in a separate process."""
+  stored = 0
+  while pipeline.get_message(name) is not SENTINEL:
+    stored += 1
+  logging.info("%s stored %d messages. Exiting", name, stored)
+
+
+class SharedMemoryPipeline:
+  """
+  Pipeline between processes, a ring of fixed-size slots in shared memory with semaphores for backpressure.
+  """
+  def __init__(self, capacity=1024, slot_size=64, context=multiprocessing):
+    self.capacity = capacity
+    self.slot_size = slot_size
+    self._shm = shared_memory.SharedMemory(create=True, size=HEADER.size + capacity * slot_size)
+    HEADER.pack_into(self._shm.buf, 0, 0, 0)
+    self._owner = True
+    # free_slots blocks the producers while the ring is full and messages blocks the consumers while it is empty,
+    # the two locks only order the producers among themselves and the consumers among themselves
+    self._free_slots = context.Semaphore(capacity)
+    self._messages = context.Semaphore(0)
+    self._put_lock = context.Lock()
+    self._get_lock = context.Lock()
+
+  def __getstate__(self):
+    # sent to the worker processes as their arguments, they attach to the same segment by name
+    state = self.__dict__.copy()
+    state["_shm"] = self._shm.name
+    state["_owner"] = False
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._shm = shared_memory.SharedMemory(name=state["_shm"])
+
+  def qsize(self):
+    head, tail = HEADER.unpack_from(self._shm.buf, 0)
+    return tail - head
+
+  def empty(self):
+    return self.qsize() == 0
+
+  def _encode(self, message):
+    if message is SENTINEL:
+      # the SENTINEL object can't cross processes, each process compares with its own product_consumer.SENTINEL
+      return SENTINEL_KIND, b""
+    if type(message) is int and -2 ** 63 <= message < 2 ** 63:
+      return INT, INT64.pack(message)
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    if SLOT_HEADER.size + len(data) > self.slot_size:
+      raise ValueError(f"message of {len(data)} bytes doesn't fit into a {self.slot_size} byte slot")
+    return PICKLED, data
+
+  def set_message(self, message, name):
+    kind, data = self._encode(message)
+    self._free_slots.acquire()
+    with self._put_lock:
+      head, tail = HEADER.unpack_from(self._shm.buf, 0)
+      offset = HEADER.size + (tail % self.capacity) * self.slot_size
+      SLOT_HEADER.pack_into(self._shm.buf, offset, kind, len(data))
+      self._shm.buf[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(data)] = data
+      INT64.pack_into(self._shm.buf, 8, tail + 1)
+    self._messages.release()
+
+  def get_message(self, name):
+    self._messages.acquire()
+    with self._get_lock:
+      head, tail = HEADER.unpack_from(self._shm.buf, 0)
+      offset = HEADER.size + (head % self.capacity) * self.slot_size
+      kind, length = SLOT_HEADER.unpack_from(self._shm.buf, offset)
+      start = offset + SLOT_HEADER.size
+      if kind == INT:
+        message, = INT64.unpack_from(self._shm.buf, start)
+      elif kind == SENTINEL_KIND:
+        message = SENTINEL
+      else:
+        message = pickle.loads(self._shm.buf[start:start + length])
+      INT64.pack_into(self._shm.buf, 0, head + 1)
+    self._free_slots.release()
+    return message
+
+  def close(self):
+    self._shm.close()
+    if self._owner:
+      self._shm.unlink()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+    return False
+
+
+if __name__ == "__main__":
+  format = "%(asctime)s: %(message)s"
+  logging.basicConfig(
+      format=format,
+      level=logging.INFO,
+      datefmt="%H:%M:%S"
+  )
+
+  consumers, count = 4, 100_000
+  with SharedMemoryPipeline(capacity=1024) as pipeline:
+    processes = [
+        multiprocessing.Process(target=consumer, args=(pipeline, f"Consumer {n}")) for n in range(consumers)
+    ]
+    for process in processes:
+      process.start()
+    producer(pipeline, count)
+    logging.info("Main: %d messages produced, queue size=%d", count, pipeline.qsize())
+    # one sentinel per consumer process
+    for _ in range(consumers):
+      pipeline.set_message(SENTINEL, "Producer")
+    for process in processes:
+      process.join()
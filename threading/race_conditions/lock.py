@@ -1,5 +1,7 @@
+import collections
 import concurrent.futures
 import logging
+import random
 import threading
 import time
 
@@ -7,6 +9,10 @@ import time
 class FakeDatabase:
   def __init__(self):
     self.value = 0
+    # bumped by every write, optimistic_update uses it to tell whether the value changed since it was read
+    self.version = 0
+    # updates, conflicts (a compare_and_swap that failed) and retries of optimistic_update
+    self.stats = collections.Counter()
     # Allow only one thread at a time into the read-modify-write section of your code
     # Most common way to do this is called Lock in Python(in some other languages this same idea is called a mutex)
 
@@ -18,7 +24,7 @@ class FakeDatabase:
       # Thus, if one thread gets the lock but never gives it back the program will be stuck
     self._lock = threading.Lock()
 
-  def locked_update(self, name):
+  def locked_update(self, name, delay=0.1):
     logging.info("Thread %s: starting update", name)
     logging.debug("Thread %s about to lock", name)
     with self._lock:
@@ -26,13 +32,58 @@ class FakeDatabase:
       logging.debug("Thread %s has lock", name)
       local_copy = self.value
       local_copy += 1
-      time.sleep(0.1)
+      time.sleep(delay)
       self.value = local_copy
+      self.version += 1
       logging.debug("Thread %s about to release lock", name)
       # the locked_update method will keep the lock until all the process in the context manager(copy(assign), update, sleep, write to the database) is done
     logging.debug("Thread %s after release", name)
     logging.info("Thread %s: finishing update", name)
 
+  def read(self):
+    # value and version as one consistent snapshot, the lock is held for the two reads only
+    with self._lock:
+      return self.value, self.version
+
+  def compare_and_swap(self, expected_version, new_value):
+    # writes only if nobody else has written since expected_version was read,
+    # the lock is held for the comparison and the write, never across the work
+    with self._lock:
+      if self.version != expected_version:
+        self.stats["conflicts"] += 1
+        return False
+      self.value = new_value
+      self.version += 1
+      return True
+
+  def optimistic_update(self, name, delay=0.1, max_retries=None):
+    # The same read-modify-write as locked_update, but without holding the lock while working (the sleep),
+    # so updaters overlap; when another write got in between, compare_and_swap fails and the update starts over
+    logging.info("Thread %s: starting optimistic update", name)
+    attempt = 0
+    while True:
+      local_copy, version = self.read()
+      local_copy += 1
+      time.sleep(delay)
+      if self.compare_and_swap(version, local_copy):
+        break
+      attempt += 1
+      logging.debug("Thread %s: conflict on version %d, retrying", name, version)
+      if max_retries is not None and attempt > max_retries:
+        raise RuntimeError(f"Thread {name}: gave up after {max_retries} retries")
+      # a short random pause so the updaters that just collided don't collide again in lockstep
+      time.sleep(random.uniform(0, delay / 10))
+    # the counters are shared, so they are updated under the lock as well
+    with self._lock:
+      self.stats["updates"] += 1
+      self.stats["retries"] += attempt
+    logging.info("Thread %s: finishing optimistic update after %d retries", name, attempt)
+
+  def conflict_rate(self):
+    # the fraction of compare_and_swap calls that failed
+    attempts = self.stats["updates"] + self.stats["conflicts"]
+    return self.stats["conflicts"] / attempts if attempts else 0.0
+
 
 if __name__ == "__main__":
   format = "%(asctime)s: %(message)s"
@@ -82,3 +133,20 @@ if __name__ == "__main__":
     # 2) A design issue where a utility function needs to be called by functions that might or might not already have the Lock
       # Python threading has a second object, called RLock
       # RLock allows a thread to .acquire() an RLock multiple times before it calls .release()
+
+  # Optimistic concurrency
+  # optimistic_update reads value and version, works without the lock and writes with compare_and_swap,
+  # which fails if another thread wrote in the meantime; the update is then retried with a fresh read
+  database = FakeDatabase()
+  with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+    for index in range(2):
+      executor.submit(database.optimistic_update, index)
+  logging.info(
+      "Optimistic update. Ending value is %d, conflict rate %.0f%%, %d retries.",
+      database.value, database.conflict_rate() * 100, database.stats["retries"],
+  )
+  # 19:18:16: Thread 0: starting optimistic update
+  # 19:18:16: Thread 1: starting optimistic update
+  # 19:18:16: Thread 0: finishing optimistic update after 0 retries
+  # 19:18:16: Thread 1: finishing optimistic update after 1 retries
+  # 19:18:16: Optimistic update. Ending value is 2, conflict rate 33%, 1 retries.
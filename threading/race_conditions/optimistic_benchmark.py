@@ -0,0 +1,67 @@
+import argparse
+import logging
+import random
+import statistics
+import threading
+import time
+
+import lock
+
+
+def run(mode, threads, updates, delay, think):
+  database = lock.FakeDatabase()
+  latencies = []
+
+  def work(name):
+    pace = random.Random(name)
+    for _ in range(updates):
+      # the work each thread does between updates, the longer it is the less often updates overlap
+      time.sleep(pace.expovariate(1 / think) if think else 0)
+      start = time.perf_counter()
+      if mode == "locked":
+        database.locked_update(name, delay)
+      else:
+        database.optimistic_update(name, delay)
+      latencies.append(time.perf_counter() - start)
+
+  workers = [threading.Thread(target=work, args=(n,)) for n in range(threads)]
+  start = time.perf_counter()
+  for worker in workers:
+    worker.start()
+  for worker in workers:
+    worker.join()
+  elapsed = time.perf_counter() - start
+  assert database.value == threads * updates
+  return {
+      "updates/s": threads * updates / elapsed,
+      "p50 ms": statistics.median(latencies) * 1e3,
+      "p95 ms": statistics.quantiles(latencies, n=20)[-1] * 1e3,
+      "conflict rate": database.conflict_rate(),
+      "retries/update": database.stats["retries"] / (threads * updates),
+  }
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--threads", type=int, default=8)
+  parser.add_argument("--updates", type=int, default=20, help="updates per thread")
+  parser.add_argument("--delay", type=float, default=0.005, help="seconds between the read and the write of an update")
+  ns = parser.parse_args()
+  logging.basicConfig(level=logging.WARNING)
+
+  print(f"{'contention':<10} {'mode':<10} {'updates/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'conflict rate':>14} {'retries/update':>15}")
+  # low: the threads mostly do other work and rarely update at the same time, high: they update back to back
+  for contention, think in (("low", ns.delay * ns.threads * 10), ("high", 0.0)):
+    for mode in ("locked", "optimistic"):
+      result = run(mode, ns.threads, ns.updates, ns.delay, think)
+      print(
+          f"{contention:<10} {mode:<10} {result['updates/s']:>10.1f} {result['p50 ms']:>8.1f} {result['p95 ms']:>8.1f}"
+          f" {result['conflict rate']:>14.0%} {result['retries/update']:>15.2f}"
+      )
+  # contention mode        updates/s   p50 ms   p95 ms  conflict rate  retries/update
+  # low        locked           15.2      5.3     12.5             0%            0.00
+  # low        optimistic       15.2      5.3     11.0             8%            0.09
+  # high       locked          178.5     42.2     49.9             0%            0.00
+  # high       optimistic      181.4      5.2    254.2            79%            3.82
+  # Optimistic never holds the lock across the work, so at low contention it costs a few retries and nothing else;
+  # at high contention most compare_and_swap calls fail, the median update is fast but the unlucky ones retry many times
@@ -0,0 +1,74 @@
+import argparse
+import random
+import threading
+import time
+
+import sharded_counter
+
+
+def run_threads(threads, target):
+  workers = [threading.Thread(target=target, args=(n,)) for n in range(threads)]
+  start = time.perf_counter()
+  for worker in workers:
+    worker.start()
+  for worker in workers:
+    worker.join()
+  return time.perf_counter() - start
+
+
+def counter_rate(counter, threads, increments):
+  def work(_):
+    for _ in range(increments):
+      counter.increment()
+
+  elapsed = run_threads(threads, work)
+  assert counter.value == threads * increments
+  return threads * increments / elapsed
+
+
+def store_rate(stripes, threads, updates, records, delay, flush_every=None):
+  database = sharded_counter.StripedDatabase(stripes, delay)
+
+  def work(name):
+    keys = random.Random(name).choices(range(records), k=updates)
+    if flush_every is None:
+      for key in keys:
+        database.locked_update(name, key)
+    else:
+      with database.batch(flush_every) as add:
+        for key in keys:
+          add(key)
+
+  elapsed = run_threads(threads, work)
+  assert sum(database.records.values()) == threads * updates
+  return threads * updates / elapsed
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+  parser.add_argument("--increments", type=int, default=50_000)
+  parser.add_argument("--updates", type=int, default=200, help="record updates per thread")
+  parser.add_argument("--records", type=int, default=1000)
+  parser.add_argument("--delay", type=float, default=0.001, help="seconds a write holds its record")
+  ns = parser.parse_args()
+
+  print(f"{'threads':>7} {'locked counter':>15} {'sharded counter':>16} {'global lock':>12} {'striped':>10} {'batched':>10}")
+  for threads in ns.threads:
+    rates = [
+        counter_rate(sharded_counter.LockedCounter(), threads, ns.increments),
+        counter_rate(sharded_counter.ShardedCounter(), threads, ns.increments),
+        # one stripe is the single global lock of FakeDatabase
+        store_rate(1, threads, ns.updates, ns.records, ns.delay),
+        store_rate(64, threads, ns.updates, ns.records, ns.delay),
+        store_rate(64, threads, ns.updates, ns.records, ns.delay, flush_every=100),
+    ]
+    print(f"{threads:>7} {rates[0]:>15,.0f} {rates[1]:>16,.0f} {rates[2]:>12,.0f} {rates[3]:>10,.0f} {rates[4]:>10,.0f}")
+  # threads  locked counter  sharded counter  global lock    striped    batched
+  #       1       1,449,979        2,789,968          877        878      1,740
+  #       2       1,496,391        2,920,372          870      1,655      3,238
+  #       4       1,611,863        4,087,942          864      3,409      5,805
+  #       8       2,172,813        4,025,695          868      5,969     11,080
+  #      16       2,011,084        4,321,183          872     11,466     20,740
+  #      32       1,595,055        2,872,746          848     19,028     32,729
+  # The global lock stays at 1 / delay updates per second however many threads there are
@@ -0,0 +1,147 @@
+import collections
+import concurrent.futures
+import contextlib
+import logging
+import threading
+import time
+
+
+class LockedCounter:
+  """
+  The baseline, one lock around every increment like FakeDatabase.locked_update.
+  """
+  def __init__(self):
+    self._value = 0
+    self._lock = threading.Lock()
+
+  def increment(self, amount=1):
+    with self._lock:
+      self._value += amount
+
+  @property
+  def value(self):
+    with self._lock:
+      return self._value
+
+
+class ShardedCounter:
+  """
+  A counter with one shard per thread, increments never take a lock and reads add the shards up.
+  """
+  def __init__(self):
+    # each thread only ever writes its own shard, so `shard[0] += amount` doesn't race with anything,
+    # the lock is only taken the first time a thread registers its shard
+    self._local = threading.local()
+    self._shards = []
+    self._lock = threading.Lock()
+
+  def _shard(self):
+    shard = getattr(self._local, "shard", None)
+    if shard is None:
+      shard = self._local.shard = [0]
+      with self._lock:
+        self._shards.append(shard)
+    return shard
+
+  def increment(self, amount=1):
+    self._shard()[0] += amount
+
+  @property
+  def value(self):
+    # Aggregated on read, exact once the writers are done, while they are running it is a value that lies
+    # between the count at the start and the count at the end of the read
+    with self._lock:
+      shards = list(self._shards)
+    return sum(shard[0] for shard in shards)
+
+
+class StripedDatabase:
+  """
+  FakeDatabase with many records, each guarded by one of a fixed set of striped locks instead of one global lock.
+  """
+  def __init__(self, stripes=64, delay=0.0):
+    self.records = collections.defaultdict(int)
+    # updates of records in different stripes don't wait on each other, a fixed number of locks
+    # keeps the memory bounded however many records there are
+    self._locks = [threading.Lock() for _ in range(stripes)]
+    # stands in for the time.sleep(0.1) of FakeDatabase, the time a write holds the record
+    self.delay = delay
+
+  def _lock_for(self, key):
+    return self._locks[hash(key) % len(self._locks)]
+
+  def locked_update(self, name, key, amount=1):
+    logging.debug("Thread %s about to lock record %s", name, key)
+    with self._lock_for(key):
+      local_copy = self.records[key]
+      local_copy += amount
+      if self.delay:
+        time.sleep(self.delay)
+      self.records[key] = local_copy
+
+  def commit(self, deltas):
+    # applies many deltas taking every stripe once, in stripe order so two commits can't deadlock each other
+    by_stripe = collections.defaultdict(list)
+    for key, amount in deltas.items():
+      by_stripe[hash(key) % len(self._locks)].append((key, amount))
+    for stripe in sorted(by_stripe):
+      with self._locks[stripe]:
+        for key, amount in by_stripe[stripe]:
+          self.records[key] += amount
+        if self.delay:
+          # one write round trip per stripe instead of one per update
+          time.sleep(self.delay)
+
+  @contextlib.contextmanager
+  def batch(self, flush_every=1000):
+    # with database.batch() as add: add(key) ... accumulates the deltas locally and commits them in batches
+    deltas = collections.Counter()
+    pending = 0
+
+    def add(key, amount=1):
+      nonlocal pending
+      deltas[key] += amount
+      pending += 1
+      if pending >= flush_every:
+        self.commit(deltas)
+        deltas.clear()
+        pending = 0
+
+    try:
+      yield add
+    finally:
+      # what is left is committed even when the block raised, nothing that was added is lost
+      if deltas:
+        self.commit(deltas)
+
+  def value(self, key):
+    with self._lock_for(key):
+      return self.records.get(key, 0)
+
+
+if __name__ == "__main__":
+  format = "%(asctime)s: %(message)s"
+  logging.basicConfig(
+      format=format,
+      level=logging.INFO,
+      datefmt="%H:%M:%S"
+  )
+
+  # race_problem.py with a counter that can't lose increments
+  counter = ShardedCounter()
+
+  def increment_counter(fake_value):
+    for _ in range(100):
+      counter.increment()
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=50) as executor:
+    executor.map(increment_counter, range(5000))
+  logging.info("ShardedCounter: %d, expected %d", counter.value, 5000 * 100)
+
+  database = StripedDatabase(stripes=64, delay=0.1)
+  with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+    # eight updates of records in different stripes, with one global lock they would take 0.8 seconds
+    start_time = time.time()
+    for index in range(8):
+      executor.submit(database.locked_update, index, index)
+  logging.info("StripedDatabase: 8 updates in %.2f seconds", time.time() - start_time)